@@ -20,7 +20,7 @@ def main():
     sim_test1.add_test(repo_test.file_regex_check(tester, "sim_tb_multicycle.log", "===== TEST PASSED =====",
         "tb_multicycle testbench check", error_on_match = False,
         error_msg = "tb_multicycle testbench failed"))
-    sim_test2 = tester.add_makefile_test("sim_tb_multicycle_bounds", ["riscv_multicycle.sv"], ["sim_tb_multicycle.log"])
+    sim_test2 = tester.add_makefile_test("sim_tb_multicycle_bounds", ["riscv_multicycle.sv"], ["sim_tb_multicycle_bounds.log"])
     sim_test2.add_test(repo_test.file_regex_check(tester, "sim_tb_multicycle_bounds.log", "===== TEST PASSED =====",
         "tb_multicycle_bounds testbench check", error_on_match = False,
         error_msg = "tb_multicycle_bounds testbench failed"))
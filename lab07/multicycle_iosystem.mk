@@ -24,7 +24,7 @@ MULTICYCLE_SOURCES = ../lab02/alu.sv ../lab03/regfile.sv \
 
 # Rule for analyzing all of the files needed for the multicycle iosystem and testbench
 analyze_multicycle_iosystem: analyze_iosystem $(MULTICYCLE_SOURCES)
-	xvlog -sv $(MULTICYCLE_SOURCES) -nolog --include $(INCLUDE_DIR)
+	xvlog -sv $(MULTICYCLE_SOURCES) -nolog --include $(INCLUDE_DIR) $(IOSYSTEM_LIB_OPTS)
 
 # Elaboration rule for the multicycle iosystem without a testbench.
 # Note that the debouncer is disabled for this simulation.
@@ -33,7 +33,7 @@ elab_multicycle_iosystem: analyze_multicycle_iosystem multicycle_iosystem_text.m
 		-debug typical -timescale 1ns/100ps \
 		-generic "TEXT_MEM=multicycle_iosystem_text.mem" \
 		-generic "USE_DEBOUNCER=0" \
-		-L unisims_ver glbl \
+		$(IOSYSTEM_LIB_OPTS) -L unisims_ver $(IOSYSTEM_LIB).glbl \
 
 # Simulation of top-level design without testbench using the template tcl file
 sim_multicycle_iosystem_tcl_template: elab_multicycle_iosystem
@@ -52,11 +52,31 @@ elab_tb_multicycle_io: analyze_multicycle_iosystem multicycle_iosystem_text.mem
 	xelab --nolog tb_multicycle_io -s tb_multicycle_io \
 		-debug typical -timescale 1ns/100ps \
 		-generic "TEXT_MEM=multicycle_iosystem_text.mem" \
-		-L unisims_ver glbl \
+		$(IOSYSTEM_LIB_OPTS) -L unisims_ver $(IOSYSTEM_LIB).glbl \
 
 sim_multicycle_iosystem: elab_tb_multicycle_io
 	xsim tb_multicycle_io --log sim_multicycle_iosystem.log --runall
 
+####################################################
+# Program Simulation Rules
+####################################################
+
+# Snapshot of the multicycle iosystem testbench without a memory file. The program is
+# selected when the simulation starts (TEXT_MEM plusarg) so the snapshot is only
+# elaborated again when a source file changes.
+MULTICYCLE_PROGRAM_SNAPSHOT = xsim.dir/tb_multicycle_io_program/xsimk
+$(MULTICYCLE_PROGRAM_SNAPSHOT): $(MULTICYCLE_SOURCES) $(IOSYSTEM_LIB_DIR)/.complete
+	xvlog -sv $(MULTICYCLE_SOURCES) -nolog --include $(INCLUDE_DIR) $(IOSYSTEM_LIB_OPTS)
+	xelab --nolog tb_multicycle_io -s tb_multicycle_io_program \
+		-debug typical -timescale 1ns/100ps \
+		$(IOSYSTEM_LIB_OPTS) -L unisims_ver $(IOSYSTEM_LIB).glbl
+
+# Simulate a program with the testbench snapshot (i.e., 'make sim_multicycle_program_example'
+# simulates example.s)
+sim_multicycle_program_%: $(MULTICYCLE_PROGRAM_SNAPSHOT) %_text.mem
+	xsim tb_multicycle_io_program --log sim_multicycle_program_$*.log --runall \
+		-testplusarg TEXT_MEM=$*_text.mem
+
 ####################################################
 # Implementation Rules
 ####################################################
@@ -70,5 +90,5 @@ multicycle_iosystem.bit: multicycle_iosystem.sv multicycle_iosystem_text.mem
 
 clean_iosystem:
 	rm -f multicycle_iosystem_text.mem multicycle_iosystem_text.txt multicycle_iosystem*.log
-	rm -f sim_multicycle_iosystem*.log
+	rm -f sim_multicycle_iosystem*.log sim_multicycle_program_*.log
 	rm -f multicycle_iosystem.bit multicycle_iosystem*.rpt
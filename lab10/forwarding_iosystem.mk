@@ -24,7 +24,7 @@ FORWARDING_SOURCES = ../lab02/alu.sv ../lab03/regfile.sv \
 
 # Rule for analyzing all of the files needed for the forwarding iosystem and testbench
 analyze_forwarding_iosystem: analyze_iosystem $(FORWARDING_SOURCES)
-	xvlog -sv $(FORWARDING_SOURCES) -nolog --include $(INCLUDE_DIR)
+	xvlog -sv $(FORWARDING_SOURCES) -nolog --include $(INCLUDE_DIR) $(IOSYSTEM_LIB_OPTS)
 
 # Elaboration rule for the forwarding iosystem without a testbench.
 # Note that the debouncer is disabled for this simulation.
@@ -34,7 +34,7 @@ elab_forwarding_iosystem: analyze_forwarding_iosystem forwarding_iosystem_text.m
 		-generic "TEXT_MEM=forwarding_iosystem_text.mem" \
 		-generic "DATA_MEM=forwarding_iosystem_data.mem" \
 		-generic "USE_DEBOUNCER=0" \
-		-L unisims_ver glbl \
+		$(IOSYSTEM_LIB_OPTS) -L unisims_ver $(IOSYSTEM_LIB).glbl \
 
 # Simulation of top-level design without testbench using the template tcl file
 sim_forwarding_iosystem_tcl_template: elab_forwarding_iosystem
@@ -48,6 +48,26 @@ sim_forwarding_iosystem_tcl: elab_forwarding_iosystem
 sim_forwarding_iosystem_tcl_gui: elab_forwarding_iosystem
 	xsim forwarding_iosystem --nolog -gui
 
+####################################################
+# Program Simulation Rules
+####################################################
+
+# Snapshot of the forwarding iosystem without memory files. The program is selected when
+# the simulation starts (TEXT_MEM/DATA_MEM plusargs) so the snapshot is only elaborated
+# again when a source file changes.
+FORWARDING_PROGRAM_SNAPSHOT = xsim.dir/forwarding_iosystem_program/xsimk
+$(FORWARDING_PROGRAM_SNAPSHOT): $(FORWARDING_SOURCES) $(IOSYSTEM_LIB_DIR)/.complete
+	xvlog -sv $(FORWARDING_SOURCES) -nolog --include $(INCLUDE_DIR) $(IOSYSTEM_LIB_OPTS)
+	xelab forwarding_iosystem -s forwarding_iosystem_program --nolog  \
+		-debug typical -timescale 1ns/100ps \
+		-generic "USE_DEBOUNCER=0" \
+		$(IOSYSTEM_LIB_OPTS) -L unisims_ver $(IOSYSTEM_LIB).glbl
+
+# Simulate a program with the snapshot (i.e., 'make sim_forwarding_program_defuse' simulates defuse.s)
+sim_forwarding_program_%: $(FORWARDING_PROGRAM_SNAPSHOT) %_text.mem %_data.mem
+	xsim forwarding_iosystem_program --log sim_forwarding_program_$*.log -tclbatch vga_sim.tcl \
+		-testplusarg TEXT_MEM=$*_text.mem -testplusarg DATA_MEM=$*_data.mem
+
 ####################################################
 # Implementation Rules
 ####################################################
@@ -69,6 +89,6 @@ forwarding_defuse.bit: forwarding_iosystem.bit defuse_text.mem defuse_data.mem
 clean_iosystem:
 	rm -f forwarding_iosystem_*.mem forwarding_iosystem_text.txt forwarding_iosystem*.log
 	rm -f defuse_*.mem defuse_text.txt
-	rm -f sim_forwarding_iosystem*.log
+	rm -f sim_forwarding_iosystem*.log sim_forwarding_program_*.log
 	rm -f forwarding_iosystem.bit forwarding_iosystem.dcp forwarding_iosystem*.rpt
 	rm -f forwarding_defuse.bit
@@ -21,7 +21,7 @@ FINAL_SOURCES = ../lab02/alu.sv ../lab03/regfile.sv \
 
 # Rule for analyzing all of the files needed for the forwarding iosystem and testbench
 analyze_final_iosystem: analyze_iosystem $(FINAL_SOURCES)
-	xvlog -sv $(FINAL_SOURCES) -nolog --include $(INCLUDE_DIR)
+	xvlog -sv $(FINAL_SOURCES) -nolog --include $(INCLUDE_DIR) $(IOSYSTEM_LIB_OPTS)
 
 # Elaboration rule for the forwarding iosystem without a testbench.
 # Note that the debouncer is disabled for this simulation.
@@ -31,7 +31,7 @@ elab_final_iosystem: analyze_final_iosystem final_iosystem_text.mem final_iosyst
 		-generic "TEXT_MEM=final_iosystem_text.mem" \
 		-generic "DATA_MEM=final_iosystem_data.mem" \
 		-generic "USE_DEBOUNCER=0" \
-		-L unisims_ver glbl \
+		$(IOSYSTEM_LIB_OPTS) -L unisims_ver $(IOSYSTEM_LIB).glbl \
 
 # Simulation of top-level design without testbench using the template tcl file
 sim_final_iosystem_tcl: elab_final_iosystem
@@ -41,6 +41,26 @@ sim_final_iosystem_tcl: elab_final_iosystem
 sim_final_iosystem_tcl_gui: elab_final_iosystem
 	xsim riscv_io_final --nolog -gui
 
+####################################################
+# Program Simulation Rules
+####################################################
+
+# Snapshot of the final iosystem without memory files. The program is selected when the
+# simulation starts (TEXT_MEM/DATA_MEM plusargs) so the snapshot is only elaborated again
+# when a source file changes.
+FINAL_PROGRAM_SNAPSHOT = xsim.dir/riscv_io_final_program/xsimk
+$(FINAL_PROGRAM_SNAPSHOT): $(FINAL_SOURCES) $(IOSYSTEM_LIB_DIR)/.complete
+	xvlog -sv $(FINAL_SOURCES) -nolog --include $(INCLUDE_DIR) $(IOSYSTEM_LIB_OPTS)
+	xelab riscv_io_final -s riscv_io_final_program --nolog  \
+		-debug typical -timescale 1ns/100ps \
+		-generic "USE_DEBOUNCER=0" \
+		$(IOSYSTEM_LIB_OPTS) -L unisims_ver $(IOSYSTEM_LIB).glbl
+
+# Simulate a program with the snapshot (i.e., 'make sim_final_program_examples' simulates examples.s)
+sim_final_program_%: $(FINAL_PROGRAM_SNAPSHOT) %_text.mem %_data.mem
+	xsim riscv_io_final_program --log sim_final_program_$*.log -tclbatch final_sim.tcl \
+		-testplusarg TEXT_MEM=$*_text.mem -testplusarg DATA_MEM=$*_data.mem
+
 ####################################################
 # Implementation Rules
 ####################################################
@@ -52,10 +72,16 @@ riscv_io_final.bit: riscv_io_final.sv final_iosystem_text.mem final_iosystem_dat
 # Rule that will generate the .dcp file if the .bit file is out of date.
 riscv_io_final.dcp: riscv_io_final.bit
 
+# Command for running load_mem.tcl commands. Each command starts a new Vivado and reads
+# the checkpoint. Use the Vivado server to keep Vivado and the checkpoint open between the
+# memory updates (a batch Vivado is used if the server is not running):
+#   python3 ../resources/vivado_server.py serve &
+#   make background.bit LOAD_MEM="python3 ../resources/vivado_server.py load_mem"
+LOAD_MEM ?= vivado -mode batch -source ../resources/load_mem.tcl -tclargs
+
 # Genrates a bitfile with a new font memory image. The .dcp file is also updated with the new memory image.
 font.bit: riscv_io_final.dcp
-	vivado -mode batch -source ../resources/load_mem.tcl \
-		-tclargs updateFont riscv_io_final.dcp game_font_mem.txt font.bit font.dcp
+	$(LOAD_MEM) updateFont riscv_io_final.dcp game_font_mem.txt font.bit font.dcp
 
 font.dcp: font.bit
 
@@ -63,8 +89,7 @@ background_game_template.mem: background_game_template.txt
 	python3 ../resources/generate_background.py $< $@
 
 background.bit: font.dcp background_game_template.mem
-	vivado -mode batch -source ../resources/load_mem.tcl \
-		-tclargs updateBackground font.dcp background_game_template.mem background.bit background.dcp
+	$(LOAD_MEM) updateBackground font.dcp background_game_template.mem background.bit background.dcp
 
 ####################################################
 # Clean Rules
@@ -72,7 +97,7 @@ background.bit: font.dcp background_game_template.mem
 
 clean_iosystem:
 	rm -f final_iosystem*.mem final_iosystem_text.txt
-	rm -f sim_final_iosystem*.log
+	rm -f sim_final_iosystem*.log sim_final_program_*.log
 	rm -f riscv_io_final*.log
 	rm -f riscv_io_final*.rpt
 	rm -f riscv_io_final.bit riscv_io_final.dcp font.bit font.dcp background.bit background.dcp
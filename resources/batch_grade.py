@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+
+'''
+Grades the submissions of many students for a single lab.
+
+Each student repository is graded by running the lab passoff script from this
+repository (not the copy in the student repository) in its own process with the
+student lab directory as the working directory. Repositories are graded
+concurrently with a limit on the number of worker processes and a timeout for
+each repository. The results of every repository are gathered into a single
+JSON report and a summary is printed at the end.
+
+The repositories to grade are given with a roster file (one repository path per
+line, optionally preceded by a name) or with a directory that contains the
+student clones. Any arguments that are not recognized by this script are passed
+to the passoff script (the default is '--full_check').
+
+Submissions with identical inputs for a makefile rule can share results through
+a shared result cache ('--shared_cache', passed to the passoff script).
+
+The passoff of each repository (and every tool it runs) is limited in memory, output,
+open files and, optionally, CPU time and file size so a single runaway submission does
+not starve the other repositories that are graded at the same time (see the '--*_limit'
+options, 0 for no limit). The default memory limit is only applied when the passoff can run
+in a cgroup (an address space limit would stop the JVM of the tools), and the passoff is run
+with '--output tail' unless another '--output' is given so the output limit is not reached by
+the echoed output of the tools (their logs have the full output).
+
+Example:
+  batch_grade.py lab11 --repos_dir /tmp/lab11_clones --workers 8 --timeout 3600
+  batch_grade.py lab11 --roster roster.txt --full_check --shared_cache /tmp/ecen423_results
+'''
+
+import argparse
+import concurrent.futures
+import json
+import os
+import pathlib
+import sys
+import time
+
+import process_runner
+from repo_test_suite import TermColor
+
+# Top of the starter code repository (one level above the resources directory)
+STARTER_ROOT_PATH = pathlib.Path(__file__).resolve().parent.parent
+
+# Memory limit of each repository when the passoff can be run in a cgroup
+DEFAULT_MEMORY_LIMIT_MB = 16 * 1024
+
+class graded_repo():
+    ''' The result of grading a single student repository.
+    name: name used in the report
+    repo_path: path of the student repository
+    status: the overall result of the test suite (SUCCESS, WARNING, ERROR) or TIMEOUT (LIMIT when a resource limit stopped it)
+    '''
+    def __init__(self, name, repo_path):
+        self.name = name
+        self.repo_path = repo_path
+        self.status = None
+        self.return_code = None
+        self.duration = 0
+        self.log_filepath = None
+        self.results = None
+        self.msg = None
+        # CPU time and peak memory of the passoff script and of the tools it ran
+        self.usage = None
+
+    def to_dict(self):
+        ''' Returns a dictionary summary of the graded repository for the report '''
+        return {
+            "name" : self.name,
+            "repo" : str(self.repo_path),
+            "status" : self.status,
+            "return_code" : self.return_code,
+            "duration" : round(self.duration, 2),
+            "log" : str(self.log_filepath) if self.log_filepath else None,
+            "msg" : self.msg,
+            "usage" : self.usage.to_dict() if self.usage else None,
+            "results" : self.results,
+        }
+
+def read_roster(roster_filename):
+    ''' Read a roster file. Each non-empty line has a repository path, optionally preceded
+    by a name ('name path'). Lines starting with '#' are ignored. Relative paths are relative
+    to the directory of the roster file. Returns a list of (name, path) tuples. '''
+    roster_path = pathlib.Path(roster_filename).resolve()
+    repos = []
+    with open(roster_path) as fp:
+        for line in fp:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            fields = line.split()
+            repo_path = roster_path.parent / fields[-1]
+            name = fields[0] if len(fields) > 1 else repo_path.name
+            repos.append((name, repo_path.resolve()))
+    return repos
+
+def find_repos(repos_dir):
+    ''' Returns a list of (name, path) tuples for the git repositories in a directory '''
+    repos = []
+    for repo_path in sorted(pathlib.Path(repos_dir).resolve().iterdir()):
+        if (repo_path / ".git").exists():
+            repos.append((repo_path.name, repo_path))
+    return repos
+
+def grade_repo(graded, lab_name, suite_args, output_path, timeout_seconds, limits = None):
+    ''' Grade a single repository by running the lab passoff script in a separate process.
+    The output of the passoff script is saved in a log file in the output path.
+    limits: process_runner.resource_limits for the passoff and the tools it runs '''
+    passoff_script = STARTER_ROOT_PATH / lab_name / "passoff.py"
+    lab_path = graded.repo_path / lab_name
+    if not lab_path.is_dir():
+        graded.status = "ERROR"
+        graded.msg = f"Lab directory {lab_path} does not exist"
+        return graded
+    result_filepath = output_path / f"{graded.name}_result.json"
+    graded.log_filepath = output_path / f"{graded.name}.log"
+    if result_filepath.exists():
+        result_filepath.unlink()
+    cmd = [sys.executable, str(passoff_script), "--repo", str(graded.repo_path), "--nocolor",
+           "--result_file", str(result_filepath)] + suite_args
+    start_time = time.time()
+    # Everything the passoff starts (including the tools in their own sessions) is stopped on timeout
+    runner = process_runner.process_runner(cmd, cwd=lab_path, sinks=[process_runner.file_sink(graded.log_filepath)],
+                                           timeout_seconds=timeout_seconds, limits=limits)
+    graded.return_code = runner.run()
+    graded.usage = runner.usage
+    if runner.timed_out:
+        graded.status = "TIMEOUT"
+        graded.msg = f"Grading exceeded {timeout_seconds} seconds"
+    elif runner.limit_msg is not None:
+        graded.status = "LIMIT"
+        graded.msg = runner.limit_msg
+    graded.duration = time.time() - start_time
+    if graded.status is None:
+        if result_filepath.exists():
+            try:
+                with open(result_filepath) as fp:
+                    result_data = json.load(fp)
+                graded.results = result_data["tests"]
+                graded.status = result_data["result"]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                graded.results = None
+                graded.status = "ERROR"
+                graded.msg = f"Invalid result file {result_filepath}: {e!r}"
+        else:
+            graded.status = "ERROR"
+            graded.msg = f"No results generated (return code {graded.return_code})"
+    return graded
+
+def grading_limits(args):
+    ''' Returns the resource limits given on the command line (0 is no limit) '''
+    def limit(value, scale = 1):
+        return value * scale if value else None
+    memory_limit_mb = args.memory_limit_mb
+    if memory_limit_mb is None:
+        memory_limit_mb = DEFAULT_MEMORY_LIMIT_MB if process_runner.cgroup_parent_path() is not None else 0
+    return process_runner.resource_limits(memory_bytes = limit(memory_limit_mb, 1 << 20),
+                                          cpu_seconds = limit(args.cpu_limit_seconds),
+                                          open_files = limit(args.open_files_limit),
+                                          file_bytes = limit(args.file_limit_mb, 1 << 20),
+                                          output_bytes = limit(args.output_limit_mb, 1 << 20))
+
+def print_summary(graded_repos):
+    ''' Print a one line summary for each repository '''
+    colors = {"SUCCESS" : TermColor.GREEN, "WARNING" : TermColor.YELLOW}
+    for graded in graded_repos:
+        color = colors.get(graded.status, TermColor.RED)
+        msg = f" ({graded.msg})" if graded.msg else ""
+        usage = f" {graded.usage}" if graded.usage else ""
+        print(f"{color}{graded.name:30} {graded.status:10} {graded.duration:8.1f}s{usage}{msg}{TermColor.END}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade many student repositories for a lab. " +
+                                     "Unrecognized arguments are passed to the lab passoff script.",
+                                     # Passoff options like '--output' are not abbreviations of the options below
+                                     allow_abbrev=False)
+    parser.add_argument("lab", type=str, help="Name of the lab to grade (i.e., lab11)")
+    repo_group = parser.add_mutually_exclusive_group(required=True)
+    repo_group.add_argument("--roster", type=str, help="File with the list of repository paths to grade")
+    repo_group.add_argument("--repos_dir", type=str, help="Directory containing the repositories to grade")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Maximum number of repositories graded at the same time")
+    parser.add_argument("--timeout", type=int, default=60 * 60,
+                        help="Maximum number of seconds for grading a single repository")
+    parser.add_argument("--memory_limit_mb", type=int,
+                        help="Memory limit of each repository (cgroup, or address space of each process). " +
+                        f"The default is {DEFAULT_MEMORY_LIMIT_MB} when cgroups can be used and no limit otherwise")
+    parser.add_argument("--cpu_limit_seconds", type=int, default=0, help="CPU time limit of each process")
+    parser.add_argument("--output_limit_mb", type=int, default=512, help="Limit of the passoff output of each repository")
+    parser.add_argument("--open_files_limit", type=int, default=4096, help="Open file limit of each process")
+    parser.add_argument("--file_limit_mb", type=int, default=0, help="Size limit of each file written")
+    parser.add_argument("--output_dir", type=str, help="Directory for the logs and report (default is batch_<lab>)")
+    parser.add_argument("--report", type=str, default="report.json", help="Filename of the combined report")
+    args, suite_args = parser.parse_known_args()
+    if len(suite_args) == 0:
+        suite_args = ["--full_check"]
+    # The output limit applies to the passoff output (the tool logs are not limited)
+    if not any(arg == "--output" or arg.startswith("--output=") for arg in suite_args):
+        suite_args = suite_args + ["--output", "tail"]
+
+    if not (STARTER_ROOT_PATH / args.lab / "passoff.py").exists():
+        print(f"No passoff script for lab '{args.lab}'")
+        return 1
+    if args.roster:
+        repos = read_roster(args.roster)
+    else:
+        repos = find_repos(args.repos_dir)
+    output_path = pathlib.Path(args.output_dir if args.output_dir else f"batch_{args.lab}").resolve()
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    limits = grading_limits(args)
+    print(f"Grading {len(repos)} repositories for {args.lab} with {args.workers} workers (limits: {limits})")
+    graded_repos = [graded_repo(name, path) for name, path in repos]
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(grade_repo, graded, args.lab, suite_args, output_path, args.timeout, limits) : graded
+                   for graded in graded_repos}
+        for future in concurrent.futures.as_completed(futures):
+            graded = futures[future]
+            # A failure while grading one repository is recorded in its report entry
+            try:
+                future.result()
+            except Exception as e:
+                graded.status = "ERROR"
+                graded.msg = f"Grading failed: {e!r}"
+            print(f" {graded.name}: {graded.status} ({graded.duration:.1f}s)")
+
+    report = {
+        "lab" : args.lab,
+        "suite_args" : suite_args,
+        "limits" : str(limits),
+        "duration" : round(time.time() - start_time, 2),
+        "repos" : [graded.to_dict() for graded in graded_repos],
+    }
+    report_filepath = output_path / args.report
+    with open(report_filepath, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print_summary(graded_repos)
+    print(f"Report written to {report_filepath}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
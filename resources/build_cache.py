@@ -0,0 +1,515 @@
+#!/usr/bin/python3
+
+'''
+Caching of makefile test results based on the content of their inputs.
+
+A build manifest records the content hash of every input of a make rule:
+- the source files the rule depends on (found from the make rule database),
+- the files referenced by the commands of the rule that are tracked by git
+  (i.e., Tcl scripts, include directories, the RARS jar file),
+- the makefiles and makefile fragments that were read (i.e., iosystem.mk),
+- the files read by the Tcl scripts run by the commands ('vivado -source',
+  'xsim -tclbatch'): the scripts they source and the files of their read_verilog,
+  read_xdc, add_files, ... commands and include directories (recursively),
+- the declared input files of the test, and
+- the tools that would be used (the resolved location of each executable).
+
+When a rule is run again with a manifest that matches the manifest of the last
+successful run, the rule is skipped and the saved build artifacts are restored.
+No manifest is created (the rule is always run) when a Tcl script reads a file
+whose name is computed ('read_verilog $file', 'source [file join ...]') unless
+the file names are given on the command line with '-tclargs'.
+'''
+
+import hashlib
+import json
+import os
+import pathlib
+import shlex
+import shutil
+import subprocess
+import time
+import uuid
+
+import make_database
+
+# Executables whose location identifies the version of the tools used by the rules
+TOOL_EXECUTABLES = ["make", "vivado", "xvlog", "xelab", "xsim", "java", "python3"]
+TOOL_ENVIRONMENT_VARIABLES = ["XILINX_VIVADO"]
+
+# Version of the manifest format (change to invalidate existing caches)
+MANIFEST_VERSION = 2
+
+# Options of the tool commands that run a Tcl script
+TCL_SCRIPT_OPTIONS = ["-source", "-tclbatch"]
+# Tcl commands whose arguments are files read by the tool ('source' files are also scanned)
+TCL_FILE_COMMANDS = ["source", "read_verilog", "read_vhdl", "read_xdc", "read_mem", "read_edif",
+                     "read_ip", "read_checkpoint", "open_checkpoint", "add_files"]
+# Options of the Tcl file commands that are followed by a value (not a file)
+TCL_VALUE_OPTIONS = ["-library", "-fileset", "-of_objects", "-cells", "-part", "-mode"]
+# Options and properties followed by a list of include directories
+TCL_INCLUDE_DIR_OPTIONS = ["-include_dirs", "include_dirs"]
+
+# Files created by the tools that are never saved as build artifacts
+SCRATCH_FILE_PREFIXES = ("xvlog.", "xelab.", "xsim.", "webtalk", "vivado", "usage_statistics")
+
+def file_digest(filepath):
+    ''' Returns the sha256 hex digest of the contents of a file '''
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def tool_versions():
+    ''' Returns a dictionary that identifies the tools that are used by the make rules.
+    The resolved path of an executable includes the installation version for the
+    Xilinx tools (i.e., /tools/Xilinx/Vivado/2024.1/bin/vivado) '''
+    tools = {}
+    for executable in TOOL_EXECUTABLES:
+        path = shutil.which(executable)
+        tools[executable] = os.path.realpath(path) if path is not None else None
+    for variable in TOOL_ENVIRONMENT_VARIABLES:
+        tools[variable] = os.environ.get(variable)
+    return tools
+
+def command_words(command):
+    ''' Returns the words of a shell command '''
+    try:
+        # Separate the shell operators (';', '&&', '>', ...) from the words
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        return list(lexer)
+    except ValueError:
+        return command.split()
+
+def command_tokens(command):
+    ''' Returns the words of a command that could be filenames '''
+    tokens = set()
+    for word in command_words(command):
+        tokens.add(word)
+        # Options of the form NAME=value or --option=value
+        if "=" in word:
+            tokens.add(word.split("=", 1)[1])
+    return set(token for token in tokens if token != "" and not token.startswith("-"))
+
+def tcl_words(line):
+    ''' Split a Tcl command into its words (the braces and quotes of a word are removed) '''
+    words = []
+    position = 0
+    while position < len(line):
+        if line[position].isspace():
+            position += 1
+            continue
+        if line[position] == "{":
+            depth = 0
+            end = position
+            while end < len(line):
+                depth += {"{" : 1, "}" : -1}.get(line[end], 0)
+                if depth == 0:
+                    break
+                end += 1
+            words.append(line[position + 1:end])
+            position = end + 1
+        elif line[position] == '"':
+            end = line.find('"', position + 1)
+            end = len(line) if end < 0 else end
+            words.append(line[position + 1:end])
+            position = end + 1
+        else:
+            end = position
+            while end < len(line) and not line[end].isspace():
+                end += 1
+            words.append(line[position:end])
+            position = end
+    return words
+
+def tcl_commands(script_text):
+    ''' Returns the words of each command of a Tcl script (comments are skipped and
+    continued lines are joined) '''
+    commands = []
+    for line in script_text.replace("\\\n", " ").splitlines():
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        commands.append(tcl_words(line))
+    return commands
+
+def is_computed_name(word):
+    ''' Returns True if a Tcl word is computed when the script runs (variables, commands, globs) '''
+    return any(c in word for c in "$[*?")
+
+def tcl_script_inputs(working_path, scripts, computed_names_allowed = False):
+    ''' Returns the files read by Tcl scripts (run in the working path) and the scripts they
+    source, recursively. The paths are relative to the working path. Returns None if a script
+    reads a file whose name is computed (unless computed_names_allowed). '''
+    working_path = pathlib.Path(working_path)
+    inputs = set()
+    pending = list(scripts)
+    while pending:
+        script = os.path.normpath(pending.pop())
+        if script in inputs:
+            continue
+        inputs.add(script)
+        try:
+            script_text = (working_path / script).read_text(errors="replace")
+        except OSError:
+            # A missing script is an input (the rule changes when it is created)
+            continue
+        for words in tcl_commands(script_text):
+            names = []
+            if words[0] in TCL_FILE_COMMANDS:
+                skip_value = False
+                for word in words[1:]:
+                    if skip_value:
+                        skip_value = False
+                    elif word in TCL_VALUE_OPTIONS:
+                        skip_value = True
+                    elif not word.startswith("-"):
+                        names += word.split()
+            for index, word in enumerate(words[:-1]):
+                if word in TCL_INCLUDE_DIR_OPTIONS:
+                    names += words[index + 1].split()
+            for name in names:
+                if is_computed_name(name):
+                    if computed_names_allowed:
+                        continue
+                    return None
+                if words[0] == "source":
+                    pending.append(name)
+                elif (working_path / name).is_dir():
+                    for root, _, filenames in os.walk(working_path / name):
+                        inputs.update(os.path.relpath(os.path.join(root, filename), working_path)
+                                      for filename in filenames)
+                else:
+                    inputs.add(os.path.normpath(name))
+    return inputs
+
+def joined_commands(commands):
+    ''' Join the recipe lines continued with a backslash into one command '''
+    joined = []
+    continued = False
+    for command in commands:
+        if continued:
+            joined[-1] = joined[-1][:-1] + " " + command.strip()
+        else:
+            joined.append(command.rstrip())
+        joined[-1] = joined[-1].rstrip()
+        continued = joined[-1].endswith("\\")
+    return joined
+
+def command_scripts(command):
+    ''' Returns the Tcl scripts run by a command and True if the command gives the script
+    arguments ('-tclargs') '''
+    words = command_words(command)
+    scripts = set(word for word in words if word.endswith(".tcl"))
+    for index, word in enumerate(words[:-1]):
+        if word in TCL_SCRIPT_OPTIONS:
+            scripts.add(words[index + 1])
+    return scripts, "-tclargs" in words
+
+def tracked_files(working_path, names):
+    ''' Returns the subset of files (and files within directories) in the list of names
+    that are tracked by git. Paths are returned relative to the working path. Returns
+    None if git cannot be used. '''
+    if len(names) == 0:
+        return set()
+    cmd = ["git", "ls-files", "-z", "--"] + sorted(names)
+    try:
+        proc = subprocess.run(cmd, cwd=working_path, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return set(name for name in proc.stdout.decode().split("\0") if name != "")
+
+class build_manifest():
+    ''' The inputs of a make rule and their content hashes.
+    rule: the make rule
+    inputs: dictionary of content hashes keyed by path relative to the working path
+      (None for an input that does not exist)
+    generated: the targets in the rule closure that are built by make
+    tools: the dictionary from tool_versions()
+    '''
+    def __init__(self, rule):
+        self.rule = rule
+        self.inputs = {}
+        self.generated = set()
+        self.tools = {}
+
+    def to_dict(self):
+        ''' Returns the manifest as a dictionary (used for hashing and saving the manifest) '''
+        return {
+            "version" : MANIFEST_VERSION,
+            "rule" : self.rule,
+            "inputs" : self.inputs,
+            "tools" : self.tools,
+        }
+
+    def digest(self):
+        ''' Returns a single hash representing the entire manifest '''
+        manifest_str = json.dumps(self.to_dict(), sort_keys=True)
+        return hashlib.sha256(manifest_str.encode()).hexdigest()
+
+def create_build_manifest(working_path, make_rule, required_input_files = None, required_build_files = None):
+    ''' Create the build manifest of a make rule. Returns None if the inputs of the rule
+    cannot be determined. '''
+    working_path = pathlib.Path(working_path)
+    database = make_database.read_make_database(working_path, [make_rule], always_make=True)
+    if database is None or make_rule not in database:
+        return None
+    manifest = build_manifest(make_rule)
+    manifest.tools = tool_versions()
+    closure = database.prerequisite_closure(make_rule)
+    # Targets with a recipe or prerequisites are created by make (not sources)
+    for name in closure:
+        target = database.targets.get(name)
+        if target is not None and (target.has_recipe or len(target.prerequisites) > 0):
+            manifest.generated.add(name)
+    outputs = manifest.generated | set(required_build_files or []) | {make_rule}
+    candidates = (closure | set(required_input_files or []) | set(database.makefiles)) - outputs
+    # Files referenced by the commands are only inputs if they are tracked by git
+    # (this keeps generated files like .dcp checkpoints out of the manifest)
+    tokens = set()
+    for command in database.commands:
+        tokens |= command_tokens(command)
+    tokens = set(token for token in tokens if (working_path / token).exists()) - outputs
+    tracked = tracked_files(working_path, tokens)
+    if tracked is not None:
+        candidates |= (tracked - outputs)
+    # The files read by the Tcl scripts of the commands (the rule is not cached if they cannot be found)
+    for command in joined_commands(database.commands):
+        scripts, script_arguments = command_scripts(command)
+        script_inputs = tcl_script_inputs(working_path, scripts, script_arguments)
+        if script_inputs is None:
+            return None
+        candidates |= (script_inputs - outputs)
+    for name in sorted(candidates):
+        filepath = working_path / name
+        if filepath.is_file():
+            manifest.inputs[name] = file_digest(filepath)
+        elif not filepath.exists():
+            manifest.inputs[name] = None
+    return manifest
+
+def directory_snapshot(directory_path):
+    ''' Returns a dictionary of (size, mtime) keyed by filename for the regular files
+    in a directory (not recursive) '''
+    snapshot = {}
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+def changed_files(directory_path, snapshot):
+    ''' Returns the names of the files in a directory that were created or modified
+    since the snapshot was taken '''
+    current = directory_snapshot(directory_path)
+    return set(name for name, stat in current.items() if snapshot.get(name) != stat)
+
+def build_output_files(working_path, manifest, required_build_files, new_files = ()):
+    ''' Determine the build artifacts of a rule: the declared build files, the targets
+    built by make, and the files created while the rule was running. Only files in
+    the working directory are included. '''
+    names = set(required_build_files or []) | manifest.generated | {manifest.rule} | set(new_files)
+    outputs = []
+    for name in sorted(names):
+        if "/" in name or name in manifest.inputs or name.startswith(SCRATCH_FILE_PREFIXES):
+            continue
+        if (pathlib.Path(working_path) / name).is_file():
+            outputs.append(name)
+    return outputs
+
+def copy_output_files(source_path, target_path, names):
+    ''' Copy saved build artifacts into a working directory. The copied files get the
+    current time so that make considers them up to date. '''
+    for name in names:
+        target = pathlib.Path(target_path) / name
+        shutil.copyfile(pathlib.Path(source_path) / name, target)
+        shutil.copymode(pathlib.Path(source_path) / name, target)
+
+class incremental_build_cache():
+    ''' Saves the manifest and build artifacts of each successful make rule in a cache
+    directory so the rule can be skipped when none of its inputs have changed.
+
+    cache_path: directory for this working directory's cache entries
+    '''
+    def __init__(self, cache_path):
+        self.cache_path = pathlib.Path(cache_path)
+
+    def entry_path(self, make_rule):
+        ''' Directory for the cache entry of a make rule '''
+        safe_name = "".join(c if c.isalnum() or c in "._-" else "_" for c in make_rule)
+        return self.cache_path / safe_name
+
+    def store(self, working_path, manifest, required_build_files, new_files = ()):
+        ''' Save the manifest and build artifacts of a successful make rule '''
+        entry_path = self.entry_path(manifest.rule)
+        if entry_path.exists():
+            shutil.rmtree(entry_path)
+        outputs_path = entry_path / "outputs"
+        outputs_path.mkdir(parents=True)
+        outputs = build_output_files(working_path, manifest, required_build_files, new_files)
+        for name in outputs:
+            shutil.copy2(pathlib.Path(working_path) / name, outputs_path / name)
+        entry = manifest.to_dict()
+        entry["digest"] = manifest.digest()
+        entry["result"] = "SUCCESS"
+        entry["outputs"] = outputs
+        with open(entry_path / "manifest.json", "w") as fp:
+            json.dump(entry, fp, indent=2)
+
+    def lookup(self, manifest):
+        ''' Returns the saved entry for the rule if it matches the manifest (None otherwise) '''
+        manifest_filepath = self.entry_path(manifest.rule) / "manifest.json"
+        if not manifest_filepath.exists():
+            return None
+        try:
+            with open(manifest_filepath) as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if entry.get("digest") != manifest.digest():
+            return None
+        return entry
+
+    def restore(self, working_path, manifest):
+        ''' Restore the build artifacts of a rule if its inputs have not changed.
+        Returns True if the artifacts were restored. '''
+        entry = self.lookup(manifest)
+        if entry is None:
+            return False
+        outputs_path = self.entry_path(manifest.rule) / "outputs"
+        for name in entry["outputs"]:
+            if not (outputs_path / name).is_file():
+                return False
+        copy_output_files(outputs_path, working_path, entry["outputs"])
+        return True
+
+class shared_result_cache():
+    ''' A content addressed cache of make rule results that is shared between
+    repositories (i.e., all of the submissions graded by the batch grader).
+
+    Entries are keyed by the hash of the complete input set of a rule (the build
+    manifest, whose paths are relative to the lab directory) and the checks that
+    are performed on its output. An entry holds the result of the rule, the outcome
+    of each check, the rule output log, and the build artifacts. Entries are evicted
+    in least recently used order when the cache grows larger than its size budget.
+
+    cache_path: root directory of the cache (may be used by many processes at once)
+    max_size_bytes: size budget of the cache
+    '''
+    ENTRY_FILENAME = "entry.json"
+    LOG_FILENAME = "make_output.log"
+
+    def __init__(self, cache_path, max_size_bytes):
+        self.cache_path = pathlib.Path(cache_path)
+        self.max_size_bytes = max_size_bytes
+        self.entries_path = self.cache_path / "entries"
+        self.tmp_path = self.cache_path / "tmp"
+
+    def entry_key(self, manifest, required_build_files, check_names):
+        ''' The cache key for a rule with the given manifest, build files, and checks '''
+        key_data = {
+            "manifest" : manifest.digest(),
+            "build_files" : sorted(required_build_files or []),
+            "checks" : list(check_names),
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return self.entries_path / key[:2] / key
+
+    def lookup(self, key):
+        ''' Returns the entry dictionary for the key or None if there is no entry.
+        A lookup marks the entry as recently used. '''
+        entry_filepath = self.entry_path(key) / self.ENTRY_FILENAME
+        try:
+            with open(entry_filepath) as fp:
+                entry = json.load(fp)
+            os.utime(entry_filepath)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def restore(self, key, working_path):
+        ''' Restore the build artifacts of the entry for the key to the working path.
+        Returns the entry or None if there is no complete entry for the key. '''
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        outputs_path = self.entry_path(key) / "outputs"
+        try:
+            copy_output_files(outputs_path, working_path, entry["outputs"])
+        except OSError:
+            # The entry was evicted by another process
+            return None
+        entry["log_filepath"] = str(self.entry_path(key) / self.LOG_FILENAME)
+        return entry
+
+    def store(self, key, working_path, manifest, required_build_files, result, check_results, log_capture, new_files = ()):
+        ''' Add an entry to the cache. The entry is created in a temporary directory and
+        renamed into place so other processes never see a partial entry.
+        result: the (result, msg) of the make rule
+        check_results: list of (result, msg) of each check in order
+        log_capture: the captured output of the rule (a process_runner.output_capture) '''
+        entry_path = self.entry_path(key)
+        if entry_path.exists():
+            return
+        tmp_entry_path = self.tmp_path / uuid.uuid4().hex
+        outputs_path = tmp_entry_path / "outputs"
+        outputs_path.mkdir(parents=True)
+        outputs = build_output_files(working_path, manifest, required_build_files, new_files)
+        for name in outputs:
+            shutil.copy2(pathlib.Path(working_path) / name, outputs_path / name)
+        with open(tmp_entry_path / self.LOG_FILENAME, "wb") as fp:
+            log_capture.copy_to(fp)
+        entry = {
+            "key" : key,
+            "rule" : manifest.rule,
+            "result" : result,
+            "checks" : check_results,
+            "outputs" : outputs,
+            "created" : time.time(),
+        }
+        with open(tmp_entry_path / self.ENTRY_FILENAME, "w") as fp:
+            json.dump(entry, fp, indent=2)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(tmp_entry_path, entry_path)
+        except OSError:
+            # Another process added the same entry first
+            shutil.rmtree(tmp_entry_path, ignore_errors=True)
+        self.evict()
+
+    def directory_size(self, path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for filename in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, filename))
+                except OSError:
+                    pass
+        return size
+
+    def evict(self):
+        ''' Remove the least recently used entries until the cache is within its size budget '''
+        entries = []
+        total_size = 0
+        for entry_filepath in self.entries_path.glob("*/*/" + self.ENTRY_FILENAME):
+            try:
+                last_used = entry_filepath.stat().st_mtime
+            except OSError:
+                continue
+            size = self.directory_size(entry_filepath.parent)
+            entries.append((last_used, size, entry_filepath.parent))
+            total_size += size
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
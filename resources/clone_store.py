@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+'''
+Prepares the clones of the student repositories used by the lab passoff scripts.
+
+Every student repository is a copy of the starter repository (ecen323_student) with
+the changes of the student, so most of the objects of a clone (the RARS jar, the
+font and background memory files, the iosystem sources ...) are the same for every
+student. A clone is prepared with:
+
+- A reference store: a bare mirror of the starter repository shared by all of the
+  clones of the machine (REFERENCE_STORE_ENV or ~/.cache/ecen423/reference). The clones
+  use its objects through 'objects/info/alternates' rather than copying them, so only
+  the objects of the changes of the student are fetched and written. The store is
+  created the first time it is needed and is updated once a day. A clone depends on
+  the store (the extract directories are temporary).
+- A shallow ('--depth 1') or blob filtered ('--filter=blob:none') fetch of the
+  submission tag only (the checks only use the files of the tag).
+- Reuse of an existing clone of the same repository: the tag is fetched and checked
+  out and the files that are not in the tag are removed ('git clean -ffdx') rather than
+  deleting the clone and cloning it again. Only the clones made by the passoff scripts
+  (marked with the PASSOFF_CLONE_KEY configuration) are reused so the working repository
+  of a student is never checked out or cleaned.
+
+The time taken and the size of the git directory of each clone are reported.
+'''
+
+import fcntl
+import os
+import pathlib
+import shutil
+import subprocess
+import time
+
+# Directory of the reference stores (default is ~/.cache/ecen423/reference)
+REFERENCE_STORE_ENV = "ECEN423_REFERENCE_STORE"
+# The reference store is updated when its last update is older than this
+REFERENCE_REFRESH_SECONDS = 24 * 3600
+# The files in a reference store with the time of the last update and the lock
+REFERENCE_STAMP_FILENAME = "ecen423_updated"
+REFERENCE_LOCK_FILENAME = "ecen423.lock"
+# Clone modes: only the commit of the tag, all commits without the file contents or everything
+CLONE_SHALLOW = "shallow"
+CLONE_PARTIAL = "partial"
+CLONE_FULL = "full"
+CLONE_MODES = [CLONE_SHALLOW, CLONE_PARTIAL, CLONE_FULL]
+# Configuration of the clones made by the passoff scripts (the clones that can be reused)
+PASSOFF_CLONE_KEY = "ecen423.passoffclone"
+
+def run_git(args, cwd = None):
+    ''' Run a git command (the output is captured) '''
+    return subprocess.run(["git", "-c", "advice.detachedHead=false"] + args, cwd=cwd,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def default_reference_path(url):
+    ''' The reference store of a repository URL (i.e., <dir>/ecen323_student.git) '''
+    name = url.rstrip("/").rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+    if not name.endswith(".git"):
+        name += ".git"
+    store_dir = os.environ.get(REFERENCE_STORE_ENV)
+    if store_dir is None:
+        store_dir = pathlib.Path.home() / ".cache" / "ecen423" / "reference"
+    return pathlib.Path(store_dir) / name
+
+def fetch_args(mode):
+    if mode == CLONE_SHALLOW:
+        return ["--depth", "1"]
+    if mode == CLONE_PARTIAL:
+        return ["--filter=blob:none"]
+    return []
+
+def git_dir_bytes(repo_path):
+    ''' The size of the git directory of a clone (the objects of the reference store are not counted) '''
+    total_bytes = 0
+    for root, _, filenames in os.walk(pathlib.Path(repo_path) / ".git"):
+        for filename in filenames:
+            try:
+                total_bytes += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return total_bytes
+
+class reference_store():
+    ''' A bare mirror of a repository used as the reference of the clones.
+    url: the URL of the repository (i.e., the starter code repository)
+    path: the bare repository (default is default_reference_path) '''
+    def __init__(self, url, path = None):
+        self.url = url
+        self.path = pathlib.Path(path) if path is not None else default_reference_path(url)
+
+    def update(self, max_age_seconds = REFERENCE_REFRESH_SECONDS, print_function = print):
+        ''' Create the store or update it if it is older than max_age_seconds. Returns True
+        if the store can be used. The store is locked while it is updated (passoffs run at the
+        same time wait for each other). '''
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.parent / f"{self.path.name}.{REFERENCE_LOCK_FILENAME}", "w") as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                stamp_path = self.path / REFERENCE_STAMP_FILENAME
+                if not self.path.exists():
+                    return self.create(print_function)
+                if stamp_path.exists() and time.time() - stamp_path.stat().st_mtime < max_age_seconds:
+                    return True
+                print_function(f"Updating reference repository {self.path}")
+                proc = run_git(["fetch", "--quiet", "--prune", "origin",
+                                "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"], cwd=self.path)
+                if proc.returncode != 0:
+                    # The objects that are in the store can still be used
+                    print_function(f"Reference repository update failed: {proc.stderr.strip()}")
+                    return True
+                stamp_path.touch()
+                return True
+        except OSError as e:
+            print_function(f"Cannot use reference repository {self.path}: {e}")
+            return False
+
+    def create(self, print_function):
+        print_function(f"Creating reference repository {self.path} from {self.url}")
+        temp_path = self.path.with_name(self.path.name + f".{os.getpid()}")
+        proc = run_git(["clone", "--quiet", "--bare", self.url, str(temp_path)])
+        if proc.returncode != 0:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            print_function(f"Reference repository clone failed: {proc.stderr.strip()}")
+            return False
+        (temp_path / REFERENCE_STAMP_FILENAME).touch()
+        os.rename(temp_path, self.path)
+        return True
+
+def is_clone_of(repo_path, url):
+    ''' Returns True if the directory is a clone of the repository URL made by clone_preparer '''
+    repo_path = pathlib.Path(repo_path)
+    if not (repo_path / ".git").is_dir():
+        return False
+    values = []
+    for key in ["remote.origin.url", PASSOFF_CLONE_KEY]:
+        proc = run_git(["config", "--local", "--get", key], cwd=repo_path)
+        values.append(proc.stdout.strip() if proc.returncode == 0 else None)
+    return values == [str(url), "true"]
+
+def fetch_tag(repo_path, tag, mode = CLONE_SHALLOW):
+    ''' Fetch (and force the update of) a tag from the origin of a clone. Returns the error
+    message (None if the fetch succeeded). '''
+    proc = run_git(["fetch", "--quiet", "--force", "--no-tags"] + fetch_args(mode) +
+                   ["origin", f"+refs/tags/{tag}:refs/tags/{tag}"], cwd=repo_path)
+    return proc.stderr.strip() if proc.returncode != 0 else None
+
+def checkout_tag(repo_path, tag):
+    ''' Check out a tag and remove all of the files that are not in it. Returns the error
+    message (None if the checkout succeeded). '''
+    for args in (["checkout", "--quiet", "--force", "--detach", f"refs/tags/{tag}"], ["clean", "-q", "-ffdx"]):
+        proc = run_git(args, cwd=repo_path)
+        if proc.returncode != 0:
+            return proc.stderr.strip()
+    return None
+
+class clone_preparer():
+    ''' Prepares the clone of a repository at a tag.
+    reference_path: a reference_store path (None for no reference)
+    mode: CLONE_SHALLOW, CLONE_PARTIAL or CLONE_FULL '''
+    def __init__(self, reference_path = None, mode = CLONE_SHALLOW, print_function = print):
+        self.reference_path = reference_path
+        self.mode = mode
+        self.print_function = print_function
+        # Time and git directory size of the last clone
+        self.seconds = 0
+        self.git_dir_bytes = 0
+        self.reused = False
+
+    def prepare(self, url, repo_path, tag):
+        ''' Clone the repository (or update an existing clone) at the tag. Returns the error
+        message (None if the clone is ready). '''
+        repo_path = pathlib.Path(repo_path).absolute()
+        start_time = time.monotonic()
+        self.reused = is_clone_of(repo_path, url)
+        if self.reused:
+            error = fetch_tag(repo_path, tag, self.mode) or checkout_tag(repo_path, tag)
+        else:
+            args = ["clone", "--quiet", "--branch", tag] + fetch_args(self.mode)
+            if self.reference_path is not None:
+                args += ["--reference-if-able", str(self.reference_path)]
+            proc = run_git(args + ["--config", f"{PASSOFF_CLONE_KEY}=true", str(url), str(repo_path)])
+            error = proc.stderr.strip() if proc.returncode != 0 else None
+        self.seconds = time.monotonic() - start_time
+        if error is None:
+            self.git_dir_bytes = git_dir_bytes(repo_path)
+            action = "Updated existing clone" if self.reused else f"Cloned ({self.mode})"
+            reference = f", reference {self.reference_path}" if self.reference_path is not None and not self.reused else ""
+            self.print_function(f"{action} in {self.seconds:.1f}s: {self.git_dir_bytes / 1024 ** 2:.1f} MB in .git{reference}")
+        return error
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+
+'''
+Coordinates the fetches of the remotes of a repository made by the repository checks.
+
+The checks of a test suite used to fetch the same remote several times (the unpushed
+and the unpulled commit checks each fetched all of 'origin', the lab tag lookup
+fetched all of the tags with 'git fetch --tags --force'). A 'fetch_coordinator'
+fetches only the references a check needs (a branch or a tag) and each reference
+at most once per run:
+
+- fetch_branch(remote, branch): '+refs/heads/<branch>:refs/remotes/<remote>/<branch>'
+- fetch_tag(remote, tag): '+refs/tags/<tag>:refs/tags/<tag>'
+- fetch(remote, refspecs): any refspecs (one 'git fetch' for all of them)
+
+The time of the last fetch of each reference is saved in the git directory of the
+repository (FETCH_STATE_FILENAME) so a reference fetched less than ttl_seconds ago
+by an earlier run is not fetched again. A fetch can be forced (i.e., when waiting
+for a tag to be updated by the remote). The time taken by the fetches of each remote
+is recorded in fetch_seconds.
+
+The remotes are the remotes of the repository (a URL or the path of a local bare
+repository can also be given as the remote).
+'''
+
+import json
+import os
+import pathlib
+import subprocess
+import threading
+import time
+
+# File in the git directory with the time of the last fetch of each reference
+FETCH_STATE_FILENAME = "ecen423_fetch_state.json"
+# References fetched less than this many seconds ago by an earlier run are not fetched again
+DEFAULT_FETCH_TTL_SECONDS = 300
+# Message of 'git fetch' when a reference does not exist on the remote
+MISSING_REF_MESSAGE = "couldn't find remote ref"
+
+def branch_refspec(remote_name, branch):
+    return f"+refs/heads/{branch}:refs/remotes/{remote_name}/{branch}"
+
+def tag_refspec(tag):
+    return f"+refs/tags/{tag}:refs/tags/{tag}"
+
+class fetch_coordinator():
+    ''' Fetches the references of the remotes of a repository at most once per run.
+    repo_root_path: the working tree of the repository
+    ttl_seconds: references fetched less than this many seconds ago (by any run) are not fetched
+    git_dir: the git directory where the fetch times are saved (default is found with git)
+    '''
+    def __init__(self, repo_root_path, ttl_seconds = DEFAULT_FETCH_TTL_SECONDS, git_dir = None):
+        self.repo_root_path = pathlib.Path(repo_root_path)
+        self.ttl_seconds = ttl_seconds
+        if git_dir is None:
+            git_dir = subprocess.run(["git", "rev-parse", "--absolute-git-dir"], cwd=self.repo_root_path,
+                stdout=subprocess.PIPE, text=True, check=True).stdout.strip()
+        self.state_path = pathlib.Path(git_dir) / FETCH_STATE_FILENAME
+        self.lock = threading.Lock()
+        # References fetched by this run ("<remote> <refspec>" to True if the reference exists)
+        self.fetched = {}
+        # Seconds spent fetching each remote and the number of fetches
+        self.fetch_seconds = {}
+        self.fetch_count = 0
+
+    def read_state(self):
+        try:
+            with open(self.state_path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def write_state(self, state):
+        temp_path = self.state_path.with_name(self.state_path.name + f".{os.getpid()}")
+        try:
+            with open(temp_path, "w") as fp:
+                json.dump(state, fp, indent=1)
+            os.replace(temp_path, self.state_path)
+        except OSError:
+            pass
+
+    def fetch(self, remote_name, refspecs, force = False):
+        ''' Fetch the refspecs from a remote unless they were fetched by this run (or within the
+        TTL by an earlier run). Returns True if all of the references exist on the remote.
+        Raises an Exception if the fetch fails. '''
+        with self.lock:
+            state = self.read_state()
+            now = time.time()
+            pending = []
+            exists = True
+            for refspec in refspecs:
+                key = f"{remote_name} {refspec}"
+                if not force and key in self.fetched:
+                    exists = exists and self.fetched[key]
+                elif not force and key in state and now - state[key]["time"] < self.ttl_seconds:
+                    exists = exists and state[key]["exists"]
+                else:
+                    pending.append(refspec)
+            if not pending:
+                return exists
+            found = self.run_fetch(remote_name, pending)
+            state = self.read_state()
+            for refspec in pending:
+                key = f"{remote_name} {refspec}"
+                self.fetched[key] = found[refspec]
+                state[key] = {"time" : now, "exists" : found[refspec]}
+                exists = exists and found[refspec]
+            self.write_state(state)
+            return exists
+
+    def run_fetch(self, remote_name, refspecs):
+        ''' Run 'git fetch' and return a dictionary with True for each refspec found on the remote.
+        The refspecs are fetched one at a time when one of them does not exist. '''
+        start_time = time.monotonic()
+        try:
+            error = self.run_git_fetch(remote_name, refspecs)
+            if error is None:
+                return {refspec : True for refspec in refspecs}
+            if MISSING_REF_MESSAGE not in error:
+                raise Exception(f"Error fetching updates from remote {remote_name}: {error}")
+            if len(refspecs) == 1:
+                return {refspecs[0] : False}
+            return {refspec : self.run_fetch(remote_name, [refspec])[refspec] for refspec in refspecs}
+        finally:
+            self.fetch_seconds[remote_name] = self.fetch_seconds.get(remote_name, 0) + time.monotonic() - start_time
+
+    def run_git_fetch(self, remote_name, refspecs):
+        ''' Returns None if the fetch succeeded and the error message otherwise '''
+        self.fetch_count += 1
+        proc = subprocess.run(["git", "fetch", "--quiet", "--no-tags", remote_name] + refspecs,
+            cwd=self.repo_root_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            return proc.stderr.strip()
+        return None
+
+    def fetch_branch(self, remote_name, branch, force = False):
+        return self.fetch(remote_name, [branch_refspec(remote_name, branch)], force)
+
+    def fetch_tag(self, remote_name, tag, force = False):
+        return self.fetch(remote_name, [tag_refspec(tag)], force)
+
+    def summary(self):
+        ''' Returns a string with the time spent fetching each remote '''
+        return ", ".join(f"{remote_name} {seconds:.1f}s" for remote_name, seconds in self.fetch_seconds.items())
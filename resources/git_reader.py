@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+
+'''
+Reads the objects of a git repository through a long-lived 'git cat-file --batch' process.
+
+The repository checks read files from tagged commits (.commitdate), resolve tags and
+list the commits of a range (unpushed and unpulled commits, the commits of a lab
+directory). A 'git_object_reader' keeps one 'git cat-file --batch' process open for
+the repository and serves all of the object reads from it:
+
+- read_blob(rev, path): the contents of a file of a commit
+- commit(rev): a commit_info (hexsha, message, dates, parents) for a commit, tag or branch
+- tag_commit(tag_name): the commit_info of a tag (annotated tags are peeled)
+- commits(rev_range, paths): the commit_info of each commit of a range, newest first
+
+The commits of a range are read with one 'git rev-list --header' that writes the
+contents of each commit (rev-list only starts once its input is complete, so it
+cannot be kept open between requests like the batch process). The commits are
+cached by object name. The batch process is restarted by invalidate() after a fetch.
+
+The commit_info objects have the attributes of the GitPython commits used by the
+checks (hexsha, message, committed_date, committed_datetime) so they can be used in
+place of them.
+
+Benchmark against the GitPython helpers (a repository with thousands of commits is
+created if none is given):
+  git_reader.py --benchmark [--repo <path>] [--commits 5000]
+'''
+
+import argparse
+import datetime
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+class commit_info():
+    ''' A commit read from the object database '''
+    def __init__(self, hexsha, data):
+        self.hexsha = hexsha
+        self.parents = []
+        self.tree = None
+        self.author = None
+        self.committer = None
+        self.committed_date = 0
+        self.committer_tz_offset = 0
+        headers, _, message = data.partition(b"\n\n")
+        self.message = message.decode("utf-8", errors="replace")
+        for header in headers.decode("utf-8", errors="replace").split("\n"):
+            key, _, value = header.partition(" ")
+            if key == "tree":
+                self.tree = value
+            elif key == "parent":
+                self.parents.append(value)
+            elif key in ("author", "committer"):
+                # <name> <email> <seconds> <+hhmm>
+                identity, seconds, offset = value.rsplit(" ", 2)
+                setattr(self, key, identity)
+                if key == "committer":
+                    self.committed_date = int(seconds)
+                    sign = -1 if offset.startswith("-") else 1
+                    self.committer_tz_offset = sign * (int(offset[1:3]) * 60 + int(offset[3:5]))
+
+    @property
+    def committed_datetime(self):
+        timezone = datetime.timezone(datetime.timedelta(minutes=self.committer_tz_offset))
+        return datetime.datetime.fromtimestamp(self.committed_date, timezone)
+
+class git_object_reader():
+    ''' Reads objects from a repository with a persistent 'git cat-file --batch' process.
+    The methods can be called from several threads (the requests are serialized). '''
+    def __init__(self, repo_root_path):
+        self.repo_root_path = pathlib.Path(repo_root_path)
+        self.batch = None
+        self.lock = threading.Lock()
+        self.commit_cache = {}
+        # Number of git processes started (for the benchmark)
+        self.process_count = 0
+
+    def start_batch(self):
+        self.batch = subprocess.Popen(["git", "cat-file", "--batch"], cwd=self.repo_root_path,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.process_count += 1
+
+    def read_object(self, name):
+        ''' Returns the (object name, type, contents) of an object (None if it does not exist).
+        The name is any name accepted by 'git rev-parse' (i.e., 'lab01^{commit}' or 'HEAD:.commitdate'). '''
+        if "\n" in name:
+            return None
+        with self.lock:
+            if self.batch is None or self.batch.poll() is not None:
+                self.start_batch()
+            self.batch.stdin.write(name.encode("utf-8") + b"\n")
+            self.batch.stdin.flush()
+            header = self.batch.stdout.readline().decode("utf-8", errors="replace").split()
+            if len(header) != 3 or header[-1] in ("missing", "ambiguous"):
+                return None
+            object_name, object_type, size = header
+            data = self.batch.stdout.read(int(size))
+            # The contents are followed by an end of line
+            self.batch.stdout.read(1)
+            return object_name, object_type, data
+
+    def resolve(self, rev, object_type = "commit"):
+        ''' The object name of a revision (peeled to the object type) or None '''
+        result = self.read_object(f"{rev}^{{{object_type}}}")
+        return None if result is None else result[0]
+
+    def read_blob(self, rev, path):
+        ''' The contents (bytes) of a file of a commit or None if it does not exist '''
+        result = self.read_object(f"{rev}:{path}")
+        if result is None or result[1] != "blob":
+            return None
+        return result[2]
+
+    def commit(self, rev):
+        ''' The commit_info of a revision or None if it is not a commit '''
+        if rev in self.commit_cache:
+            return self.commit_cache[rev]
+        result = self.read_object(f"{rev}^{{commit}}")
+        if result is None:
+            return None
+        commit = self.commit_cache.get(result[0])
+        if commit is None:
+            commit = commit_info(result[0], result[2])
+            self.commit_cache[result[0]] = commit
+        return commit
+
+    def tag_commit(self, tag_name):
+        ''' The commit_info of a tag (None if there is no tag) '''
+        return self.commit(f"refs/tags/{tag_name}")
+
+    def run_git(self, args):
+        ''' Run a git command in the repository and return its output (bytes) '''
+        self.process_count += 1
+        proc = subprocess.run(["git"] + args, cwd=self.repo_root_path, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, check=False)
+        if proc.returncode != 0:
+            raise Exception(f"git {' '.join(args)} failed: {proc.stderr.decode(errors='replace').strip()}")
+        return proc.stdout
+
+    def path_args(self, paths):
+        if paths is None:
+            return []
+        return [str(path) for path in ([paths] if isinstance(paths, (str, os.PathLike)) else paths)]
+
+    def rev_list(self, rev_range, paths = None):
+        ''' The object names of the commits of a range (i.e., 'origin/main..HEAD'), newest first '''
+        return self.run_git(["rev-list"] + rev_range.split() + ["--"] + self.path_args(paths)).decode().split()
+
+    def commits(self, rev_range, paths = None):
+        ''' The commit_info of the commits of a range that change the paths (all commits if None) '''
+        output = self.run_git(["rev-list", "--header"] + rev_range.split() + ["--"] + self.path_args(paths))
+        commits = []
+        # Each record is the object name and the contents of a commit (the message is indented)
+        for record in output.split(b"\0"):
+            if not record.strip():
+                continue
+            hexsha, _, data = record.partition(b"\n")
+            hexsha = hexsha.decode()
+            commit = self.commit_cache.get(hexsha)
+            if commit is None:
+                headers, _, message = data.partition(b"\n\n")
+                message = b"\n".join(line[4:] if line.startswith(b"    ") else line for line in message.split(b"\n"))
+                commit = commit_info(hexsha, headers + b"\n\n" + message)
+                self.commit_cache[hexsha] = commit
+            commits.append(commit)
+        return commits
+
+    def tags(self):
+        ''' Dictionary of the tags of the repository with the object name of their commit '''
+        tags = {}
+        output = self.run_git(["for-each-ref", "--format=%(refname:strip=2) %(objectname) %(*objectname)", "refs/tags"])
+        for line in output.decode("utf-8", errors="replace").splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                tags[fields[0]] = fields[-1]
+        return tags
+
+    def invalidate(self):
+        ''' Restart the batch process (i.e., after a fetch changed the references) '''
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.batch is not None:
+                self.batch.stdin.close()
+                self.batch.wait()
+                self.batch.stdout.close()
+                self.batch = None
+
+#########################################################################################
+# Benchmark
+#########################################################################################
+
+def create_benchmark_repo(repo_path, commit_count):
+    ''' Create a repository with commit_count commits (with fast-import) and a 'lab01' tag '''
+    subprocess.run(["git", "init", "-q", "-b", "main", str(repo_path)], check=True)
+    stream = []
+    for index in range(commit_count):
+        directory = f"lab{index % 12 + 1:02d}"
+        content = f"// change {index}\n".encode()
+        commit_date = 1700000000 + index * 60
+        message = f"Commit {index}\n".encode()
+        stream.append(b"commit refs/heads/main\n")
+        stream.append(f"committer Student <student@example.com> {commit_date} -0700\n".encode())
+        stream.append(b"data %d\n%s\n" % (len(message), message))
+        stream.append(f"M 100644 inline {directory}/file{index % 50}.sv\n".encode())
+        stream.append(b"data %d\n%s\n" % (len(content), content))
+        if index == commit_count // 2:
+            date_text = f"Submitted {commit_date}\n".encode()
+            stream.append(b"M 100644 inline .commitdate\n")
+            stream.append(b"data %d\n%s\n" % (len(date_text), date_text))
+            stream.append(b"\nreset refs/tags/lab01\nfrom refs/heads/main\n\n")
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=repo_path, input=b"".join(stream), check=True)
+    subprocess.run(["git", "checkout", "-q", "main"], cwd=repo_path, check=True)
+
+def time_calls(function, repetitions):
+    start_time = time.perf_counter()
+    for _ in range(repetitions):
+        value = function()
+    return (time.perf_counter() - start_time) / repetitions, value
+
+def benchmark(repo_path, repetitions = 20):
+    ''' Compare the GitPython helpers of repo_test with the reader '''
+    import git
+    import repo_test
+    repo = git.Repo(repo_path)
+    reader = git_object_reader(repo_path)
+    lab_tag = next(iter(reader.tags()), None)
+    tag_rev = f"refs/tags/{lab_tag}"
+    cases = [
+        ("read .commitdate of a tag",
+            lambda: repo_test.get_commit_file_contents(repo.tags[lab_tag].commit, ".commitdate"),
+            lambda: reader.read_blob(tag_rev, ".commitdate")),
+        ("resolve a tag",
+            lambda: next(tag for tag in repo.tags if tag.name == lab_tag).commit.hexsha,
+            lambda: reader.tag_commit(lab_tag).hexsha),
+        ("commits of a range (messages and dates)",
+            lambda: [(c.hexsha, c.message, c.committed_date) for c in repo.iter_commits(f"{tag_rev}..HEAD")],
+            lambda: [(c.hexsha, c.message, c.committed_date) for c in reader.commits(f"{tag_rev}..HEAD")]),
+        ("commits of a directory",
+            lambda: [(c.hexsha, c.message) for c in repo.iter_commits(paths="lab01")],
+            lambda: [(c.hexsha, c.message) for c in reader.commits("HEAD", "lab01")]),
+    ]
+    print(f"Repository {repo_path}: {len(reader.rev_list('HEAD'))} commits, tag {lab_tag}")
+    for name, gitpython_function, reader_function in cases:
+        # The first call of each is not timed (process start up). The commit cache of the reader
+        # is cleared before each call so each call reads all of its objects.
+        uncached_function = lambda: (reader.commit_cache.clear(), reader_function())[1]
+        gitpython_function()
+        uncached_function()
+        gitpython_seconds, gitpython_value = time_calls(gitpython_function, repetitions)
+        reader_seconds, reader_value = time_calls(uncached_function, repetitions)
+        same = "same result" if gitpython_value == reader_value or \
+            (isinstance(gitpython_value, str) and gitpython_value.encode() == reader_value) else "DIFFERENT RESULT"
+        print(f"  {name:42} GitPython {gitpython_seconds * 1000:8.2f} ms   reader {reader_seconds * 1000:8.2f} ms" +
+              f"   ({gitpython_seconds / max(reader_seconds, 1e-9):5.1f}x, {same})")
+    reader.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent git object reader (benchmark)")
+    parser.add_argument("--benchmark", action="store_true", help="Compare the reader with the GitPython helpers")
+    parser.add_argument("--repo", type=str, help="Repository for the benchmark (default is a new repository)")
+    parser.add_argument("--commits", type=int, default=5000, help="Number of commits of the new repository")
+    parser.add_argument("--repetitions", type=int, default=20, help="Number of timed calls of each case")
+    args = parser.parse_args()
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+    if args.repo is not None:
+        benchmark(pathlib.Path(args.repo), args.repetitions)
+        return 0
+    with tempfile.TemporaryDirectory(prefix="git_reader_") as temp_dir:
+        repo_path = pathlib.Path(temp_dir) / "repo"
+        create_benchmark_repo(repo_path, args.commits)
+        benchmark(repo_path, args.repetitions)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+
+'''
+A snapshot of the status of the files of a git repository.
+
+The repository checks of a test suite (uncommitted, ignored, untracked and tracked
+files) used to run 'git ls-files' or an index diff each. Every one of these commands
+scans the working tree, which is slow when the lab directories are full of tool
+output (xsim.dir, .Xil, ...). A 'repo_snapshot' runs two commands:
+
+  git status --porcelain=v2 -z --ignored -uall
+  git ls-files -z -s
+
+and answers all of the checks from the parsed output. The paths are relative to the
+root of the repository (like the output of the git commands run by GitPython). The
+snapshot is taken by the test suite the first time it is needed and is invalidated
+when a makefile rule is run (see repo_test_suite.repo_snapshot).
+
+A 'submission_status' answers the repository checks of the lab passoff scripts
+(lab_passoff.check_repo_file_status) the same way.
+'''
+
+import os
+import pathlib
+import subprocess
+
+class status_entry():
+    ''' A changed tracked file from 'git status --porcelain=v2'.
+    staged/unstaged: the change of the file in the index (relative to HEAD) and in the
+      working tree (relative to the index), '.' for no change
+    original_path: the path before a rename or copy (None otherwise)
+    '''
+    def __init__(self, path, staged, unstaged, original_path = None, unmerged = False):
+        self.path = path
+        self.staged = staged
+        self.unstaged = unstaged
+        self.original_path = original_path
+        self.unmerged = unmerged
+
+def run_git(repo_root_path, args):
+    ''' Run a git command in the repository and return its output (bytes) '''
+    proc = subprocess.run(["git"] + args, cwd=repo_root_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if proc.returncode != 0:
+        raise Exception(f"git {' '.join(args)} failed: {proc.stderr.decode(errors='replace').strip()}")
+    return proc.stdout
+
+def split_records(output):
+    ''' Split the NUL separated output of a git command '''
+    return [record.decode("utf-8", errors="surrogateescape") for record in output.split(b"\0") if record]
+
+class repo_snapshot():
+    ''' The tracked, changed, untracked and ignored files of a repository '''
+    def __init__(self, repo_root_path):
+        self.repo_root_path = pathlib.Path(repo_root_path)
+        # Tracked files (path to (mode, object name)) from the index
+        self.tracked = {}
+        # Changed tracked files (path to status_entry)
+        self.changes = {}
+        self.untracked = []
+        self.ignored = []
+        self.read_status()
+        self.read_index()
+
+    def read_status(self):
+        records = split_records(run_git(self.repo_root_path,
+            ["status", "--porcelain=v2", "-z", "--ignored", "-uall"]))
+        position = 0
+        while position < len(records):
+            record = records[position]
+            position += 1
+            kind = record[0]
+            if kind == "?":
+                self.untracked.append(record[2:])
+            elif kind == "!":
+                self.ignored.append(record[2:])
+            elif kind == "1":
+                # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+                fields = record.split(" ", 8)
+                self.changes[fields[8]] = status_entry(fields[8], fields[1][0], fields[1][1])
+            elif kind == "2":
+                # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path> followed by the original path
+                fields = record.split(" ", 9)
+                self.changes[fields[9]] = status_entry(fields[9], fields[1][0], fields[1][1], records[position])
+                position += 1
+            elif kind == "u":
+                # u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+                fields = record.split(" ", 10)
+                self.changes[fields[10]] = status_entry(fields[10], fields[1][0], fields[1][1], unmerged = True)
+
+    def read_index(self):
+        # <mode> <object> <stage>\t<path> (unmerged files have more than one stage)
+        for record in split_records(run_git(self.repo_root_path, ["ls-files", "-z", "-s"])):
+            info, path = record.split("\t", 1)
+            mode, object_name, _ = info.split(" ")
+            self.tracked.setdefault(path, (mode, object_name))
+
+    def relative_path(self, path):
+        ''' The path relative to the root of the repository ('' for the root). Relative paths
+        are relative to the root. '''
+        if path is None:
+            return ""
+        path = pathlib.Path(path)
+        if path.is_absolute():
+            path = pathlib.Path(path.resolve()).relative_to(self.repo_root_path.resolve())
+        relative = path.as_posix()
+        return "" if relative == "." else relative
+
+    def select(self, paths, directory):
+        ''' The paths that are in a directory (or are the path) '''
+        prefix = self.relative_path(directory)
+        if prefix == "":
+            return sorted(paths)
+        return sorted(path for path in paths if path == prefix or path.startswith(prefix + "/"))
+
+    def tracked_files(self, directory = None):
+        ''' The tracked files in a directory (default is the whole repository) like 'git ls-files' '''
+        return self.select(self.tracked, directory)
+
+    def is_tracked(self, path):
+        return self.relative_path(path) in self.tracked
+
+    def untracked_files(self, directory = None):
+        ''' The files that are not tracked and not ignored like 'git ls-files --others --exclude-standard' '''
+        return self.select(self.untracked, directory)
+
+    def ignored_files(self, directory = None):
+        ''' The ignored files like 'git ls-files --others --ignored --exclude-standard' '''
+        return self.select(self.ignored, directory)
+
+    def uncommitted_files(self, directory = None):
+        ''' The tracked files with staged or unstaged changes (and the original path of renamed files) '''
+        paths = set(self.changes)
+        paths.update(entry.original_path for entry in self.changes.values() if entry.original_path is not None)
+        return self.select(paths, directory)
+
+    def staged_files(self, directory = None):
+        return self.select([path for path, entry in self.changes.items() if entry.staged != "."], directory)
+
+    def unstaged_files(self, directory = None):
+        return self.select([path for path, entry in self.changes.items() if entry.unstaged != "."], directory)
+
+def find_repo_root(path):
+    ''' The root of the working tree that contains a path (the closest directory with a '.git') '''
+    path = pathlib.Path(path).resolve()
+    for directory in [path] + list(path.parents):
+        if (directory / ".git").exists():
+            return directory
+    raise Exception(f"{path} is not in a git repository")
+
+class submission_status():
+    ''' The status of the files of a lab submission from three git commands (whatever the
+    number of files): 'ls-files' of the required files, 'status' of the lab directory and
+    the required files and a 'rev-list' count of the commits ahead and behind the upstream.
+    lab_path: the lab directory (the filenames are relative to it)
+    filenames: the files that must be committed
+    upstream: the branch the commits must be pushed to
+    '''
+    def __init__(self, lab_path, filenames, upstream = "origin/main"):
+        self.lab_path = pathlib.Path(lab_path).resolve()
+        self.filenames = list(filenames)
+        self.upstream = upstream
+        self.repo_root_path = find_repo_root(self.lab_path)
+        # Required files that are not tracked
+        self.missing_files = []
+        # Required files that are changed or not committed
+        self.modified_files = []
+        # Untracked (not ignored) files in the lab directory
+        self.untracked_files = []
+        # Commits of HEAD not in the upstream and of the upstream not in HEAD (None if unknown)
+        self.ahead = None
+        self.behind = None
+        self.upstream_error = None
+        self.read_tracked()
+        self.read_status()
+        self.read_ahead_behind()
+
+    def lab_relative(self, repo_path):
+        return pathlib.Path(os.path.relpath(self.repo_root_path / repo_path, self.lab_path)).as_posix()
+
+    def read_tracked(self):
+        if not self.filenames:
+            return
+        tracked = set(split_records(run_git(self.lab_path, ["ls-files", "-z", "--"] + self.filenames)))
+        self.missing_files = [filename for filename in self.filenames
+                              if pathlib.PurePath(filename).as_posix() not in tracked]
+
+    def read_status(self):
+        required = set(pathlib.PurePath(filename).as_posix() for filename in self.filenames)
+        records = split_records(run_git(self.lab_path,
+            ["status", "--porcelain=v2", "-z", "-uall", "--", "."] + self.filenames))
+        position = 0
+        while position < len(records):
+            record = records[position]
+            position += 1
+            kind = record[0]
+            if kind == "?":
+                path = self.lab_relative(record[2:])
+            elif kind == "1":
+                path = self.lab_relative(record.split(" ", 8)[8])
+            elif kind == "2":
+                path = self.lab_relative(record.split(" ", 9)[9])
+                position += 1
+            elif kind == "u":
+                path = self.lab_relative(record.split(" ", 10)[10])
+            else:
+                continue
+            if path in required:
+                self.modified_files.append(path)
+            if kind == "?" and not path.startswith("../"):
+                self.untracked_files.append(path)
+
+    def read_ahead_behind(self):
+        try:
+            output = run_git(self.lab_path, ["rev-list", "--left-right", "--count", f"HEAD...{self.upstream}", "--"])
+            self.ahead, self.behind = (int(count) for count in output.split())
+        except Exception as e:
+            self.upstream_error = str(e)
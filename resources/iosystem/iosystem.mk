@@ -13,8 +13,12 @@
 # Rules for generating the .mem files for iosystems
 ####################################################
 
-# Makefile variable for the RARS simulator/assembler
-RARS = java -jar ../resources/rars1_6.jar
+# Makefile variable for the RARS assembler. The python assembler generates the same
+# memory files as the RARS jar without starting a JVM and runs the jar for programs that
+# use features it does not support (macros, .include, CSR and floating point instructions).
+# Always use the jar with:
+#   make RARS="java -jar ../resources/rars1_6.jar" <target>
+RARS = python3 ../resources/rars_asm.py
 
 # Rules for creating the text .mem file and the assembly debug file
 %_text.mem: %.s
@@ -24,6 +28,9 @@ RARS = java -jar ../resources/rars1_6.jar
 %_data.mem: %.s
 	$(RARS) mc CompactTextAtZero $<  a dump .data HexText $@
 
+# Keep the memory files when they are only built for a program simulation (sim_*_program_%)
+.PRECIOUS: %_text.mem %_data.mem
+
 ####################################################
 # Simulation Rules
 ####################################################
@@ -44,7 +51,43 @@ IOSYSTEM_SV_SOURCES = \
 	$(VGA_LOC)/charcolormem3bram.sv $(VGA_LOC)/brammacro.sv
 IOSYSTEM_V_SOURCES = $(RESOURCES_LOC)/glbl.v
 
-# Rule for analyzing all of the iosystem source files
-analyze_iosystem: $(IOSYSTEM_SV_SOURCES) $(IOSYSTEM_V_SOURCES)
-	xvlog -sv $(IOSYSTEM_SV_SOURCES) -nolog --include $(INCLUDE_DIR)
-	xvlog $(IOSYSTEM_V_SOURCES) -nolog --include $(INCLUDE_DIR)
+# Testbench package used by the testbenches of the iosystem labs
+TB_PKG_SOURCES = ../include/tb_riscv_pkg.sv
+
+####################################################
+# Precompiled iosystem library
+####################################################
+
+# The iosystem sources and the testbench package are the same in every lab. They are
+# analyzed once into an xsim library (IOSYSTEM_LIB) in a cache directory that is shared
+# by all labs. The name of the library directory includes a hash of the sources and of
+# the xvlog executable so a new library is created when either one changes. Rules that
+# use the library add $(IOSYSTEM_LIB_OPTS) to their xvlog/xelab commands.
+XSIM_LIB_CACHE ?= $(HOME)/.cache/ecen423/xsim
+IOSYSTEM_LIB = iosystem_lib
+IOSYSTEM_LIB_SOURCES = $(IOSYSTEM_SV_SOURCES) $(TB_PKG_SOURCES) $(IOSYSTEM_V_SOURCES)
+IOSYSTEM_LIB_HASH := $(shell (cat $(IOSYSTEM_LIB_SOURCES); readlink -f "$$(command -v xvlog)") 2>/dev/null | sha1sum | cut -c1-16)
+IOSYSTEM_LIB_DIR = $(XSIM_LIB_CACHE)/$(IOSYSTEM_LIB)_$(IOSYSTEM_LIB_HASH)
+IOSYSTEM_LIB_OPTS = -L $(IOSYSTEM_LIB)=$(IOSYSTEM_LIB_DIR)
+
+# The library is built while holding a lock so that concurrent builds (i.e., several
+# labs or submissions graded at the same time) analyze the sources only once. The
+# '.complete' file is created after all of the sources have been analyzed. It is touched
+# when the library with the same hash has already been built (i.e., the sources were
+# checked out again with the same contents) so the rule is not run again.
+$(IOSYSTEM_LIB_DIR)/.complete: $(IOSYSTEM_LIB_SOURCES)
+	mkdir -p $(XSIM_LIB_CACHE)
+	flock $(XSIM_LIB_CACHE)/.lock sh -e -c ' \
+		if [ ! -f $@ ]; then \
+			rm -rf $(IOSYSTEM_LIB_DIR); \
+			xvlog -sv $(IOSYSTEM_SV_SOURCES) $(TB_PKG_SOURCES) -nolog --work $(IOSYSTEM_LIB)=$(IOSYSTEM_LIB_DIR); \
+			xvlog $(IOSYSTEM_V_SOURCES) -nolog --work $(IOSYSTEM_LIB)=$(IOSYSTEM_LIB_DIR); \
+		fi; \
+		touch $@'
+
+# Rule for analyzing all of the iosystem source files (into the shared library)
+analyze_iosystem: $(IOSYSTEM_LIB_DIR)/.complete
+
+# Remove all versions of the precompiled iosystem library
+clean_iosystem_lib:
+	rm -rf $(XSIM_LIB_CACHE)/$(IOSYSTEM_LIB)_*
@@ -41,13 +41,30 @@ module riscv_mem (clk, rst, PC, iMemRead, instruction, dAddress, MemRead, MemWri
 	// Data memory
     logic [31:0] data_memory [0:DATA_WORDS-1];
 
+	// Memory files used to initialize the memories. In simulation, the memory files given by
+	// the parameters can be replaced when the simulation starts with the TEXT_MEM and DATA_MEM
+	// plusargs (i.e., 'xsim -testplusarg TEXT_MEM=program_text.mem'). This allows a single
+	// elaborated snapshot to simulate any number of programs.
+`ifndef SYNTHESIS
+	string text_memory_file = TEXT_MEMORY_FILENAME;
+	string data_memory_file = DATA_MEMORY_FILENAME;
+`else
+	localparam text_memory_file = TEXT_MEMORY_FILENAME;
+	localparam data_memory_file = DATA_MEMORY_FILENAME;
+`endif
+
 	// Initialize instruction memory
     initial
     begin
 		integer i;
 
+`ifndef SYNTHESIS
+		if ($value$plusargs("TEXT_MEM=%s", text_memory_file))
+			$display("**** Top-Level I/O System: Instruction memory file '%s' selected with plusarg ****",text_memory_file);
+`endif
+
 		// Load the Instruction Memory
-		if (TEXT_MEMORY_FILENAME == "") begin
+		if (text_memory_file == "") begin
 			$display("**** Top-Level I/O System: No instruction memory defined");
 			$finish;
 		end
@@ -56,18 +73,18 @@ module riscv_mem (clk, rst, PC, iMemRead, instruction, dAddress, MemRead, MemWri
 			for (i = 0; i < INSTRUCTION_WORDS; i=i+1)
 				inst_memory[i] = NOP_INSTRUCTION;
 			// Update memory with contents of memory file
-        	$readmemh(TEXT_MEMORY_FILENAME,inst_memory);
+        	$readmemh(text_memory_file,inst_memory);
 		end
 
 		// Debug messages for simulation
 
 		// synthesis translate_off
 		if (^inst_memory[0] === 1'bX || inst_memory[0] == NOP_INSTRUCTION ) begin
-			$display("**** Top-Level I/O System: Error - Instruction memory file '%s' failed to load ****",TEXT_MEMORY_FILENAME);
+			$display("**** Top-Level I/O System: Error - Instruction memory file '%s' failed to load ****",text_memory_file);
 			$finish;
 		end
 		else
-			$display("**** Top-Level I/O System: Instruction memory file '%s' loaded ****",TEXT_MEMORY_FILENAME);
+			$display("**** Top-Level I/O System: Instruction memory file '%s' loaded ****",text_memory_file);
 		// synthesis translate_on
     end
 
@@ -76,23 +93,28 @@ module riscv_mem (clk, rst, PC, iMemRead, instruction, dAddress, MemRead, MemWri
     initial
     begin
 
+`ifndef SYNTHESIS
+		if ($value$plusargs("DATA_MEM=%s", data_memory_file))
+			$display("**** Top-Level I/O System: Data memory file '%s' selected with plusarg ****",data_memory_file);
+`endif
+
 		// Load the Data Memory
-		if (DATA_MEMORY_FILENAME == "") begin
+		if (data_memory_file == "") begin
 			$display("**** Top-Level I/O System: Warning: No data memory defined");
 		end else begin
-        	$readmemh(DATA_MEMORY_FILENAME,data_memory);
+        	$readmemh(data_memory_file,data_memory);
 		end
 
 		// Debug messages for simulation
 
 		// synthesis translate_off
-		if (DATA_MEMORY_FILENAME != "")
+		if (data_memory_file != "")
 			if (^data_memory[0] === 1'bX) begin
-				$display("**** Top-Level I/O System: Error - Simulation model instruction memory %s failed to load****",DATA_MEMORY_FILENAME);
+				$display("**** Top-Level I/O System: Error - Simulation model instruction memory %s failed to load****",data_memory_file);
 				$finish;
 			end
 			else
-				$display("**** Top-Level I/O System: Data memory file '%s' loaded ****",DATA_MEMORY_FILENAME);
+				$display("**** Top-Level I/O System: Data memory file '%s' loaded ****",data_memory_file);
 		else
 				$display("**** No Data memory contents defined - no initalialization ****");
 		// synthesis translate_on
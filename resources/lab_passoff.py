@@ -23,6 +23,12 @@ import sys
 import re
 # For os.remove
 import os
+# Runs the tools and copies their output
+import clone_store
+import git_snapshot
+import log_store
+import process_runner
+import workspace
 
 
 # TODO Reused from pygrader
@@ -40,6 +46,30 @@ class TermColor:
 
 SCRIPT_VERSION = 1.0
 
+# Where the output of the tools run by subprocess_file_print is written
+OUTPUT_BOTH = "both"
+OUTPUT_FILE = "file"
+OUTPUT_STDOUT = "stdout"
+OUTPUT_NONE = "none"
+# Number of lines of output kept for the result of a command (printed when it fails and
+# the output was not printed)
+OUTPUT_TAIL_LINES = 20
+
+class subprocess_result:
+    ''' The result of a command run by lab_test.subprocess_file_print.
+        return_code - the return code (1 when the command was terminated on a kill pattern)
+        duration_seconds - the time the command ran
+        tail - the last lines of output (without the end of line)
+        usage - the resource usage (process_runner.resource_usage) of the command
+        terminated_msg - the reason the command was terminated (None if it exited)
+    '''
+    def __init__(self, return_code, duration_seconds, tail, usage = None, terminated_msg = None):
+        self.return_code = return_code
+        self.duration_seconds = duration_seconds
+        self.tail = tail
+        self.usage = usage
+        self.terminated_msg = terminated_msg
+
 class lab_test:
     ''' An instance of this class represents a specific test for a lab passoff.
         It contains the variables needed to implement a passoff script. The purpose
@@ -63,6 +93,11 @@ class lab_test:
         execution_path - represents the directory where the executables will run. By default
             this is the 'submission_lab_path'. When the -run_dir flag is given, this is relative
             to 'cwd'.
+        workspace - the workspace_manager of a clone that is placed in a RAM backed or local
+            directory rather than in the extract directory (None if the extract directory is used).
+            The logs and the files matching 'artifact_patterns' are copied back to the extract
+            directory by clean_up_test. The clone is kept in the workspace (without the files created
+            by the tests) and is updated by the next passoff unless --fresh_clone or --clean is given.
 
         This class also has a number of constants that are the same for all scripts.
 
@@ -82,6 +117,12 @@ class lab_test:
         self.proceed_with_tests = True
         # Directories to delete
         self.directories_to_delete = []
+        # Status of the submission files in the repository (see check_repo_file_status)
+        self.submission_status = None
+        # Workspace of the clone (see prepare_remote_repo)
+        self.workspace = None
+        # Files (relative to the lab directory) copied back from the workspace in addition to the logs
+        self.artifact_patterns = ["*.bit"]
         # Constants
         self.BASYS3_PART = "xc7a35tcpg236-1"
         self.STARTER_CODE_REPO = "git@github.com:byu-cpe/ecen323_student.git"
@@ -97,6 +138,10 @@ class lab_test:
         self.log = None
         self.tests_to_perform = []
         self.stepnum=1
+        # Write the logs of the tools as plain text rather than compressed (see log_store)
+        self.plain_logs = False
+        # Where the output of the tools is written by default (OUTPUT_BOTH, OUTPUT_FILE, ...)
+        self.output_mode = OUTPUT_BOTH
 
         # Final messages to print at end of passoff script
         self.final_messages = []
@@ -110,6 +155,8 @@ class lab_test:
 
         # Parse the arguments
         self.args = self.parser.parse_args()
+        self.plain_logs = self.args.plain_logs
+        self.output_mode = self.args.output
 
     def print_step_message(self,msg_str):
         self.print_color(TermColor.YELLOW, f"Step {self.stepnum}: {msg_str}")
@@ -190,10 +237,8 @@ class lab_test:
             # The current temporary tagged repository has been updated on the remote using
             # the github action. We need to update the local repository with the new tag
             # (updated by the actions) and checkout the modified tag.
-            #   Update the local tags and "force" to update the local lab submission tag
-            cmd = ["git", "fetch", "--tags", "--force"]
-            p = subprocess.run(cmd, cwd=self.submission_top_path, 
-                stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+            #   "force" the update of the local lab submission tag (only the tag is fetched)
+            clone_store.fetch_tag(self.submission_top_path, self.LAB_TAG_STRING, self.args.clone_mode)
             #   Checkout the new tag (which should have the commit string)
             cmd = ["git", "checkout", f"tags/{self.LAB_TAG_STRING}"]
             p = subprocess.run(cmd, cwd=self.submission_top_path, 
@@ -212,37 +257,66 @@ class lab_test:
         self.print_message_with_header("End of Passoff Script")
 
 
-    def subprocess_file_print(self,process_output_filepath, proc_cmd, proc_cwd):
+    def subprocess_file_print(self,process_output_filepath, proc_cmd, proc_cwd, kill_patterns = None,
+                              output = None, matchers = None, timeout_seconds = 0):
         """ 
         Complete a sub-process and print to a file and stdout.
-
-        Returns the sub-process return code.
-
-        TODO:Provide more options on output: 1. to stdout and file, 2. To one or the other, or 3. None
+        kill_patterns: regular expressions that terminate the process as soon as a line of its
+          output matches (the process is reported as failed)
+        output: where the output is written: OUTPUT_BOTH (stdout and the log file), OUTPUT_FILE,
+          OUTPUT_STDOUT or OUTPUT_NONE (default is the '--output' option)
+        matchers: list of (regex_str, callback) where callback(line, match) is called as soon as
+          a line of output matches the regular expression
+        timeout_seconds: the process (and its children) is terminated after this many seconds
+          (0 for no limit, the process is reported as failed)
+
+        The output is buffered and the sinks are flushed on an interval (see process_runner).
+        The last lines of output are printed when the command fails and its output was not
+        printed to stdout.
+
+        Returns a subprocess_result.
         """
-        with open(process_output_filepath, "w") as fp:
-            # Print command to file
-            fp.write("Executing the following command in directory:"+str(proc_cwd)+"\n\t")
-            for cmd in proc_cmd:
-                fp.write(str(cmd)+" ")
-            fp.write("\n")
-            # Execute command		
-            proc = subprocess.Popen(
-                proc_cmd,
-                cwd=proc_cwd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-            )
-            for line in proc.stdout:
-                sys.stdout.write(line)
-                fp.write(line)
-                fp.flush()
-            # Wait until process is done
-            proc.communicate()
-            #print("Proc return code",proc.returncode)
-            return proc.returncode
-        return 0
+        output = self.output_mode if output is None else output
+        tail = process_runner.tail_sink(OUTPUT_TAIL_LINES)
+        sinks = [tail]
+        if output in (OUTPUT_BOTH, OUTPUT_STDOUT):
+            sinks.append(process_runner.stream_sink(sys.stdout))
+        log = None
+        if output in (OUTPUT_BOTH, OUTPUT_FILE):
+            # The command is written at the start of the log (compressed unless --plain_logs is given)
+            header = "Executing the following command in directory:"+str(proc_cwd)+"\n\t"
+            header += "".join(str(cmd)+" " for cmd in proc_cmd) + "\n"
+            log = log_store.log_sink(process_output_filepath, header, plain = self.plain_logs)
+            sinks.append(log)
+        if matchers:
+            sinks.append(process_runner.matcher_sink(matchers))
+        try:
+            # The log is closed here (after the reason the process was terminated is written to it)
+            runner = process_runner.process_runner(proc_cmd, cwd=proc_cwd, sinks=sinks,
+                kill_patterns=kill_patterns, close_sinks=False, timeout_seconds=timeout_seconds)
+            return_code = runner.run()
+            terminated_msg = None
+            if runner.timed_out:
+                terminated_msg = f"Process terminated after {timeout_seconds} seconds"
+                self.print_error(terminated_msg)
+                if log is not None:
+                    log.write(terminated_msg + "\n")
+                return_code = 1
+            elif runner.kill_line is not None:
+                terminated_msg = f"Process terminated on output matching '{runner.kill_pattern}'"
+                self.print_error(f"{terminated_msg}:", runner.kill_line.strip())
+                if log is not None:
+                    log.write(terminated_msg + "\n")
+                return_code = 1
+        finally:
+            if log is not None:
+                log.close()
+        result = subprocess_result(return_code, runner.elapsed_seconds, tail.tail_lines(), runner.usage, terminated_msg)
+        if return_code != 0 and output not in (OUTPUT_BOTH, OUTPUT_STDOUT):
+            print(f"Last lines of output of '{proc_cmd[0]}' (return code {return_code}):")
+            for line in result.tail:
+                print("  " + line)
+        return result
 
     def check_executable_existence(self, command_list):
         # See if the executable is even in the path
@@ -375,13 +449,18 @@ class lab_test:
 
             ''' Clone Repository. When done, the 'student_repo_dir' variable will be set.
             '''
+            # See if the submission directory matches the local directory (don't want to overwrite
+            # or clean it)
+            if self.submission_top_path.resolve() == self.script_path.parent.resolve():
+                self.print_error("Extract directory and root of local repository are the same")
+                self.proceed_with_tests = False
+                return False
+            # An existing clone of the repository made by a passoff is updated to the tag rather than deleted
+            reuse_clone = not self.args.fresh_clone and clone_store.is_clone_of(self.submission_top_path, student_git_repo)
+            if reuse_clone:
+                print("Target directory",self.submission_top_path,"is a clone of",student_git_repo,"- will be updated")
             # See if directory exists
-            if self.submission_top_path.exists():
-                # See if the submission directory matches the local directory (don't want to overwrite)
-                if self.submission_top_path == self.script_path.parent:
-                    self.print_error("Extract directory and root of local repository are the same")
-                    self.proceed_with_tests = False
-                    return False
+            elif self.submission_top_path.exists():
                 if self.args.force:
                     print( "Target directory",self.submission_top_path,"exists. Will be deleted before proceeding")
                     shutil.rmtree(self.submission_top_path, ignore_errors=True)
@@ -400,6 +479,12 @@ class lab_test:
             # Save directory for deleting (if chosen)
             self.directories_to_delete.append(self.submission_top_path)
 
+            # Clone and run the tests in a faster workspace when there is one (the results are copied
+            # back to the extract directory when done). The clone is kept in the workspace for the
+            # next passoff (a clone in the extract directory is updated where it is).
+            if not self.args.no_workspace and not self.args.nodelete and not reuse_clone:
+                self.prepare_workspace(student_git_repo)
+
             # Perform the actual clone of the repo
             if not self.clone_repo(student_git_repo, self.submission_top_path,self.LAB_TAG_STRING):
                 self.print_error("Failed to clone repository")
@@ -489,7 +574,9 @@ class lab_test:
 
     def clone_repo(self, git_path, student_repo_path, lab_tag):
         '''
-        Clone student repository to local directory
+        Clone student repository to local directory (or update an existing clone of the
+        repository). Only the tag is fetched and the objects of the starter code are used
+        from a reference repository shared by all the clones (see clone_store).
         
         Parameters
         ----------
@@ -501,46 +588,21 @@ class lab_test:
             The path where the cloned repository should go
         
         '''
-        if student_repo_path.is_dir() and list(student_repo_path.iterdir()):
-            self.print_info(
-                "Student repo",
-                student_repo_path.name,
-                "already cloned. Re-fetching tag",
-            )
-
-            # Fetch
-            cmd = ["git", "fetch", "--tags", "-f"]
-            p = subprocess.run(cmd, cwd=student_repo_path)
-            if p.returncode:
-                self.print_error("git fetch failed")
-                return False
-
-            # Checkout tag
-            if self.LAB_TAG_STRING not in ("master", "main"):
-                tag = "tags/" + lab_tag
-            cmd = ["git", "checkout", tag, "-f"]
-            p = subprocess.run(cmd, cwd=student_repo_path)
-            if p.returncode:
-                self.print_error(TermColor.RED, "git checkout of tag failed")
-                return False
-            return True
-
-        self.print_info("Cloning repo, tag =", lab_tag)
-        cmd = [
-            "git",
-            "clone",
-            "--branch",
-            self.LAB_TAG_STRING,
-            git_path,
-            str(student_repo_path.absolute()),
-        ]
+        reference_path = None
+        if not self.args.no_reference:
+            store = clone_store.reference_store(self.STARTER_CODE_REPO, self.args.reference_dir)
+            if store.update(print_function = self.print_info):
+                reference_path = store.path
+        preparer = clone_store.clone_preparer(reference_path, self.args.clone_mode, self.print_info)
+        self.print_info("Preparing repo, tag =", lab_tag)
         try:
-            p = subprocess.run(cmd)
+            error = preparer.prepare(git_path, student_repo_path, lab_tag)
         except KeyboardInterrupt:
-            shutil.rmtree(str(student_repo_path))
+            if not preparer.reused:
+                shutil.rmtree(str(student_repo_path), ignore_errors=True)
             sys.exit(-1)
-        if p.returncode:
-            self.print_error("Clone failed")
+        if error is not None:
+            self.print_error("Clone failed:", error)
             return False
         return True
 
@@ -617,84 +679,59 @@ class lab_test:
                 self.proceed_with_tests = False
         return not error
     
+    def get_submission_status(self):
+        ''' Returns the git_snapshot.submission_status of the submission files (the git commands
+        are run the first time it is needed) '''
+        if self.submission_status is None:
+            self.submission_status = git_snapshot.submission_status(self.submission_lab_path,
+                self.submission_dict.values())
+        return self.submission_status
+
     def check_for_required_files(self):
         ''' Checks to make sure all required files exist in the file system. '''
-        status = True
         # Make sure the files are in the repository
-        files_to_check = []
-        for filename in self.submission_dict.values():
-            cmd = ["git", "ls-files", filename]
-            proc = subprocess.run(cmd, cwd=str(self.submission_lab_path),
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                text=True,
-                                check=True)
-            git_file = proc.stdout.rstrip()
-            if git_file != filename:
-                print(f"Required file {filename} not in repository ({git_file})")
-                status = False
-            else:
-                files_to_check.append(filename)
-        return status
+        missing_files = self.get_submission_status().missing_files
+        for filename in missing_files:
+            print(f"Required file {filename} not in repository")
+        return not missing_files
 
     def check_for_git_file_status(self):
-        status = True
         # Make sure the files are up to date and committed
-        cmd = ["git", "status", "--porcelain"]
-        for filename in self.submission_dict.values():
-            cmd.append(filename)
-        proc = subprocess.run(cmd, cwd=str(self.submission_lab_path),
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True,
-                            check=True)
-        if proc.stdout != "":
-            modified_files=[]
-            status = False
-            for line in proc.stdout.splitlines():
-                status, file_repo_name = line[:2], line[3:]
-                filename = pathlib.PurePath(file_repo_name).name
-                modified_files.append(filename)
+        modified_files = self.get_submission_status().modified_files
+        if modified_files:
             print("Warning: The following files have been modified and need to be committed:")
             for mfile in modified_files:
-                print(f" {mfile}")
-        return status
+                print(f" {pathlib.PurePath(mfile).name}")
+        return not modified_files
 
     def check_for_git_pending_push(self):
-        status = True
         # Make sure all the commits have been pushed
-        cmd = ["git", "diff", "--stat", "--cached", "origin/main" ]
-        proc = subprocess.run(cmd, cwd=str(self.submission_lab_path),
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True,
-                            check=True)
-        if proc.stdout != "":
-            status = False
-            print("Warning: Pending commits have not been pushed")
-        return status
+        status = self.get_submission_status()
+        if status.upstream_error is not None:
+            print(f"Warning: Cannot compare to {status.upstream}: {status.upstream_error}")
+            return False
+        if status.ahead > 0:
+            print(f"Warning: Pending commits have not been pushed ({status.ahead} commits ahead of {status.upstream})")
+        if status.behind > 0:
+            print(f"Warning: {status.upstream} has {status.behind} commits that are not in the local repository")
+        return status.ahead == 0 and status.behind == 0
 
     def check_for_git_untracked_files(self):
-        status = True
-        # See if there are any ignored directories
-        cmd = ["git", "ls-files", "--others", "--exclude-standard" ]
-        proc = subprocess.run(cmd, cwd=str(self.submission_lab_path),
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True,
-                            check=True)
-        if proc.stdout != "":
-            status = False
+        # See if there are any untracked files
+        untracked_files = self.get_submission_status().untracked_files
+        if untracked_files:
             print("Warning: Untracked files in repository")
-            for line in proc.stdout.splitlines():
-                print(" "+line)
-        return status
+            for filename in untracked_files:
+                print(" "+filename)
+        return not untracked_files
 
     def check_repo_file_status(self):
         ''' Checks the respository to make sure that all expected files are committed and that
         there are no changes in these files. Returns True if the files are properly committed
-        and false otherwise. '''
+        and false otherwise. The status of the repository is read with a constant number of
+        git commands (see git_snapshot.submission_status). '''
 
+        self.submission_status = None
         required_files = self.check_for_required_files()
         file_commit_status = self.check_for_git_file_status()
         pending_push = self.check_for_git_pending_push()
@@ -738,10 +775,36 @@ class lab_test:
             #self.proceed_with_tests = False
         return result
 
+    def prepare_workspace(self, student_git_repo):
+        ''' Choose a workspace for the clone. When one is chosen, submission_top_path and
+            submission_lab_path are moved to the workspace. A clone of the repository kept in
+            the workspace by an earlier passoff is reused. '''
+        min_free_bytes = int(self.args.workspace_min_free_gb * 1024 ** 3)
+        self.workspace = workspace.workspace_manager(self.submission_top_path, self.args.workspace_dir, min_free_bytes)
+        workspace_path = self.workspace.choose()
+        if workspace_path is None:
+            self.workspace = None
+            return
+        for pattern in self.artifact_patterns:
+            self.workspace.add_artifact(pattern)
+        if not self.args.fresh_clone and clone_store.is_clone_of(workspace_path, student_git_repo):
+            print(f"Workspace {workspace_path} has a clone of {student_git_repo} - will be updated")
+        else:
+            # A workspace left by an earlier passoff that did not finish (or of another repository)
+            shutil.rmtree(workspace_path, ignore_errors=True)
+        print(f"Using {self.workspace.kind} workspace {workspace_path} (results are copied to {self.submission_top_path})")
+        self.submission_top_path = workspace_path
+        self.submission_lab_path = self.submission_top_path / self.LAB_DIR_NAME
+
     def clean_up_test(self):
         ''' Should be called at the end of a test. It closes the log file and deletes the temporary directory. '''
         if self.log:
             self.log.close()
+        # Copy the results from the workspace and remove it (or only the files created by the tests
+        # when the clone is kept for the next passoff)
+        if self.workspace is not None:
+            keep_clone = not self.args.fresh_clone and not self.args.clean
+            self.workspace.clean_up(self.LAB_DIR_NAME, self.print_info, keep_clone)
         # Delete temporary directories
         if self.args.clean:
             for directory in self.directories_to_delete:
@@ -800,6 +863,22 @@ class lab_passoff_argparse(argparse.ArgumentParser):
         # Clean up the temporary directory
         self.add_argument("--clean", action="store_true", help="Clean up any directories that are created")
 
+        # Clone preparation
+        self.add_argument("--clone_mode", choices=clone_store.CLONE_MODES, default=clone_store.CLONE_SHALLOW,
+            help="Fetch only the commit of the tag (shallow), all commits without the file contents (partial) or everything (full)")
+        self.add_argument("--reference_dir", type=str,
+            help=f"Reference repository of the starter code shared by the clones (default is in ${clone_store.REFERENCE_STORE_ENV} or ~/.cache/ecen423/reference)")
+        self.add_argument("--no_reference", action="store_true", help="Do not use a reference repository for the clone")
+        self.add_argument("--fresh_clone", action="store_true", help="Delete an existing clone of the repository rather than updating it")
+
+        # Workspace for the clone
+        self.add_argument("--no_workspace", action="store_true",
+            help="Clone and run the tests in the extract directory (default is a RAM backed or local directory when available)")
+        self.add_argument("--workspace_dir", type=str,
+            help=f"Directory to try first for the workspace (default is ${workspace.WORKSPACE_DIR_ENV}, /dev/shm, $XDG_RUNTIME_DIR, /tmp)")
+        self.add_argument("--workspace_min_free_gb", type=float, default=workspace.MIN_FREE_BYTES / 1024 ** 3,
+            help="Free space needed in the file system of the workspace")
+
         # Do not clean up the temporary directory
         self.add_argument("--notest", action="store_true", help="Do not run the tests")
 
@@ -808,5 +887,12 @@ class lab_passoff_argparse(argparse.ArgumentParser):
         #  This is helpful if the students want to debug their files before going through the entire process of pushing and tagging.
         self.add_argument("--local", action="store_true", help="Perform passoff script on local repository rather than cloning the remote repository")
 
+        # Output of the tools
+        self.add_argument("--output", choices=[OUTPUT_BOTH, OUTPUT_FILE], default=OUTPUT_BOTH,
+            help="Copy the output of the tools to stdout and the log files (both) or only to the log files (file). The last lines of a command that fails are printed.")
+
+        # Plain logs
+        self.add_argument("--plain_logs", action="store_true", help="Write the tool logs as plain text (default is compressed '.gz' logs)")
+
         # Check repository
         self.add_argument("--check_repo", action="store_true", help="Checks the repository for correctness (for local option only)")
@@ -948,134 +948,143 @@ set data_1 mem/data_memory_reg_1
 #  updateMem <checkpoint file> <.text file> <.data file> <bitstream file>
 #
 #  Commands for updating the character memory and font ROM
-if { [llength $argv] > 0 } {
-	# copy command name
-	set command [lindex $argv 0]
-
-	# Open checkpoint file (must have check point file as second argument)
-	if {[llength $argv] > 1} {
-		set checkpointFilename [lindex $argv 1]
-		open_checkpoint $checkpointFilename
 
-		if {[string equal $command "dumpMem"]} {
-			puts "Executing 'dumpMem' command"
-			# Output file for dump
-			if {[llength $argv] > 2} {
-				set outputFilename [lindex $argv 2]
-				set filehandle [open $outputFilename w]
+# Execute a command on the design that is open. The argument list is the same as the
+# script arguments (the command name followed by the checkpoint file and the command
+# arguments) but the checkpoint is not opened by this procedure. The procedure is also
+# used by vivado_server.py, which keeps the checkpoint open between commands.
+proc load_mem_command { argv } {
+	global inst_0 inst_1 data_0 data_1
+	set command [lindex $argv 0]
+	if {[string equal $command "dumpMem"]} {
+		puts "Executing 'dumpMem' command"
+		# Output file for dump
+		if {[llength $argv] > 2} {
+			set outputFilename [lindex $argv 2]
+			set filehandle [open $outputFilename w]
+		} else {
+			set filehandle stdout
+		}
+		dumpMemory instruction_reg $filehandle
+		dumpMemory data_memory_reg $filehandle
+		if {[llength $argv] > 2} {
+			close $filehandle
+		}
+	} elseif {[string equal $command "updateMem"]} {
+		#  updateMem <cheeckpoint> <.text file> <.data file> <bitstream file>
+		puts "Executing 'updateMem' command"
+		if {[llength $argv] < 5} {
+			puts "Missing arguments: updateMem <checkpoint file> <.text file> <.data file> <bitstream file> \[optional .dcp file\]"
+		} else {
+			# Extract parameters
+			set textFileName [lindex $argv 2]
+			set dataFileName [lindex $argv 3]
+			set bitstreamName [lindex $argv 4]
+			if {[llength $argv] >= 6} {
+				set checkpointname [lindex $argv 5]
 			} else {
-				set filehandle stdout
+				set checkpointname ""
 			}
-			dumpMemory instruction_reg $filehandle
-			dumpMemory data_memory_reg $filehandle
-			if {[llength $argv] > 2} {
-				close $filehandle
-			}
-		} elseif {[string equal $command "updateMem"]} {
-			#  updateMem <cheeckpoint> <.text file> <.data file> <bitstream file>
-			puts "Executing 'updateMem' command"
-			if {[llength $argv] < 5} {
-				puts "Missing arguments: updateMem <checkpoint file> <.text file> <.data file> <bitstream file> \[optional .dcp file\]"
+			updateRiscvMemories $textFileName $dataFileName $bitstreamName $checkpointname
+		}
+	} elseif {[string equal $command "updateMem2"]} {
+		#  updateMem <cheeckpoint> <.text file> <.data file> <bitstream file>
+		puts "Executing 'updateMem' command"
+		if {[llength $argv] < 5} {
+			puts "Missing arguments: updateMem2 <checkpoint file> <.text file> <.data file> <bitstream file> \[optional .dcp file\]"
+		} else {
+			# Extract parameters
+			set textFileName [lindex $argv 2]
+			set dataFileName [lindex $argv 3]
+			set bitstreamName [lindex $argv 4]
+			if {[llength $argv] >= 6} {
+				set checkpointname [lindex $argv 5]
 			} else {
-				# Extract parameters
-				set textFileName [lindex $argv 2]
-				set dataFileName [lindex $argv 3]
-				set bitstreamName [lindex $argv 4]
-				if {[llength $argv] >= 6} {
-					set checkpointname [lindex $argv 5]
-				} else {
-					set checkpointname ""
-				}
-				updateRiscvMemories $textFileName $dataFileName $bitstreamName $checkpointname
+				set checkpointname ""
 			}
-		} elseif {[string equal $command "updateMem2"]} {
-			#  updateMem <cheeckpoint> <.text file> <.data file> <bitstream file>
-			puts "Executing 'updateMem' command"
-			if {[llength $argv] < 5} {
-				puts "Missing arguments: updateMem2 <checkpoint file> <.text file> <.data file> <bitstream file> \[optional .dcp file\]"
-			} else {
-				# Extract parameters
-				set textFileName [lindex $argv 2]
-				set dataFileName [lindex $argv 3]
+			updateRiscvMemories2 $textFileName $dataFileName $bitstreamName $checkpointname
+		}
+	} elseif {[string equal $command "updateData"]} {
+		puts "Executing 'updateData' command"
+		if {[llength $argv] < 4} {
+			puts "Missing arguments: updateData <checkpoint file> <.data file> <bitstream file> \[optional .dcp file\]"
+		} else {
+			# Load the .data file
+			set dataFileName [lindex $argv 2]
+			# arguments: list of data memory brams, signal name of data memory, data memory input filename
+			#load_brams_dict_32hextext [list data_memory_reg_0 data_memory_reg_1 ] data_memory_read_wb $dataFileName
+			load_brams_dict_32hextext [list $data_0 $data_1 ] mem/dReadData $dataFileName
+			# Write the bitfile
+			set bitstreamName [lindex $argv 3]
+			write_bitstream -force $bitstreamName
+			# See if there is a checkpoint write command
+			if {[llength $argv] >= 5} {
+				puts "Generating new checkpoint file"
 				set bitstreamName [lindex $argv 4]
-				if {[llength $argv] >= 6} {
-					set checkpointname [lindex $argv 5]
-				} else {
-					set checkpointname ""
-				}
-				updateRiscvMemories2 $textFileName $dataFileName $bitstreamName $checkpointname
-			}
-		} elseif {[string equal $command "updateData"]} {
-			puts "Executing 'updateData' command"
-			if {[llength $argv] < 4} {
-				puts "Missing arguments: updateData <checkpoint file> <.data file> <bitstream file> \[optional .dcp file\]"
-			} else {
-				# Load the .data file
-				set dataFileName [lindex $argv 2]
-				# arguments: list of data memory brams, signal name of data memory, data memory input filename
-				#load_brams_dict_32hextext [list data_memory_reg_0 data_memory_reg_1 ] data_memory_read_wb $dataFileName
-				load_brams_dict_32hextext [list $data_0 $data_1 ] mem/dReadData $dataFileName
-				# Write the bitfile
-				set bitstreamName [lindex $argv 3]
-				write_bitstream -force $bitstreamName
-				# See if there is a checkpoint write command
-				if {[llength $argv] >= 5} {
-					puts "Generating new checkpoint file"
-					set bitstreamName [lindex $argv 4]
-					write_checkpoint $bitstreamName -force
-				}
+				write_checkpoint $bitstreamName -force
 			}
-		} elseif {[string equal $command "updateFont"]} {
+		}
+	} elseif {[string equal $command "updateFont"]} {
 #vivado -mode batch -source ../../project/solution/load_mem.tcl -tclargs updateFont ./final.dcp ../../project/solution/font_mem_mod.txt font.bit font.dcp			puts "Executing 'updateFont' command"
-			if {[llength $argv] < 4} {
-				puts "Missing arguments:"
-			} else {
-				# Load the .text file
-				set textFileName [lindex $argv 2]
-				#set bram vga/charGen/fontrom/addr_reg_reg
-				set bram iosystem/vga/charGen/fontrom/addr_reg_reg
-				load_mem_font $bram $textFileName
-				# Write the bitfile
-				set bitstreamName [lindex $argv 3]
-				write_bitstream -force $bitstreamName
-				# See if there is a checkpoint write command
-				if {[llength $argv] >= 5} {
-					puts "Generating new checkpoint file"
-					set checkpointName [lindex $argv 4]
-					write_checkpoint $checkpointName -force
-				}
+		if {[llength $argv] < 4} {
+			puts "Missing arguments:"
+		} else {
+			# Load the .text file
+			set textFileName [lindex $argv 2]
+			#set bram vga/charGen/fontrom/addr_reg_reg
+			set bram iosystem/vga/charGen/fontrom/addr_reg_reg
+			load_mem_font $bram $textFileName
+			# Write the bitfile
+			set bitstreamName [lindex $argv 3]
+			write_bitstream -force $bitstreamName
+			# See if there is a checkpoint write command
+			if {[llength $argv] >= 5} {
+				puts "Generating new checkpoint file"
+				set checkpointName [lindex $argv 4]
+				write_checkpoint $checkpointName -force
 			}
-		} elseif {[string equal $command "updateBackground"]} {
+		}
+	} elseif {[string equal $command "updateBackground"]} {
 #vivado -mode batch -source ../../project/solution/load_mem.tcl -tclargs updateFont ./final.dcp ../../project/solution/font_mem_mod.txt font.bit font.dcp			puts "Executing 'updateFont' command"
-			puts "Executing 'updateBackground' command"
-			if {[llength $argv] < 4} {
-				puts "Missing arguments:"
-			} else {
-				# Load the .text file
-				set textFileName [lindex $argv 2]
-				# Set background vga values
-				set bram0 iosystem/vga/charGen/charmem/BRAM_inst_0/bram
-				set bram1 iosystem/vga/charGen/charmem/BRAM_inst_1/bram
-				set bram2 iosystem/vga/charGen/charmem/BRAM_inst_2/bram
-				set bram3 iosystem/vga/charGen/charmem/BRAM_inst_3/bram
-				set bramList [ list $bram0 $bram1 $bram2 $bram3 ]
-
-				# Load memories
-				load_brams_interleaved_32hextext  $bramList $textFileName
-
-				# Write the bitfile
-				set bitstreamName [lindex $argv 3]
-				write_bitstream -force $bitstreamName
-				# See if there is a checkpoint write command
-				if {[llength $argv] >= 5} {
-					puts "Generating new checkpoint file"
-					set checkpointName [lindex $argv 4]
-					write_checkpoint $checkpointName -force
-				}
-			}
+		puts "Executing 'updateBackground' command"
+		if {[llength $argv] < 4} {
+			puts "Missing arguments:"
 		} else {
-			puts "Unknown command: $command"
+			# Load the .text file
+			set textFileName [lindex $argv 2]
+			# Set background vga values
+			set bram0 iosystem/vga/charGen/charmem/BRAM_inst_0/bram
+			set bram1 iosystem/vga/charGen/charmem/BRAM_inst_1/bram
+			set bram2 iosystem/vga/charGen/charmem/BRAM_inst_2/bram
+			set bram3 iosystem/vga/charGen/charmem/BRAM_inst_3/bram
+			set bramList [ list $bram0 $bram1 $bram2 $bram3 ]
+
+			# Load memories
+			load_brams_interleaved_32hextext  $bramList $textFileName
+
+			# Write the bitfile
+			set bitstreamName [lindex $argv 3]
+			write_bitstream -force $bitstreamName
+			# See if there is a checkpoint write command
+			if {[llength $argv] >= 5} {
+				puts "Generating new checkpoint file"
+				set checkpointName [lindex $argv 4]
+				write_checkpoint $checkpointName -force
+			}
 		}
+	} else {
+		puts "Unknown command: $command"
+	}
+}
+
+if { [info exists load_mem_library] } {
+	# The script was sourced for its procedures (i.e., by vivado_server.py)
+} elseif { [llength $argv] > 0 } {
+	# Open checkpoint file (must have check point file as second argument)
+	if {[llength $argv] > 1} {
+		set checkpointFilename [lindex $argv 1]
+		open_checkpoint $checkpointFilename
+		load_mem_command $argv
 	} else {
 		puts "Missing Checkpoint file"
 	}
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+
+'''
+Finds which of a set of regular expressions match in a (log) file with a single read.
+
+Several checks are usually made on the same log file (i.e., the lab11 'fib_main.log'
+has nine 'file_regex_check' tests). A 'log_scanner' reads the file once (or maps it
+into memory if it is large) and resolves every pattern against the same contents.
+
+A regular expression made of the alternation of all of the patterns is much slower
+than the separate patterns with the Python 're' module: the search for a pattern
+that starts with a literal string jumps directly to the occurrences of the string
+but the search for an alternation tries every alternative at every position. The
+patterns are therefore grouped by their leading literal text. Each group is compiled
+into one expression that starts with the literal text the patterns of the group have
+in common, followed by the alternation of the rest of each pattern. The contents
+are searched once for each group (from the position of the last match, after the
+patterns that matched are removed). Patterns without a long enough literal prefix,
+with back references, with inline flags or with an alternation at the top level
+(the prefix would become part of every alternative) are searched on their own, and
+so is a pattern that is the only one with its prefix.
+
+Files larger than MMAP_THRESHOLD_BYTES are searched with 'bytes' patterns through
+a memory map (the ASCII semantics of \\s, \\w and \\d are used and line endings are not
+translated). A compressed log (see log_store) is decompressed into memory when the
+plain file does not exist.
+'''
+
+import mmap
+import os
+import re
+
+import log_store
+
+# Minimum number of leading literal characters shared by the patterns of a group
+MIN_GROUP_PREFIX = 4
+# Files at least this large are searched through a memory map rather than read
+MMAP_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# Characters with a special meaning in a pattern and the quantifiers that can follow a literal
+SPECIAL_CHARACTERS = ".^$*+?{}[]()|\\"
+QUANTIFIER_CHARACTERS = "*+?{"
+# Back references and conditional groups refer to group numbers that change when combined
+GROUP_REFERENCE_REGEX = re.compile(r"\\[1-9]|\(\?\(")
+
+def has_top_level_alternation(regex_str):
+    ''' Returns True if the pattern has a '|' outside of its groups and character sets '''
+    depth = 0
+    position = 0
+    while position < len(regex_str):
+        character = regex_str[position]
+        if character == "\\":
+            position += 1
+        elif character == "[":
+            # A ']' at the start of the set (after an optional '^') is part of the set
+            position += 1
+            if regex_str[position:position + 1] == "^":
+                position += 1
+            if regex_str[position:position + 1] == "]":
+                position += 1
+            while position < len(regex_str) and regex_str[position] != "]":
+                position += 2 if regex_str[position] == "\\" else 1
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "|" and depth == 0:
+            return True
+        position += 1
+    return False
+
+def literal_prefix(regex_str):
+    ''' Returns the leading literal text of a pattern and a list with the end offset in
+    regex_str of each of its characters (i.e., 'Mem\\[0x' is 'Mem[0x' with offsets
+    [1, 2, 3, 5, 6, 7]) '''
+    text = ""
+    offsets = []
+    position = 0
+    while position < len(regex_str):
+        character = regex_str[position]
+        length = 1
+        if character == "\\":
+            # Only escaped punctuation is a literal (\n, \d, \x41 ... are not handled)
+            if position + 1 >= len(regex_str) or regex_str[position + 1].isalnum():
+                break
+            character = regex_str[position + 1]
+            length = 2
+        elif character in SPECIAL_CHARACTERS:
+            break
+        end = position + length
+        # A literal followed by a quantifier is not part of the prefix
+        if end < len(regex_str) and regex_str[end] in QUANTIFIER_CHARACTERS:
+            break
+        text += character
+        offsets.append(end)
+        position = end
+    return text, offsets
+
+class pattern_group():
+    ''' Patterns with the same leading literal text searched with a single expression.
+    prefix: the literal text shared by the patterns
+    members: list of (regex_str, remainder) where the remainder is the pattern after the prefix '''
+    def __init__(self, prefix, members):
+        self.prefix = prefix
+        self.members = members
+
+    def combined_regex(self, members):
+        alternatives = "|".join(f"(?P<_scan{index}>{remainder})" for index, (_, remainder) in enumerate(members))
+        return re.escape(self.prefix) + "(?:" + alternatives + ")"
+
+    def search(self, contents, compile_pattern):
+        ''' Returns the set of patterns of the group that match in the contents '''
+        matched = set()
+        pending = list(self.members)
+        position = 0
+        while pending:
+            try:
+                regex = compile_pattern(self.combined_regex(pending))
+            except re.error:
+                # The patterns cannot be combined (i.e., the same group name is used twice)
+                for regex_str, _ in pending:
+                    if compile_pattern(regex_str).search(contents, position):
+                        matched.add(regex_str)
+                break
+            match = regex.search(contents, position)
+            if match is None:
+                break
+            index = int(match.lastgroup[len("_scan"):])
+            matched.add(pending[index][0])
+            del pending[index]
+            # The other patterns may also match at the same position
+            position = match.start()
+        return matched
+
+class log_scanner():
+    ''' Determines which of a set of regular expressions match in a file '''
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.patterns = []
+
+    def add_pattern(self, regex_str):
+        if regex_str not in self.patterns:
+            self.patterns.append(regex_str)
+
+    def group_patterns(self):
+        ''' Returns the pattern groups (single patterns are groups with an empty prefix) '''
+        groups = []
+        by_prefix = {}
+        for regex_str in self.patterns:
+            prefix, offsets = literal_prefix(regex_str)
+            if len(prefix) < MIN_GROUP_PREFIX or GROUP_REFERENCE_REGEX.search(regex_str) or \
+               has_top_level_alternation(regex_str):
+                groups.append(pattern_group("", [(regex_str, regex_str)]))
+                continue
+            by_prefix.setdefault(prefix[:MIN_GROUP_PREFIX], []).append((regex_str, prefix, offsets))
+        for members in by_prefix.values():
+            if len(members) == 1:
+                groups.append(pattern_group("", [(members[0][0], members[0][0])]))
+                continue
+            common = os.path.commonprefix([prefix for _, prefix, _ in members])
+            groups.append(pattern_group(common,
+                [(regex_str, regex_str[offsets[len(common) - 1]:]) for regex_str, _, offsets in members]))
+        return groups
+
+    def scan(self):
+        ''' Returns a dictionary with True for each pattern that matches in the file '''
+        matched = set()
+        if not os.path.exists(self.filepath) or os.path.getsize(self.filepath) < MMAP_THRESHOLD_BYTES:
+            with log_store.open_log(self.filepath) as fp:
+                contents = fp.read()
+            for group in self.group_patterns():
+                matched |= group.search(contents, re.compile)
+        else:
+            with open(self.filepath, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                compile_bytes = lambda regex_str: re.compile(regex_str.encode("utf-8"))
+                for group in self.group_patterns():
+                    matched |= group.search(contents, compile_bytes)
+        return {regex_str : regex_str in matched for regex_str in self.patterns}
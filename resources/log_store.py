@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+'''
+Compressed storage for the logs of the tools run by the tests.
+
+A compressed log ('<name>.gz') is a sequence of independent gzip members. Each member
+holds about LOG_BLOCK_BYTES of complete lines of text so the file can be read with
+the usual tools (zcat, zless, gzip -d) and a region of the log can be decompressed
+without reading the members before it. The members are listed in a small index file
+('<name>.gz.idx') with one line per member:
+
+  <uncompressed offset> <compressed offset> <first line number>
+
+The readers (open_log, read_log_lines) accept the name of the plain log and use
+the compressed log when the plain log does not exist. The tests are run with plain
+logs with the '--plain_logs' option.
+
+Example:
+  log_store.py make_sim_riscv_final.log --start 120000 --count 40
+'''
+
+import argparse
+import bisect
+import gzip
+import os
+import sys
+
+import process_runner
+
+# Amount of text compressed into each gzip member
+LOG_BLOCK_BYTES = 1024 * 1024
+# Level 1 is about 3x faster than the default level 6 and the logs are only about 10% larger
+LOG_COMPRESS_LEVEL = 1
+COMPRESSED_SUFFIX = ".gz"
+INDEX_SUFFIX = ".idx"
+
+def compressed_path(filepath):
+    return f"{filepath}{COMPRESSED_SUFFIX}"
+
+def index_path(filepath):
+    ''' The index of a compressed log (filepath is the name of the plain log) '''
+    return f"{filepath}{COMPRESSED_SUFFIX}{INDEX_SUFFIX}"
+
+class compressed_log_sink():
+    ''' Writes a log as a sequence of indexed gzip members (a process_runner sink).
+    filepath: the name of the plain log ('.gz' is added)
+    header: text written at the start of the log '''
+    def __init__(self, filepath, header = None, block_bytes = LOG_BLOCK_BYTES):
+        self.filepath = compressed_path(filepath)
+        self.index_filepath = index_path(filepath)
+        self.block_bytes = block_bytes
+        self.fp = open(self.filepath, "wb")
+        self.index_fp = open(self.index_filepath, "w")
+        # Text of the member that is being filled
+        self.block = []
+        self.block_size = 0
+        self.uncompressed_offset = 0
+        self.line_count = 0
+        if header is not None:
+            self.write(header)
+
+    def write(self, text):
+        data = text.encode("utf-8", errors="replace")
+        self.block.append(data)
+        self.block_size += len(data)
+        if self.block_size >= self.block_bytes:
+            self.write_block()
+
+    def write_block(self, final = False):
+        ''' Compress the complete lines of the block into a gzip member (and the rest of
+        the block if this is the last member) '''
+        data = b"".join(self.block)
+        end = len(data) if final else data.rfind(b"\n") + 1
+        self.block = [data[end:]] if end < len(data) else []
+        self.block_size = len(data) - end
+        if end == 0:
+            return
+        self.index_fp.write(f"{self.uncompressed_offset} {self.fp.tell()} {self.line_count}\n")
+        self.fp.write(gzip.compress(data[:end], compresslevel=LOG_COMPRESS_LEVEL, mtime=0))
+        self.uncompressed_offset += end
+        self.line_count += data.count(b"\n", 0, end)
+
+    def flush(self):
+        # The block stays open (small members compress poorly)
+        self.fp.flush()
+        self.index_fp.flush()
+
+    def close(self):
+        if self.fp.closed:
+            return
+        self.write_block(final = True)
+        self.fp.close()
+        self.index_fp.close()
+
+def log_sink(filepath, header = None, plain = False):
+    ''' Returns the sink for a tool log: a compressed log or, when plain is True, a text file.
+    The sink has the name of the file that is written in 'filepath'. The files of the log
+    of an earlier run are deleted so the readers never find a stale plain or compressed log. '''
+    remove_log(filepath)
+    if not plain:
+        return compressed_log_sink(filepath, header)
+    sink = process_runner.file_sink(filepath, header)
+    sink.filepath = str(filepath)
+    return sink
+
+def log_filepaths(filepath):
+    ''' All of the files that may be written for a log (plain, compressed and index) '''
+    return [str(filepath), compressed_path(filepath), index_path(filepath)]
+
+def remove_log(filepath):
+    ''' Delete all of the files of a log '''
+    for log_filepath in log_filepaths(filepath):
+        try:
+            os.remove(log_filepath)
+        except FileNotFoundError:
+            pass
+
+def find_log(filepath):
+    ''' Returns the path of the plain log or of the compressed log (None if neither exists) '''
+    if os.path.exists(filepath):
+        return str(filepath)
+    if os.path.exists(compressed_path(filepath)):
+        return compressed_path(filepath)
+    return None
+
+def log_exists(filepath):
+    return find_log(filepath) is not None
+
+def open_log(filepath):
+    ''' Open a plain or compressed log for reading text '''
+    log_filepath = find_log(filepath)
+    if log_filepath is None:
+        raise FileNotFoundError(f"No log file: {filepath}")
+    if log_filepath.endswith(COMPRESSED_SUFFIX):
+        return gzip.open(log_filepath, "rt", errors="replace")
+    return open(log_filepath, "r")
+
+def read_index(filepath):
+    ''' Returns the (uncompressed offset, compressed offset, first line number) of each member
+    of a compressed log (empty if there is no index) '''
+    try:
+        with open(index_path(filepath)) as fp:
+            return [tuple(int(field) for field in line.split()) for line in fp if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+def read_log_lines(filepath, start_line = 0, line_count = None):
+    ''' Iterate over the lines of a log (without the end of line) starting at line number
+    start_line. Only the members of a compressed log from the member with start_line
+    are decompressed. '''
+    log_filepath = find_log(filepath)
+    if log_filepath is None:
+        raise FileNotFoundError(f"No log file: {filepath}")
+    line_number = 0
+    if log_filepath.endswith(COMPRESSED_SUFFIX):
+        index = read_index(filepath)
+        position = bisect.bisect_right([entry[2] for entry in index], start_line) - 1
+        compressed_offset = 0
+        if position >= 0:
+            line_number = index[position][2]
+            compressed_offset = index[position][1]
+        raw_fp = open(log_filepath, "rb")
+        raw_fp.seek(compressed_offset)
+        fp = gzip.open(raw_fp, "rt", errors="replace")
+    else:
+        raw_fp = None
+        fp = open(log_filepath, "r", errors="replace")
+    try:
+        for line in fp:
+            if line_number >= start_line:
+                if line_count is not None and line_number >= start_line + line_count:
+                    return
+                yield line.rstrip("\n")
+            line_number += 1
+    finally:
+        fp.close()
+        if raw_fp is not None:
+            raw_fp.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the lines of a plain or compressed log")
+    parser.add_argument("log", type=str, help="Name of the log (without the '.gz')")
+    parser.add_argument("--start", type=int, default=0, help="First line number to print (from 0)")
+    parser.add_argument("--count", type=int, help="Number of lines to print (default is the rest of the log)")
+    args = parser.parse_args()
+    filepath = args.log[:-len(COMPRESSED_SUFFIX)] if args.log.endswith(COMPRESSED_SUFFIX) else args.log
+    try:
+        for line in read_log_lines(filepath, args.start, args.count):
+            print(line)
+    except FileNotFoundError as e:
+        print(e)
+        return 1
+    except BrokenPipeError:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
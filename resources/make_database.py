@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+'''
+Functions for querying the rule database of a Makefile.
+
+The database is obtained by running 'make' in dry-run mode with the
+'--print-data-base' option ('make -pn'). This gives the prerequisites of
+every file make considered while planning the given goals, including
+prerequisites found through pattern rules (i.e., '%_text.mem: %.s') and
+the Makefile fragments that were included.
+'''
+
+import subprocess
+import re
+
+# Matches a target line in the 'Files' section of the database (but not variable assignments)
+TARGET_LINE_RE = re.compile(r"^([^#\s:][^:=]*?)(::?)(?![=])\s*(.*)$")
+
+class make_target():
+    ''' A single file entry from the make database.
+    name: the target (file) name
+    prerequisites: list of normal prerequisites
+    order_only: list of order only prerequisites (after the '|')
+    has_recipe: True if make has a recipe for building this target
+    is_target: False for entries make marks as 'Not a target' (files it only looked at)
+    '''
+    def __init__(self, name, prerequisites, order_only, has_recipe = False, is_target = True):
+        self.name = name
+        self.prerequisites = prerequisites
+        self.order_only = order_only
+        self.has_recipe = has_recipe
+        self.is_target = is_target
+
+class make_rule_database():
+    ''' The parsed output of 'make -pn'.
+    targets: dictionary of make_target objects keyed by target name
+    makefiles: list of the makefiles that were read (the MAKEFILE_LIST variable)
+    commands: the (expanded) recipe lines that make would have executed for the goals
+    '''
+    def __init__(self):
+        self.targets = {}
+        self.makefiles = []
+        self.commands = []
+
+    def __contains__(self, name):
+        return name in self.targets
+
+    def prerequisite_closure(self, goal):
+        ''' Returns the set of all targets/files that the goal depends on (directly
+        or indirectly). The goal itself is not included. '''
+        closure = set()
+        pending = [goal]
+        while pending:
+            name = pending.pop()
+            target = self.targets.get(name)
+            if target is None:
+                continue
+            for prereq in target.prerequisites + target.order_only:
+                if prereq not in closure and prereq != goal:
+                    closure.add(prereq)
+                    pending.append(prereq)
+        return closure
+
+    def buildable_targets(self, names):
+        ''' Returns the subset of the given names that make has a recipe for '''
+        return set(name for name in names if name in self.targets and self.targets[name].has_recipe)
+
+def parse_make_database(database_str):
+    ''' Parse the output of 'make -pn' and return a make_rule_database. '''
+    database = make_rule_database()
+    in_database = False
+    in_files_section = False
+    not_a_target = False
+    current = None
+    for line in database_str.splitlines():
+        if not in_database:
+            # Everything before the database (except the version banner and
+            # make's own messages) is a command that would have been executed
+            if line.startswith("# Make data base"):
+                in_database = True
+            elif not line.startswith("#") and not line.startswith("make") and line.strip() != "":
+                database.commands.append(line)
+            continue
+        if line.startswith("MAKEFILE_LIST :="):
+            database.makefiles = line.split(":=", 1)[1].split()
+            continue
+        if line.startswith("# Files"):
+            in_files_section = True
+            continue
+        if not in_files_section:
+            continue
+        if line.startswith("# files hash-table stats") or line.startswith("# VPATH Search Paths"):
+            break
+        if line == "":
+            current = None
+            not_a_target = False
+            continue
+        if line.startswith("# Not a target:"):
+            not_a_target = True
+            continue
+        if line.startswith("#  recipe to execute"):
+            if current is not None:
+                current.has_recipe = True
+            continue
+        if line.startswith("#") or line.startswith("\t"):
+            continue
+        match = TARGET_LINE_RE.match(line)
+        if not match:
+            continue
+        name = match.group(1).strip()
+        prereq_str = match.group(3)
+        order_only = []
+        if "|" in prereq_str:
+            prereq_str, order_only_str = prereq_str.split("|", 1)
+            order_only = order_only_str.split()
+        current = make_target(name, prereq_str.split(), order_only, is_target = not not_a_target)
+        database.targets[name] = current
+    return database
+
+def read_make_database(working_path, goals, always_make = False, timeout_seconds = 60):
+    ''' Run 'make -pn' for the given goals in the working path and return the
+    parsed make_rule_database. Returns None if make could not be run.
+    always_make: Add the '-B' option so that the commands for every target
+      needed by the goals are listed (not just the out of date ones). '''
+    cmd = ["make", "--print-data-base", "--dry-run", "--keep-going"]
+    if always_make:
+        cmd.append("--always-make")
+    cmd += list(goals)
+    try:
+        proc = subprocess.run(cmd, cwd=working_path, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True,
+                              timeout=timeout_seconds)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return parse_make_database(proc.stdout)
@@ -0,0 +1,912 @@
+#!/usr/bin/python3
+
+'''
+Runs a tool (make, vivado, xsim, ...) and copies its output to several sinks.
+
+The output of the process (stdout and stderr combined) is read in large chunks
+from a non-blocking pipe with a selector. Only complete lines are passed to the
+sinks so the output of tests that run at the same time is not mixed within a
+line. The sinks buffer their writes and are flushed on a fixed interval (and when
+the process is done) rather than after every line. The selector wakes up for the
+flush interval and the timeout so a timeout is detected when it expires instead of
+at the next line of output.
+
+Kill patterns stop a process as soon as its output shows that it has failed (i.e.,
+a testbench error message) rather than when it exits or times out. The complete
+lines of each chunk of output are searched for the patterns and the process group of
+the process is terminated at the first line that matches.
+
+Each process is started in its own session. When a process is stopped (timeout, kill
+pattern or interrupt) every process of its tree is signalled: the processes in its
+session and all of their descendants, including the ones that started a session of
+their own (found through the parent process ids in /proc). The processes get SIGTERM
+and the ones still running after a grace period get SIGKILL. Processes left running
+in the session after the tool exits (i.e., a hw_server started by Vivado) are stopped
+the same way. While runners are running the harness is a 'child subreaper' (Linux) so
+orphaned descendants become children of the harness, where they can be found and reaped,
+rather than of init (the subreaper is turned off after the last runner so the orphans of
+other commands are reaped by init again). The tree of the tool is scanned at each flush of the sinks and
+only the orphans that were seen in it (by process id and start time) are adopted: a
+child of the harness in another session may be a tool that another runner has just
+started. The CPU time and peak memory of the tool and its descendants
+are obtained with wait4.
+
+Resource limits (address space, CPU time, open files and file size) are applied to the
+tool with setrlimit before it is executed and are inherited by all of its descendants.
+The memory of the whole tree is limited with a cgroup (v2) when the cgroup of the harness
+(or the cgroup given with the ECEN423_CGROUP environment variable) has the memory
+controller delegated to it. The output of a tool can also be limited: the tool is
+stopped when it writes more than the limit.
+
+The output of a test is captured with an 'output_capture' sink: the complete output
+is kept in an indexed spill file and only the last lines are kept in memory, so the
+memory used by the harness does not grow with the length of a simulation.
+
+Self test (concurrent runners and the processes left running by a tool):
+  process_runner.py --self_test [--threads 4] [--runs 150]
+
+Benchmark against the queue and reader thread loop that the runner replaced (lines
+captured, wall and CPU time for a tool with a lot of output, and the time at which a
+timeout is detected):
+  process_runner.py --benchmark [--lines 1000000]
+
+Example:
+  runner = process_runner(["make", "sim_alu"], cwd = lab_path,
+      sinks = [stream_sink(sys.stdout), file_sink("make_sim_alu.log")], timeout_seconds = 60)
+  return_code = runner.run()
+'''
+
+import argparse
+import codecs
+import collections
+import ctypes
+import io
+import itertools
+import os
+import pathlib
+import queue
+import re
+import resource
+import selectors
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Size of each read from the output pipe
+READ_CHUNK_BYTES = 64 * 1024
+# Time between flushes of the sinks while the process is running
+FLUSH_INTERVAL_SECONDS = 0.5
+# Time given to a process to exit after it was terminated before it is killed
+TERMINATE_GRACE_SECONDS = 5
+# Time between checks for the processes of a tree that were terminated
+TERMINATE_POLL_SECONDS = 0.05
+# prctl option that makes orphaned descendants children of this process (Linux)
+PR_SET_CHILD_SUBREAPER = 36
+# Delegated cgroup (v2) in which the cgroups of the tools are created (default is the cgroup of the harness)
+CGROUP_PARENT_ENV = "ECEN423_CGROUP"
+# Kill patterns for the output of testbench simulations and of Vivado builds (the synthesis
+# messages upgraded to errors by messages.tcl)
+SIMULATION_KILL_PATTERNS = [r"\*\* ?ERR ?\*\*", r"TEST FAILED"]
+BUILD_KILL_PATTERNS = [r"^ERROR: \[Synth"]
+# Size of the output kept in memory by an output capture (the rest is only on disk)
+CAPTURE_TAIL_LINES = 1000
+CAPTURE_TAIL_BYTES = 1024 * 1024
+
+#########################################################################################
+# Sinks
+#########################################################################################
+
+class stream_sink():
+    ''' Writes the output to an open file object (i.e., sys.stdout or the suite log).
+    If a lock is given, it is held while writing so the lines of concurrent tests are
+    not mixed with each other (or with the messages printed by the suite). '''
+    def __init__(self, fp, lock = None):
+        self.fp = fp
+        self.lock = lock
+
+    def write(self, text):
+        if self.lock is None:
+            self.fp.write(text)
+            return
+        with self.lock:
+            self.fp.write(text)
+
+    def flush(self):
+        if self.lock is None:
+            self.fp.flush()
+            return
+        with self.lock:
+            self.fp.flush()
+
+    def close(self):
+        self.flush()
+
+class file_sink(stream_sink):
+    ''' Writes the output to a file that is opened by the sink (and closed when the
+    process is done) '''
+    def __init__(self, filepath, header = None):
+        super().__init__(open(filepath, "w", buffering=READ_CHUNK_BYTES))
+        if header is not None:
+            self.fp.write(header)
+
+    def close(self):
+        self.fp.close()
+
+class tail_sink():
+    ''' Keeps the last lines of the output in memory (i.e., to print when a command fails) '''
+    def __init__(self, max_lines = 20):
+        self.tail = collections.deque(maxlen=max_lines)
+
+    def write(self, text):
+        # Only the end of a large chunk of output can be part of the tail
+        start = len(text)
+        for _ in range(self.tail.maxlen + 1):
+            start = text.rfind("\n", 0, start)
+            if start < 0:
+                break
+        self.tail.extend(text[start + 1:].splitlines())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def tail_lines(self):
+        return list(self.tail)
+
+class matcher_sink():
+    ''' Calls a function for each line of the output that matches a regular expression.
+    matchers: list of (regex_str, callback) where callback(line, match) is called for each
+      matching line (without the end of line) '''
+    def __init__(self, matchers):
+        self.matchers = [(re.compile(regex_str, re.MULTILINE), callback) for regex_str, callback in matchers]
+
+    def write(self, text):
+        for regex, callback in self.matchers:
+            line_end = -1
+            for match in regex.finditer(text):
+                # One call for each line (a pattern can match more than once in a line)
+                if match.start() <= line_end:
+                    continue
+                line_start = text.rfind("\n", 0, match.start()) + 1
+                line_end = text.find("\n", match.start())
+                if line_end < 0:
+                    line_end = len(text)
+                callback(text[line_start:line_end], match)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class output_capture():
+    ''' Captures the output of one or more processes with bounded memory.
+    The complete output is spilled to an anonymous temporary file (deleted when the
+    capture is garbage collected or the program exits) and only the last lines are kept
+    in memory.
+    max_tail_lines: maximum number of lines kept in memory
+    max_tail_bytes: maximum number of characters kept in memory
+    '''
+    def __init__(self, max_tail_lines = CAPTURE_TAIL_LINES, max_tail_bytes = CAPTURE_TAIL_BYTES):
+        self.max_tail_lines = max_tail_lines
+        self.max_tail_bytes = max_tail_bytes
+        self.tail = collections.deque()
+        self.tail_bytes = 0
+        # Number of lines ('\n') written
+        self.line_count = 0
+        # The spill file is created by the first write
+        self.spill_fp = None
+        self.spill_bytes = 0
+
+    def write(self, text):
+        # The readers share the file offset of the spill file (it is set before each write)
+        data = text.encode("utf-8", errors="replace")
+        if self.spill_fp is None:
+            self.spill_fp = tempfile.TemporaryFile(prefix="ecen423_output_")
+        self.spill_fp.seek(self.spill_bytes)
+        self.spill_fp.write(data)
+        self.spill_bytes += len(data)
+        self.line_count += data.count(b"\n")
+        lines = text.splitlines()
+        # Only the lines that can fit in the tail are added
+        for line in lines[-self.max_tail_lines:]:
+            self.tail.append(line)
+            self.tail_bytes += len(line) + 1
+        while len(self.tail) > self.max_tail_lines or (self.tail_bytes > self.max_tail_bytes and len(self.tail) > 1):
+            self.tail_bytes -= len(self.tail.popleft()) + 1
+
+    def flush(self):
+        if self.spill_fp is not None:
+            self.spill_fp.flush()
+
+    def close(self):
+        # The spill file stays open: the capture may be read or written again
+        self.flush()
+
+    def tail_lines(self):
+        ''' The last lines of the output (without the end of line) '''
+        return list(self.tail)
+
+    def copy_to(self, fp):
+        ''' Copy the complete output to an open binary file '''
+        if self.spill_fp is None:
+            return
+        self.spill_fp.flush()
+        with open(os.dup(self.spill_fp.fileno()), "rb") as spill_fp:
+            spill_fp.seek(0)
+            shutil.copyfileobj(spill_fp, fp)
+
+    def discard(self):
+        ''' Remove the captured output '''
+        if self.spill_fp is not None:
+            self.spill_fp.close()
+            self.spill_fp = None
+        self.tail.clear()
+        self.tail_bytes = 0
+        self.line_count = 0
+        self.spill_bytes = 0
+
+#########################################################################################
+# Process trees
+#########################################################################################
+
+# Process ids of the tools that are running (the session id of a tool is its process id)
+active_pids = set()
+active_pids_lock = threading.Lock()
+# Number of runners that are running (the harness is a child subreaper while it is not 0)
+subreaper_users = 0
+subreaper_lock = threading.Lock()
+
+def set_child_subreaper(enabled):
+    ''' Make orphaned descendants children of this process rather than of init (only on Linux) '''
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1 if enabled else 0, 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+def acquire_child_subreaper():
+    ''' Turn on the child subreaper for a runner (the first runner turns it on) '''
+    global subreaper_users
+    with subreaper_lock:
+        if subreaper_users == 0:
+            set_child_subreaper(True)
+        subreaper_users += 1
+
+def release_child_subreaper():
+    ''' Turn off the child subreaper after the last runner '''
+    global subreaper_users
+    with subreaper_lock:
+        subreaper_users -= 1
+        if subreaper_users == 0:
+            set_child_subreaper(False)
+
+def process_table():
+    ''' Returns a dictionary with the (parent pid, session id, state, start time) of every
+    process (empty if /proc is not available) '''
+    table = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return table
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as fp:
+                stat = fp.read()
+        except OSError:
+            continue
+        # The fields after the command name (which may contain spaces): state ppid pgrp session ... starttime
+        fields = stat[stat.rfind(b")") + 2:].split()
+        table[int(entry)] = (int(fields[1]), int(fields[3]), fields[0].decode(), int(fields[19]))
+    return table
+
+class resource_usage():
+    ''' CPU time and peak memory of a process and of the descendants it waited for '''
+    def __init__(self, user_seconds = 0, system_seconds = 0, max_rss_kb = 0):
+        self.user_seconds = user_seconds
+        self.system_seconds = system_seconds
+        self.max_rss_kb = max_rss_kb
+
+    def combined(self, other):
+        ''' Usage of two processes that ran one after the other '''
+        if other is None:
+            return self
+        return resource_usage(self.user_seconds + other.user_seconds, self.system_seconds + other.system_seconds,
+                              max(self.max_rss_kb, other.max_rss_kb))
+
+    def to_dict(self):
+        return {"user_seconds" : round(self.user_seconds, 2), "system_seconds" : round(self.system_seconds, 2),
+                "max_rss_kb" : self.max_rss_kb}
+
+    def __str__(self):
+        return f"CPU {self.user_seconds:.1f}s user {self.system_seconds:.1f}s system, max RSS {self.max_rss_kb / 1024:.0f} MB"
+
+#########################################################################################
+# Resource limits
+#########################################################################################
+
+def cgroup_parent_path():
+    ''' Returns the cgroup (v2) directory in which the cgroups of the tools can be created
+    (None if there is no cgroup with a delegated memory controller) '''
+    if os.environ.get(CGROUP_PARENT_ENV):
+        path = pathlib.Path(os.environ[CGROUP_PARENT_ENV])
+    else:
+        try:
+            mount_path = None
+            with open("/proc/self/mountinfo") as fp:
+                for line in fp:
+                    fields = line.split()
+                    if fields[fields.index("-") + 1] == "cgroup2":
+                        mount_path = fields[4]
+                        break
+            with open("/proc/self/cgroup") as fp:
+                cgroup = [line.strip()[3:] for line in fp if line.startswith("0::")][0]
+        except (OSError, IndexError, ValueError):
+            return None
+        if mount_path is None:
+            return None
+        path = pathlib.Path(mount_path) / cgroup.lstrip("/")
+    try:
+        controllers = (path / "cgroup.subtree_control").read_text().split()
+    except OSError:
+        return None
+    if "memory" not in controllers or not os.access(path, os.W_OK):
+        return None
+    return path
+
+class tool_cgroup():
+    ''' A cgroup (v2) with a memory limit for the process tree of a tool '''
+    # Number of the next cgroup created by this process
+    counter = itertools.count()
+
+    def __init__(self, parent_path, memory_bytes):
+        self.path = parent_path / f"ecen423_{os.getpid()}_{next(tool_cgroup.counter)}"
+        self.path.mkdir()
+        (self.path / "memory.max").write_text(str(memory_bytes))
+        if (self.path / "memory.swap.max").exists():
+            (self.path / "memory.swap.max").write_text("0")
+        self.procs_path = str(self.path / "cgroup.procs")
+
+    def enter(self):
+        ''' Move the calling process to the cgroup (called in the child before the tool is executed) '''
+        fd = os.open(self.procs_path, os.O_WRONLY)
+        try:
+            os.write(fd, b"0")
+        finally:
+            os.close(fd)
+
+    def pids(self):
+        try:
+            return [int(pid) for pid in (self.path / "cgroup.procs").read_text().split()]
+        except OSError:
+            return []
+
+    def oom_killed(self):
+        ''' Returns True if processes of the cgroup were killed for exceeding the memory limit '''
+        try:
+            for line in (self.path / "memory.events").read_text().splitlines():
+                name, value = line.split()
+                if name == "oom_kill" and int(value) > 0:
+                    return True
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def remove(self):
+        ''' Kill the processes left in the cgroup (cgroup.kill, Linux 5.14) and remove it '''
+        if self.pids():
+            try:
+                (self.path / "cgroup.kill").write_text("1")
+            except OSError:
+                pass
+        for _ in range(int(TERMINATE_GRACE_SECONDS / TERMINATE_POLL_SECONDS)):
+            try:
+                self.path.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(TERMINATE_POLL_SECONDS)
+
+class resource_limits():
+    ''' Limits for a tool and all of the processes it starts (None for no limit).
+    memory_bytes: memory of the process tree (cgroup memory.max). When a cgroup cannot be
+      used, the address space of each process is limited instead.
+    address_space_bytes: address space of each process (RLIMIT_AS)
+    cpu_seconds: CPU time of each process (RLIMIT_CPU)
+    open_files: number of open files of each process (RLIMIT_NOFILE)
+    file_bytes: size of the files written by the processes (RLIMIT_FSIZE)
+    output_bytes: size of the output of the tool (stdout and stderr)
+    '''
+    def __init__(self, memory_bytes = None, address_space_bytes = None, cpu_seconds = None,
+                 open_files = None, file_bytes = None, output_bytes = None):
+        self.memory_bytes = memory_bytes
+        self.address_space_bytes = address_space_bytes
+        self.cpu_seconds = cpu_seconds
+        self.open_files = open_files
+        self.file_bytes = file_bytes
+        self.output_bytes = output_bytes
+
+    def __str__(self):
+        names = ["memory_bytes", "address_space_bytes", "cpu_seconds", "open_files", "file_bytes", "output_bytes"]
+        return ", ".join(f"{name}={getattr(self, name)}" for name in names if getattr(self, name) is not None)
+
+    def create_cgroup(self):
+        ''' Returns a cgroup for the memory limit (None if there is no limit or cgroups cannot be used) '''
+        if self.memory_bytes is None:
+            return None
+        parent_path = cgroup_parent_path()
+        if parent_path is None:
+            return None
+        try:
+            return tool_cgroup(parent_path, self.memory_bytes)
+        except OSError:
+            return None
+
+    def rlimits(self, cgroup):
+        ''' Returns the list of (resource, limit) set with setrlimit '''
+        address_space_bytes = self.address_space_bytes
+        if address_space_bytes is None and cgroup is None:
+            address_space_bytes = self.memory_bytes
+        limits = [(resource.RLIMIT_AS, address_space_bytes), (resource.RLIMIT_CPU, self.cpu_seconds),
+                  (resource.RLIMIT_NOFILE, self.open_files), (resource.RLIMIT_FSIZE, self.file_bytes)]
+        return [(limit_resource, int(limit)) for limit_resource, limit in limits if limit is not None]
+
+    def preexec_function(self, cgroup):
+        ''' Returns the function that applies the limits in the child process before the tool is
+        executed (it only makes system calls so it is safe to run after a fork with threads) '''
+        rlimits = self.rlimits(cgroup)
+        def apply_limits():
+            if cgroup is not None:
+                cgroup.enter()
+            for limit_resource, limit in rlimits:
+                # The hard limit is lowered too so the tool cannot raise the limit again (the hard CPU
+                # limit is one second later so the process gets SIGXCPU before SIGKILL)
+                new_hard_limit = limit + 1 if limit_resource == resource.RLIMIT_CPU else limit
+                hard_limit = resource.getrlimit(limit_resource)[1]
+                if hard_limit != resource.RLIM_INFINITY:
+                    limit = min(limit, hard_limit)
+                    new_hard_limit = min(new_hard_limit, hard_limit)
+                resource.setrlimit(limit_resource, (limit, new_hard_limit))
+        return apply_limits
+
+#########################################################################################
+# Runner
+#########################################################################################
+
+class process_runner():
+    ''' Runs a command and copies its output to the sinks.
+    proc_cmd: the command (list of strings)
+    cwd: the directory in which the command is run
+    sinks: objects with write(text), flush() and close() methods
+    timeout_seconds: the process is terminated after this many seconds (0 for no timeout)
+    flush_interval: seconds between flushes of the sinks
+    kill_patterns: regular expressions (searched in each line of output) that terminate the process
+    limits: resource_limits for the process and its descendants
+    close_sinks: close the sinks when the process is done (False when the caller writes to
+      them after the process, i.e., the reason the process was terminated)
+    '''
+    def __init__(self, proc_cmd, cwd = None, sinks = None, timeout_seconds = 0,
+                 flush_interval = FLUSH_INTERVAL_SECONDS, kill_patterns = None, limits = None,
+                 close_sinks = True):
+        self.proc_cmd = [str(arg) for arg in proc_cmd]
+        self.cwd = cwd
+        self.sinks = [] if sinks is None else sinks
+        self.timeout_seconds = timeout_seconds
+        self.flush_interval = flush_interval
+        self.proc = None
+        self.timed_out = False
+        self.return_code = None
+        self.elapsed_seconds = 0
+        self.output_bytes = 0
+        self.kill_regexes = [re.compile(pattern, re.MULTILINE) for pattern in (kill_patterns or [])]
+        # The kill pattern and the line of output that terminated the process
+        self.kill_pattern = None
+        self.kill_line = None
+        # Resource usage of the process (from wait4) and the number of processes stopped after it exited
+        self.usage = None
+        self.orphan_count = 0
+        # The (pid, start time) of the processes seen in the tree of the tool
+        self.seen_processes = set()
+        self.limits = limits
+        self.close_sinks = close_sinks
+        self.cgroup = None
+        # Description of the resource limit that stopped the process
+        self.limit_msg = None
+        # Output after the last end of line (passed to the sinks with the next line)
+        self.partial_line = ""
+        # Output is decoded like a subprocess with universal_newlines (\r\n and \r become \n)
+        self.decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(errors="replace"),
+                                                    translate=True)
+
+    def run(self):
+        ''' Run the command until it exits or the timeout expires. Returns the return code
+        of the process (a timed out process returns the code of the terminated process). '''
+        start_time = time.monotonic()
+        deadline = start_time + self.timeout_seconds if self.timeout_seconds > 0 else None
+        preexec_fn = None
+        if self.limits is not None:
+            self.cgroup = self.limits.create_cgroup()
+            preexec_fn = self.limits.preexec_function(self.cgroup)
+        # The process is started in its own session so it can be terminated with all of its children
+        acquire_child_subreaper()
+        try:
+            self.proc = subprocess.Popen(self.proc_cmd, cwd=self.cwd, stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, bufsize=0,
+                                         start_new_session=True, preexec_fn=preexec_fn)
+        except BaseException:
+            if self.cgroup is not None:
+                self.cgroup.remove()
+            release_child_subreaper()
+            raise
+        with active_pids_lock:
+            active_pids.add(self.proc.pid)
+        fd = self.proc.stdout.fileno()
+        os.set_blocking(fd, False)
+        selector = selectors.DefaultSelector()
+        selector.register(fd, selectors.EVENT_READ)
+        next_flush = start_time + self.flush_interval
+        try:
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    self.timed_out = True
+                    self.terminate()
+                    break
+                if now >= next_flush:
+                    self.flush()
+                    # Record the descendants before they can become orphans
+                    self.process_tree()
+                    next_flush = now + self.flush_interval
+                wait = next_flush - now
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                if not selector.select(wait):
+                    if self.wait_process(block = False):
+                        # The tool exited (the processes it left running may keep the output open)
+                        self.read_available(fd)
+                        break
+                    continue
+                try:
+                    data = os.read(fd, READ_CHUNK_BYTES)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    break
+                self.process_output(data)
+                if self.limits is not None and self.limits.output_bytes is not None and \
+                   self.output_bytes > self.limits.output_bytes:
+                    self.limit_msg = f"Output exceeded the limit of {self.limits.output_bytes} bytes"
+                if self.kill_line is not None or self.limit_msg is not None:
+                    self.terminate()
+                    break
+            self.process_output(b"", final = True)
+        except BaseException:
+            # The process is not in the terminal's process group and does not get a Ctrl-C
+            self.terminate()
+            raise
+        finally:
+            selector.close()
+            self.proc.stdout.close()
+            # The tool may close its output and keep running: the deadline still applies
+            if not self.timed_out and not self.wait_exit(deadline):
+                self.timed_out = True
+                self.terminate()
+            self.return_code = self.proc.returncode
+            self.elapsed_seconds = time.monotonic() - start_time
+            # Stop the processes left running by the tool
+            orphans = self.process_tree()
+            if orphans:
+                self.orphan_count = len(orphans)
+                self.terminate()
+            self.reap_children()
+            release_child_subreaper()
+            self.check_limits()
+            with active_pids_lock:
+                active_pids.discard(self.proc.pid)
+            for sink in self.sinks:
+                if self.close_sinks:
+                    sink.close()
+                else:
+                    sink.flush()
+        return self.return_code
+
+    def read_available(self, fd):
+        ''' Process the output that can be read without waiting '''
+        while True:
+            try:
+                data = os.read(fd, READ_CHUNK_BYTES)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            self.process_output(data)
+
+    def process_output(self, data, final = False):
+        ''' Decode a chunk of output and pass the complete lines to the sinks '''
+        self.output_bytes += len(data)
+        text = self.partial_line + self.decoder.decode(data, final)
+        if not final:
+            end = text.rfind("\n") + 1
+            self.partial_line = text[end:]
+            text = text[:end]
+        if text:
+            for sink in self.sinks:
+                sink.write(text)
+            if self.kill_regexes and self.kill_line is None:
+                self.check_kill_patterns(text)
+
+    def check_kill_patterns(self, text):
+        ''' Find the first line of the text that matches one of the kill patterns '''
+        first_match = None
+        for regex in self.kill_regexes:
+            match = regex.search(text)
+            if match is not None and (first_match is None or match.start() < first_match.start()):
+                first_match = match
+        if first_match is None:
+            return
+        line_start = text.rfind("\n", 0, first_match.start()) + 1
+        line_end = text.find("\n", first_match.start())
+        self.kill_pattern = first_match.re.pattern
+        self.kill_line = text[line_start:] if line_end < 0 else text[line_start:line_end]
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def check_limits(self):
+        ''' Find the resource limit that stopped the process (if any) and remove the cgroup '''
+        if self.cgroup is not None:
+            if self.limit_msg is None and self.cgroup.oom_killed():
+                self.limit_msg = f"Memory exceeded the limit of {self.limits.memory_bytes} bytes"
+            self.cgroup.remove()
+            self.cgroup = None
+        if self.limits is None:
+            return
+        if self.limit_msg is None and self.return_code == -signal.SIGXCPU:
+            self.limit_msg = f"CPU time exceeded the limit of {self.limits.cpu_seconds} seconds"
+        if self.limit_msg is None and self.return_code == -signal.SIGXFSZ:
+            self.limit_msg = f"File size exceeded the limit of {self.limits.file_bytes} bytes"
+
+    def wait_process(self, block = True):
+        ''' Wait for the process to exit and save its return code and resource usage.
+        Returns False if the process is still running (block is False). '''
+        if self.proc.returncode is not None:
+            return True
+        try:
+            pid, status, rusage = os.wait4(self.proc.pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            # The process was already reaped
+            self.proc.returncode = self.proc.wait()
+            return True
+        if pid == 0:
+            return False
+        self.proc.returncode = os.waitstatus_to_exitcode(status)
+        self.usage = resource_usage(rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss)
+        return True
+
+    def wait_exit(self, deadline):
+        ''' Wait for the process to exit (polling when there is a deadline). Returns False if
+        the process is still running at the deadline. '''
+        if deadline is None:
+            return self.wait_process()
+        # Most tools exit right after closing their output: the poll interval starts short
+        poll_seconds = 0.001
+        while not self.wait_process(block = False):
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            time.sleep(min(poll_seconds, deadline - now))
+            poll_seconds = min(2 * poll_seconds, TERMINATE_POLL_SECONDS)
+        return True
+
+    def process_tree(self, table = None):
+        ''' Returns the process ids of the running processes started by the tool: the processes in
+        its session, their descendants and the orphans (children of this process through the
+        subreaper) that were seen in the tree before. Children of this process that were never
+        seen in the tree are not adopted (they may be tools started by other runners). '''
+        if table is None:
+            table = process_table()
+        own_pid = os.getpid()
+        own_session = os.getsid(0)
+        with active_pids_lock:
+            other_sessions = active_pids - {self.proc.pid}
+        children = {}
+        # The process id of the tool may be reused once it has been reaped
+        roots = [self.proc.pid] if self.proc.returncode is None else []
+        for pid, (ppid, session, state, start_time) in table.items():
+            children.setdefault(ppid, []).append(pid)
+            if session == self.proc.pid:
+                roots.append(pid)
+            elif ppid == own_pid and session != own_session and (pid, start_time) in self.seen_processes:
+                roots.append(pid)
+        tree = set()
+        while roots:
+            pid = roots.pop()
+            if pid in tree or pid not in table or pid == own_pid or pid in other_sessions:
+                continue
+            tree.add(pid)
+            roots.extend(children.get(pid, []))
+        self.seen_processes.update((pid, table[pid][3]) for pid in tree)
+        # Zombies are not running (the ones that are children of this process are reaped)
+        return {pid for pid in tree if table[pid][2] != "Z"}
+
+    def terminate(self):
+        ''' Terminate the process tree of the tool: SIGTERM and SIGKILL for the processes that are
+        still running after the grace period. The orphans that became children of this process
+        are reaped. '''
+        for signum in [signal.SIGTERM, signal.SIGKILL]:
+            self.signal_tree(signum)
+            if self.wait_tree(TERMINATE_GRACE_SECONDS):
+                break
+        if not self.wait_exit(time.monotonic() + TERMINATE_GRACE_SECONDS):
+            # The process did not exit after SIGKILL (i.e., an uninterruptible sleep)
+            self.proc.returncode = -signal.SIGKILL
+        self.reap_children()
+
+    def wait_tree(self, timeout_seconds):
+        ''' Wait for the processes of the tree to exit. Returns False if some are still running. '''
+        deadline = time.monotonic() + timeout_seconds
+        while True:
+            self.reap_children()
+            if not self.process_tree():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(TERMINATE_POLL_SECONDS)
+
+    def signal_tree(self, signum):
+        ''' Send a signal to the session of the tool and to every process of its tree '''
+        pids = self.process_tree()
+        if self.cgroup is not None:
+            pids.update(self.cgroup.pids())
+        for pid in [-self.proc.pid] + list(pids):
+            try:
+                os.kill(pid, signum)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def reap_children(self):
+        ''' Reap the tool and the zombies of its tree that are children of this process '''
+        self.wait_process(block = False)
+        own_pid = os.getpid()
+        for pid, (ppid, session, state, start_time) in process_table().items():
+            if ppid != own_pid or state != "Z" or pid == self.proc.pid:
+                continue
+            with active_pids_lock:
+                if pid in active_pids or session in active_pids - {self.proc.pid}:
+                    continue
+            # The zombies of the session of the tool or of its tree (not the tools of other runners)
+            if session == self.proc.pid or (pid, start_time) in self.seen_processes:
+                try:
+                    os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    pass
+
+#########################################################################################
+# Self test and benchmark
+#########################################################################################
+
+def self_test(thread_count, run_count):
+    ''' Run short tools from several threads at the same time (the clean up of a runner must
+    not stop the tools of the other runners) and a tool that leaves a process running.
+    Returns the number of failures. '''
+    failures = 0
+    return_codes = []
+    def run_tools():
+        for _ in range(run_count):
+            return_codes.append(process_runner([sys.executable, "-c", "pass"]).run())
+    threads = [threading.Thread(target=run_tools) for _ in range(thread_count)]
+    start_time = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    failed_runs = sum(1 for return_code in return_codes if return_code != 0)
+    print(f"Concurrent runners: {len(return_codes)} runs in {thread_count} threads " +
+          f"({time.monotonic() - start_time:.1f}s), {failed_runs} failed")
+    failures += failed_runs
+    # The background process stays in the session of the tool and is stopped when the tool exits
+    runner = process_runner(["sh", "-c", "sleep 30 & echo started"])
+    return_code = runner.run()
+    left_running = runner.process_tree()
+    print(f"Process left running: return code {return_code}, {runner.orphan_count} stopped, " +
+          f"{len(left_running)} still running")
+    if return_code != 0 or runner.orphan_count != 1 or left_running:
+        failures += 1
+    return failures
+
+def queue_loop_run(proc_cmd, fps, lines, timeout_seconds = 0):
+    ''' The loop used by repo_test.execute_command before the runner: a thread reads the lines
+    into a queue and the loop writes (and flushes) each line until the process exits '''
+    def read_lines(proc, output_queue):
+        while True:
+            line = proc.stdout.readline()
+            if not line:
+                break
+            output_queue.put(line.strip())
+    start_time = time.time()
+    proc = subprocess.Popen(proc_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    output_queue = queue.Queue()
+    output_thread = threading.Thread(target=read_lines, args=(proc, output_queue))
+    output_thread.start()
+    while proc.poll() is None and output_thread.is_alive():
+        try:
+            line = output_queue.get(timeout=1.0)
+            lines.append(line)
+            line = line + "\n"
+            for fp in fps:
+                fp.write(line)
+                fp.flush()
+        except queue.Empty:
+            pass
+        if timeout_seconds > 0 and time.time() - start_time > timeout_seconds:
+            proc.terminate()
+            break
+    proc.communicate()
+    output_thread.join()
+
+def benchmark(line_count, timeout_seconds = 1.3):
+    ''' Compare the runner with the queue loop: a tool that writes line_count lines of 80
+    characters (to stdout on /dev/null, a log file, a suite log and the captured lines) and a
+    tool that sleeps for longer than a timeout '''
+    generator = [sys.executable, "-c",
+                 f"import sys\nline = 'x' * 79 + '\\n'\nfor _ in range({line_count}): sys.stdout.write(line)"]
+    print(f"Tool writing {line_count} lines of 80 characters (sinks: stdout to /dev/null, log file, suite log, captured lines)")
+    with tempfile.TemporaryDirectory(prefix="process_runner_") as temp_dir, open(os.devnull, "w") as devnull:
+        for name in ["queue loop", "process_runner"]:
+            with open(os.path.join(temp_dir, "suite.log"), "w") as suite_fp:
+                start_time = time.monotonic()
+                start_cpu = time.process_time()
+                if name == "queue loop":
+                    lines = []
+                    with open(os.path.join(temp_dir, "tool.log"), "w") as log_fp:
+                        queue_loop_run(generator, [devnull, suite_fp, log_fp], lines)
+                    captured = len(lines)
+                else:
+                    capture = output_capture()
+                    sinks = [stream_sink(devnull), stream_sink(suite_fp), file_sink(os.path.join(temp_dir, "tool.log")), capture]
+                    process_runner(generator, sinks=sinks, close_sinks=False).run()
+                    captured = capture.line_count
+                    for sink in sinks:
+                        sink.close()
+                wall_seconds = time.monotonic() - start_time
+                cpu_seconds = time.process_time() - start_cpu
+            print(f"  {name:15} {captured:9} lines captured  {wall_seconds:6.1f}s wall  {cpu_seconds:6.1f}s harness CPU" +
+                  f"  ({cpu_seconds / max(captured, 1) * 1e6:5.1f} us of CPU per line)")
+    sleeper = ["sleep", "5"]
+    print(f"Tool sleeping for 5s with a {timeout_seconds}s timeout")
+    start_time = time.monotonic()
+    queue_loop_run(sleeper, [], [], timeout_seconds)
+    print(f"  {'queue loop':15} returned after {time.monotonic() - start_time:.1f}s")
+    start_time = time.monotonic()
+    process_runner(sleeper, timeout_seconds=timeout_seconds).run()
+    print(f"  {'process_runner':15} returned after {time.monotonic() - start_time:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Process runner (self test and benchmark)")
+    parser.add_argument("--self_test", action="store_true", help="Run the self test")
+    parser.add_argument("--threads", type=int, default=4, help="Number of concurrent runners")
+    parser.add_argument("--runs", type=int, default=150, help="Number of tools run by each runner")
+    parser.add_argument("--benchmark", action="store_true", help="Compare the runner with the queue loop it replaced")
+    parser.add_argument("--lines", type=int, default=1000000, help="Number of lines written by the benchmark tool")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.lines)
+        return 0
+    if not args.self_test:
+        parser.print_help()
+        return 0
+    failures = self_test(args.threads, args.runs)
+    print("PASS" if failures == 0 else f"FAIL ({failures} failures)")
+    return 0 if failures == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1279 @@
+#!/usr/bin/python3
+
+'''
+A pure Python assembler that generates the same memory files as the RARS assembler.
+
+The memory files of the iosystem labs (the '%_text.mem' and '%_data.mem' rules of
+iosystem.mk and the 'rars_mem_file' tester modules) are generated by assembling a
+program with the RARS jar and dumping its text and data segments. Starting a JVM
+takes much longer than assembling a lab program. This assembler follows the RARS 1.6
+assembler for the RV32I and RV32M instructions, the integer pseudo instructions, the
+'.eqv' substitutions and the data directives so that the 'HexText' memory images and
+the 'SegmentWindow' listing of the text segment are the same as the ones dumped by RARS.
+
+The command line accepts the RARS options used by the makefiles and the tester:
+  rars_asm.py [nc] [ae<n>] [mc <config>] <file.s> a dump <segment> <format> <filename> ...
+
+Floating point instructions, control and status registers, macros and the '.include'
+directive are not supported. The command line runs the RARS jar with the same options
+for programs that use them (and for simulation), and exits with a non-zero code if the
+jar cannot be run.
+'''
+
+import pathlib
+import re
+import shutil
+import subprocess
+import sys
+
+COPYRIGHT_MESSAGE = "RARS 1.6  Copyright 2003-2019 Pete Sanderson and Kenneth Vollmar"
+
+# The RARS jar used for the programs this assembler does not support
+RARS_JAR = pathlib.Path(__file__).resolve().parent / "rars1_6.jar"
+
+# Memory configurations of RARS (the addresses used by the assembler and the dumps)
+MEMORY_CONFIGURATIONS = {
+    "Default" : {
+        "text_base" : 0x00400000, "data_segment_base" : 0x10000000, "extern_base" : 0x10000000,
+        "global_pointer" : 0x10008000, "data_base" : 0x10010000, "heap_base" : 0x10040000,
+        "stack_pointer" : 0x7fffeffc, "stack_base" : 0x7ffffffc, "user_high" : 0x7fffffff,
+        "kernel_base" : 0x80000000, "mmio_base" : 0xffff0000, "kernel_high" : 0xffffffff,
+        "data_segment_limit" : 0x7fffffff, "text_limit" : 0x0ffffffc, "stack_limit" : 0x10040000,
+    },
+    "CompactDataAtZero" : {
+        "text_base" : 0x3000, "data_segment_base" : 0x0000, "extern_base" : 0x1000,
+        "global_pointer" : 0x1800, "data_base" : 0x0000, "heap_base" : 0x2000,
+        "stack_pointer" : 0x2ffc, "stack_base" : 0x2ffc, "user_high" : 0x3fff,
+        "kernel_base" : 0x4000, "mmio_base" : 0x7f00, "kernel_high" : 0x7fff,
+        "data_segment_limit" : 0x2fff, "text_limit" : 0x3ffc, "stack_limit" : 0x2000,
+    },
+    "CompactTextAtZero" : {
+        "text_base" : 0x0000, "data_segment_base" : 0x1000, "extern_base" : 0x1000,
+        "global_pointer" : 0x1800, "data_base" : 0x2000, "heap_base" : 0x3000,
+        "stack_pointer" : 0x3ffc, "stack_base" : 0x3ffc, "user_high" : 0x3fff,
+        "kernel_base" : 0x4000, "mmio_base" : 0x7f00, "kernel_high" : 0x7fff,
+        "data_segment_limit" : 0x3fff, "text_limit" : 0x0ffc, "stack_limit" : 0x3000,
+    },
+}
+DEFAULT_MEMORY_CONFIGURATION = "Default"
+
+# Data memory is allocated in blocks of 1024 words (an unallocated block reads as 'null')
+MEMORY_BLOCK_BYTES = 4096
+
+#########################################################################################
+# Tokens
+#########################################################################################
+
+COMMENT = "COMMENT"
+DIRECTIVE = "DIRECTIVE"
+OPERATOR = "OPERATOR"
+REGISTER_NAME = "REGISTER_NAME"
+REGISTER_NUMBER = "REGISTER_NUMBER"
+IDENTIFIER = "IDENTIFIER"
+LEFT_PAREN = "LEFT_PAREN"
+RIGHT_PAREN = "RIGHT_PAREN"
+INTEGER_5 = "INTEGER_5"
+INTEGER_6 = "INTEGER_6"
+INTEGER_12 = "INTEGER_12"
+INTEGER_12U = "INTEGER_12U"
+INTEGER_20 = "INTEGER_20"
+INTEGER_32 = "INTEGER_32"
+QUOTED_STRING = "QUOTED_STRING"
+PLUS = "PLUS"
+MINUS = "MINUS"
+COLON = "COLON"
+HI = "HI"
+LO = "LO"
+ERROR = "ERROR"
+
+INTEGER_TYPES = (INTEGER_5, INTEGER_6, INTEGER_12, INTEGER_12U, INTEGER_20, INTEGER_32)
+REGISTER_TYPES = (REGISTER_NAME, REGISTER_NUMBER)
+SINGLE_CHARACTER_TYPES = {"(" : LEFT_PAREN, ")" : RIGHT_PAREN, ":" : COLON, "+" : PLUS, "-" : MINUS}
+
+# Wider operand types that accept a token of a narrower integer type
+INTEGER_WIDENING = {
+    INTEGER_6 : (INTEGER_5,),
+    INTEGER_12 : (INTEGER_5, INTEGER_6),
+    INTEGER_20 : (INTEGER_5, INTEGER_6, INTEGER_12, INTEGER_12U),
+    INTEGER_32 : (INTEGER_5, INTEGER_6, INTEGER_12, INTEGER_12U, INTEGER_20),
+}
+
+REGISTER_NAMES = ["zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1",
+    "a0", "a1", "a2", "a3", "a4", "a5", "a6", "a7", "s2", "s3", "s4", "s5", "s6", "s7",
+    "s8", "s9", "s10", "s11", "t3", "t4", "t5", "t6"]
+REGISTER_NUMBERS = {name : number for number, name in enumerate(REGISTER_NAMES)}
+REGISTER_NUMBERS.update({f"x{number}" : number for number in range(32)})
+REGISTER_NUMBERS["fp"] = 8
+
+DIRECTIVES = [".data", ".text", ".word", ".half", ".byte", ".ascii", ".asciz", ".string",
+    ".align", ".space", ".extern", ".globl", ".global", ".eqv"]
+# Directives of RARS that are recognized but not supported by this assembler
+UNSUPPORTED_DIRECTIVES = [".dword", ".float", ".double", ".kdata", ".ktext", ".macro",
+    ".end_macro", ".include", ".section"]
+# Instructions of RARS that are not supported by this assembler (the floating point
+# instructions are the other mnemonics with a '.', like 'fadd.s')
+UNSUPPORTED_OPERATORS = ["csrrw", "csrrs", "csrrc", "csrrwi", "csrrsi", "csrrci", "csrr",
+    "csrw", "csrs", "csrc", "csrwi", "csrsi", "csrci", "frcsr", "fscsr", "frrm", "fsrm",
+    "frflags", "fsflags", "rdcycle", "rdcycleh", "rdtime", "rdtimeh", "rdinstret",
+    "rdinstreth", "uret", "wfi", "flw", "fsw", "fld", "fsd"]
+DATA_DIRECTIVE_LENGTHS = {".word" : 4, ".half" : 2, ".byte" : 1}
+STRING_DIRECTIVES = [".ascii", ".asciz", ".string"]
+
+# Escape sequences of character literals and quoted strings
+ESCAPE_CHARACTERS = {"n" : 10, "t" : 9, "r" : 13, "\\" : 92, "'" : 39, '"' : 34,
+    "b" : 8, "f" : 12, "0" : 0}
+
+class token():
+    ''' A token of an assembly line. The column is the (1 based) position in the line. '''
+    def __init__(self, token_type, value, line, column):
+        self.type = token_type
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def __repr__(self):
+        return f"{self.type}:{self.value}"
+
+def to_signed(value, bits = 32):
+    ''' Interpret the lower bits of value as a two's complement number '''
+    value &= (1 << bits) - 1
+    if value >> (bits - 1):
+        value -= 1 << bits
+    return value
+
+def string_to_int(value):
+    ''' Convert a decimal, hex (0x) or octal (leading 0) string to a 32-bit int.
+    Returns None if the string is not an integer. Hex values of up to eight digits
+    wrap to a negative value (i.e., 0xffffffff is -1). '''
+    match = re.fullmatch(r"0[xX]([0-9a-fA-F]{1,8})", value)
+    if match:
+        return to_signed(int(match.group(1), 16))
+    match = re.fullmatch(r"([-+]?)(0[xX][0-9a-fA-F]+|0[0-7]*|[1-9][0-9]*)", value)
+    if not match:
+        return None
+    digits = match.group(2)
+    if digits[:2] in ("0x", "0X"):
+        result = int(digits[2:], 16)
+    elif digits.startswith("0"):
+        result = int(digits, 8)
+    else:
+        result = int(digits)
+    if match.group(1) == "-":
+        result = -result
+    if result < -(1 << 31) or result >= (1 << 31):
+        return None
+    return result
+
+def integer_token_type(value):
+    ''' The smallest integer token type that holds the value '''
+    if 0 <= value <= 31:
+        return INTEGER_5
+    if 0 <= value <= 64:
+        return INTEGER_6
+    if -2048 <= value <= 2047:
+        return INTEGER_12
+    if 0 <= value <= 4095:
+        return INTEGER_12U
+    if 0 <= value <= 1048575:
+        return INTEGER_20
+    return INTEGER_32
+
+def is_valid_identifier(value):
+    return re.fullmatch(r"[A-Za-z_.$][A-Za-z0-9_.$]*", value) is not None
+
+def match_token_type(value):
+    ''' Determine the type of a token string (in the order used by RARS) '''
+    if value.startswith("'"):
+        return ERROR
+    if value.startswith("#"):
+        return COMMENT
+    if value in SINGLE_CHARACTER_TYPES:
+        return SINGLE_CHARACTER_TYPES[value]
+    if value == "%hi":
+        return HI
+    if value == "%lo":
+        return LO
+    if value in REGISTER_NUMBERS:
+        return REGISTER_NAME if value in REGISTER_NAMES else REGISTER_NUMBER
+    int_value = string_to_int(value)
+    if int_value is not None:
+        return integer_token_type(int_value)
+    if value.startswith(".") and value in DIRECTIVES + UNSUPPORTED_DIRECTIVES:
+        return DIRECTIVE
+    if value.startswith('"'):
+        return QUOTED_STRING
+    if value in INSTRUCTIONS:
+        return OPERATOR
+    if is_valid_identifier(value):
+        return IDENTIFIER
+    return ERROR
+
+def is_unsupported_operator(value):
+    return value in UNSUPPORTED_OPERATORS or (value.startswith("f") and "." in value)
+
+def character_literal_value(value):
+    ''' Convert a character literal ('a', '\\n', '\\101') to its decimal string.
+    Literals that are not valid are returned unchanged. '''
+    match = re.fullmatch(r"'(?:([^\\'])|\\([ntbrf0'\"\\])|\\([0-7]{3}))'", value)
+    if not match:
+        return value
+    if match.group(1) is not None:
+        return str(ord(match.group(1)))
+    if match.group(2) is not None:
+        return str(ESCAPE_CHARACTERS[match.group(2)])
+    octal_value = int(match.group(3), 8)
+    return str(octal_value) if octal_value <= 255 else value
+
+#########################################################################################
+# Instructions
+#########################################################################################
+
+class basic_instruction():
+    ''' A machine instruction. The example gives the mnemonic and the operand types. '''
+    def __init__(self, example, instruction_format, opcode, funct3 = 0, funct7 = 0):
+        self.example = example
+        self.mnemonic = example.split()[0]
+        self.format = instruction_format
+        self.opcode = opcode
+        self.funct3 = funct3
+        self.funct7 = funct7
+        self.tokens = None
+        self.size = 4
+
+    def encode(self, operands):
+        ''' The machine code for the operand values (registers, immediates and offsets) '''
+        fields = self.funct3 << 12 | self.opcode
+        if self.format == "R":
+            rd, rs1, rs2 = operands
+            return self.funct7 << 25 | rs2 << 20 | rs1 << 15 | rd << 7 | fields
+        if self.format in ("I", "JALR"):
+            rd, rs1, imm = operands
+            return (imm & 0xfff) << 20 | rs1 << 15 | rd << 7 | fields
+        if self.format == "SHIFT":
+            rd, rs1, shamt = operands
+            return self.funct7 << 25 | (shamt & 0x1f) << 20 | rs1 << 15 | rd << 7 | fields
+        if self.format == "LOAD":
+            rd, imm, rs1 = operands
+            return (imm & 0xfff) << 20 | rs1 << 15 | rd << 7 | fields
+        if self.format == "S":
+            rs2, imm, rs1 = operands
+            return (imm >> 5 & 0x7f) << 25 | rs2 << 20 | rs1 << 15 | (imm & 0x1f) << 7 | fields
+        if self.format == "B":
+            rs1, rs2, offset = operands
+            return ((offset >> 12 & 1) << 31 | (offset >> 5 & 0x3f) << 25 | rs2 << 20 | rs1 << 15 |
+                (offset >> 1 & 0xf) << 8 | (offset >> 11 & 1) << 7 | fields)
+        if self.format == "U":
+            rd, imm = operands
+            return (imm & 0xfffff) << 12 | rd << 7 | self.opcode
+        if self.format == "J":
+            rd, offset = operands
+            return ((offset >> 20 & 1) << 31 | (offset >> 1 & 0x3ff) << 21 | (offset >> 11 & 1) << 20 |
+                (offset >> 12 & 0xff) << 12 | rd << 7 | self.opcode)
+        # Instructions without operands
+        return self.opcode
+
+class pseudo_instruction():
+    ''' An extended instruction that is replaced by one or more basic instructions.
+    The templates use the RARS substitution syntax (RGn, VLn, VHn, LLn, LHn, PCLn, PCHn, LAB). '''
+    def __init__(self, example, templates):
+        self.example = example
+        self.mnemonic = example.split()[0]
+        self.templates = templates
+        self.tokens = None
+        self.size = 4 * len(templates)
+
+BASIC_INSTRUCTIONS = [
+    basic_instruction("add t1,t2,t3", "R", 0x33, 0, 0x00),
+    basic_instruction("sub t1,t2,t3", "R", 0x33, 0, 0x20),
+    basic_instruction("sll t1,t2,t3", "R", 0x33, 1, 0x00),
+    basic_instruction("slt t1,t2,t3", "R", 0x33, 2, 0x00),
+    basic_instruction("sltu t1,t2,t3", "R", 0x33, 3, 0x00),
+    basic_instruction("xor t1,t2,t3", "R", 0x33, 4, 0x00),
+    basic_instruction("srl t1,t2,t3", "R", 0x33, 5, 0x00),
+    basic_instruction("sra t1,t2,t3", "R", 0x33, 5, 0x20),
+    basic_instruction("or t1,t2,t3", "R", 0x33, 6, 0x00),
+    basic_instruction("and t1,t2,t3", "R", 0x33, 7, 0x00),
+    basic_instruction("mul t1,t2,t3", "R", 0x33, 0, 0x01),
+    basic_instruction("mulh t1,t2,t3", "R", 0x33, 1, 0x01),
+    basic_instruction("mulhsu t1,t2,t3", "R", 0x33, 2, 0x01),
+    basic_instruction("mulhu t1,t2,t3", "R", 0x33, 3, 0x01),
+    basic_instruction("div t1,t2,t3", "R", 0x33, 4, 0x01),
+    basic_instruction("divu t1,t2,t3", "R", 0x33, 5, 0x01),
+    basic_instruction("rem t1,t2,t3", "R", 0x33, 6, 0x01),
+    basic_instruction("remu t1,t2,t3", "R", 0x33, 7, 0x01),
+    basic_instruction("addi t1,t2,-100", "I", 0x13, 0),
+    basic_instruction("slti t1,t2,-100", "I", 0x13, 2),
+    basic_instruction("sltiu t1,t2,-100", "I", 0x13, 3),
+    basic_instruction("xori t1,t2,-100", "I", 0x13, 4),
+    basic_instruction("ori t1,t2,-100", "I", 0x13, 6),
+    basic_instruction("andi t1,t2,-100", "I", 0x13, 7),
+    basic_instruction("slli t1,t2,10", "SHIFT", 0x13, 1, 0x00),
+    basic_instruction("srli t1,t2,10", "SHIFT", 0x13, 5, 0x00),
+    basic_instruction("srai t1,t2,10", "SHIFT", 0x13, 5, 0x20),
+    basic_instruction("lb t1, -100(t2)", "LOAD", 0x03, 0),
+    basic_instruction("lh t1, -100(t2)", "LOAD", 0x03, 1),
+    basic_instruction("lw t1, -100(t2)", "LOAD", 0x03, 2),
+    basic_instruction("lbu t1, -100(t2)", "LOAD", 0x03, 4),
+    basic_instruction("lhu t1, -100(t2)", "LOAD", 0x03, 5),
+    basic_instruction("sb t1, -100(t2)", "S", 0x23, 0),
+    basic_instruction("sh t1, -100(t2)", "S", 0x23, 1),
+    basic_instruction("sw t1, -100(t2)", "S", 0x23, 2),
+    basic_instruction("beq t1,t2,label", "B", 0x63, 0),
+    basic_instruction("bne t1,t2,label", "B", 0x63, 1),
+    basic_instruction("blt t1,t2,label", "B", 0x63, 4),
+    basic_instruction("bge t1,t2,label", "B", 0x63, 5),
+    basic_instruction("bltu t1,t2,label", "B", 0x63, 6),
+    basic_instruction("bgeu t1,t2,label", "B", 0x63, 7),
+    basic_instruction("lui t1,100000", "U", 0x37),
+    basic_instruction("auipc t1,100000", "U", 0x17),
+    basic_instruction("jal t1, target", "J", 0x6f),
+    basic_instruction("jalr t1, t2, -100", "JALR", 0x67, 0),
+    basic_instruction("ecall", "SYSTEM", 0x00000073),
+    basic_instruction("ebreak", "SYSTEM", 0x00100073),
+]
+
+# The integer pseudo instructions of the RARS 'PseudoOps.txt' (in the same order)
+PSEUDO_OPS = '''
+nop ;addi x0, x0, 0
+not t1,t2 ;xori RG1, RG2, -1
+mv  t1,t2 ;add RG1, x0, RG2
+neg t1,t2 ;sub RG1, x0, RG2
+sgt  t1,t2,t3 ;slt  RG1, RG3, RG2
+sgtu t1,t2,t3 ;sltu RG1, RG3, RG2
+seqz t1,t2    ;sltiu RG1, RG2, 1
+snez t1,t2    ;sltu RG1, x0, RG2
+sgtz t1,t2    ;slt RG1, x0, RG2
+sltz t1,t2    ;slt RG1, RG2, x0
+b label       ;jal x0, LAB
+beqz t1,label ;beq RG1, x0, LAB
+bnez t1,label ;bne RG1, x0, LAB
+bgez t1,label ;bge RG1, x0, LAB
+bltz t1,label ;blt RG1, x0, LAB
+bgtz t1,label ;blt x0, RG1, LAB
+blez t1,label ;bge x0, RG1, LAB
+bgt  t1,t2,label ;blt  RG2, RG1, LAB
+bgtu t1,t2,label ;bltu RG2, RG1, LAB
+ble  t1,t2,label ;bge  RG2, RG1, LAB
+bleu t1,t2,label ;bgeu RG2, RG1, LAB
+j label         ;jal  x0, LAB
+jal label       ;jal  x1, LAB
+jr t0           ;jalr x0, RG1, 0
+jalr t0         ;jalr x1, RG1, 0
+jr t0, -100     ;jalr x0, RG1, VL2
+jalr t0, -100   ;jalr x1, RG1, VL2
+jalr t0,-100(t1);jalr RG1, RG4, VL2
+ret             ;jalr x0, x1, 0
+call label      ;auipc x6,PCH1     ;jalr x1, x6, PCL1
+tail label      ;auipc x6,PCH1     ;jalr x0, x6, PCL1
+li t1,-100     ;addi RG1, x0, VL2
+li t1,10000000 ;lui RG1, VH2 ;addi RG1, RG1, VL2
+la t1,label  ;auipc RG1, PCH2 ; addi RG1, RG1, PCL2
+lw t1,(t2)     ;lw RG1,0(RG3)
+lw t1,-100     ;lw RG1, VL2(x0)
+lw t1,10000000 ;lui   RG1, VH2  ;lw RG1, VL2(RG1)
+lw t1,label    ;auipc RG1, PCH2 ;lw RG1, PCL2(RG1)
+sw t1,(t2)        ;sw RG1,0(RG3)
+sw t1,-100        ;sw RG1, VL2(x0)
+sw t1,10000000,t2 ;lui   RG3, VH2  ;sw RG1, VL2(RG3)
+sw t1,label,t2    ;auipc RG3, PCH2 ;sw RG1, PCL2(RG3)
+lh t1,(t2)     ;lh RG1,  0(RG3)
+lh t1,-100     ;lh RG1, VL2(x0)
+lh t1,10000000 ;lui RG1, VH2    ;lh RG1, VL2(RG1)
+lh t1,label    ;auipc RG1, PCH2 ;lh RG1, PCL2(RG1)
+sh t1,(t2)        ;sh RG1,0(RG3)
+sh t1,-100        ;sh RG1, VL2(x0)
+sh t1,10000000,t2 ;lui   RG3, VH2  ;sh RG1, VL2(RG3)
+sh t1,label,t2    ;auipc RG3, PCH2 ;sh RG1, PCL2(RG3)
+lb t1,(t2)     ;lb RG1,0(RG3)
+lb t1,-100     ;lb RG1, VL2(x0)
+lb t1,10000000 ;lui RG1, VH2    ;lb RG1, VL2(RG1)
+lb t1,label    ;auipc RG1, PCH2 ;lb RG1, PCL2(RG1)
+sb t1,(t2)        ;sb RG1,0(RG3)
+sb t1,-100        ;sb RG1, VL2(x0)
+sb t1,10000000,t2 ;lui   RG3, VH2  ;sb RG1, VL2(RG3)
+sb t1,label,t2    ;auipc RG3, PCH2 ;sb RG1, PCL2(RG3)
+lhu t1,(t2)     ;lhu RG1,0(RG3)
+lhu t1,-100     ;lhu RG1, VL2(x0)
+lhu t1,10000000 ;lui RG1, VH2     ;lhu RG1, VL2(RG1)
+lhu t1,label    ;auipc RG1, PCH2  ;lhu RG1, PCL2(RG1)
+lbu t1,(t2)     ;lbu RG1,0(RG3)
+lbu t1,-100     ;lbu RG1, VL2(x0)
+lbu t1,10000000 ;lui RG1, VH2    ;lbu RG1, VL2(RG1)
+lbu t1,label    ;auipc RG1, PCH2 ;lbu RG1, PCL2(RG1)
+sext.b t1, t2 ; slli RG1, RG2, 24 ;srai RG1, RG1, 24
+sext.h t1, t2 ; slli RG1, RG2, 16 ;srai RG1, RG1, 16
+zext.b t1, t2 ; andi RG1, RG2, 255
+zext.h t1, t2 ; slli RG1, RG2, 16 ;srli RG1, RG1, 16
+lui t1,%hi(label)     ;lui RG1,LH4
+addi t1,t2,%lo(label) ;addi RG1,RG2,LL5
+lb t1,%lo(label)(t2)  ;lb RG1,LL4(RG7)
+lh t1,%lo(label)(t2)  ;lh RG1,LL4(RG7)
+lw t1,%lo(label)(t2)  ;lw RG1,LL4(RG7)
+'''
+
+def create_instruction_set():
+    ''' Map each mnemonic to its instructions (basic instructions before pseudo instructions) '''
+    instructions = {}
+    for instruction in BASIC_INSTRUCTIONS:
+        instructions.setdefault(instruction.mnemonic, []).append(instruction)
+    for line in PSEUDO_OPS.strip().splitlines():
+        fields = [field.strip() for field in line.split(";")]
+        instruction = pseudo_instruction(fields[0], fields[1:])
+        instructions.setdefault(instruction.mnemonic, []).append(instruction)
+    return instructions
+
+INSTRUCTIONS = create_instruction_set()
+
+#########################################################################################
+# Assembler
+#########################################################################################
+
+class assembly_message():
+    ''' An error or warning of the assembler '''
+    def __init__(self, filename, line, column, message, warning = False, unsupported = False):
+        self.filename = filename
+        self.line = line
+        self.column = column
+        self.message = message
+        self.warning = warning
+        # The error is a RARS feature that this assembler does not support
+        self.unsupported = unsupported
+
+    def report(self):
+        kind = "Warning" if self.warning else "Error"
+        return f"{kind} in {self.filename} line {self.line} column {self.column}: {self.message}\n"
+
+class assembly_error(Exception):
+    ''' Raised when a program has assembly errors '''
+    def __init__(self, messages):
+        super().__init__(f"{len([m for m in messages if not m.warning])} assembly error(s)")
+        self.messages = messages
+
+    def report(self):
+        return "".join(message.report() for message in self.messages)
+
+    @property
+    def unsupported(self):
+        ''' True if the program uses a RARS feature that this assembler does not support '''
+        return any(message.unsupported for message in self.messages)
+
+class program_statement():
+    ''' A statement of the text segment. Basic statements have machine code,
+    pseudo instructions are replaced by their basic statements in the second pass. '''
+    def __init__(self, source, line, tokens, instruction, address):
+        self.source = source
+        self.line = line
+        self.tokens = tokens
+        self.instruction = instruction
+        self.address = address
+        self.basic = ""
+        self.code = 0
+
+class data_memory():
+    ''' The bytes written into the data segment, allocated in blocks like RARS '''
+    def __init__(self, base_address):
+        self.base_address = base_address
+        self.blocks = {}
+
+    def block(self, address, allocate = False):
+        index, offset = divmod(address - self.base_address, MEMORY_BLOCK_BYTES)
+        if index not in self.blocks and allocate:
+            self.blocks[index] = bytearray(MEMORY_BLOCK_BYTES)
+        return self.blocks.get(index), offset
+
+    def set(self, address, value, length):
+        ''' Write length bytes of value (little endian) '''
+        for i in range(length):
+            block, offset = self.block(address + i, True)
+            block[offset] = (value >> (8 * i)) & 0xff
+
+    def word_or_none(self, address):
+        ''' The word at the address (None if it is in a block that was never written) '''
+        block, offset = self.block(address)
+        if block is None:
+            return None
+        return int.from_bytes(block[offset:offset + 4], "little")
+
+class assembled_program():
+    ''' The text statements, data memory and symbols of an assembled program '''
+    def __init__(self, filename, configuration, statements, data, symbols, messages):
+        self.filename = filename
+        self.configuration = configuration
+        self.statements = {statement.address : statement for statement in statements}
+        self.data = data
+        self.symbols = symbols
+        self.messages = messages
+
+    def word_or_none(self, address):
+        ''' The word at the address in the text or data segment (None if never written) '''
+        if address in self.statements:
+            return self.statements[address].code
+        if self.in_text_segment(address):
+            return None
+        return self.data.word_or_none(address)
+
+    def in_text_segment(self, address):
+        return self.configuration["text_base"] <= address <= self.configuration["text_limit"]
+
+    def segment_bounds(self, segment):
+        ''' The address range of a segment name ('.text', '.data') or 'low-high' address range '''
+        if segment == ".text":
+            return self.configuration["text_base"], self.configuration["text_limit"]
+        if segment == ".data":
+            return self.configuration["data_base"], self.configuration["data_segment_limit"]
+        bounds = segment.split("-")
+        if len(bounds) == 2 and None not in [string_to_int(bound) for bound in bounds]:
+            return tuple(string_to_int(bound) & 0xffffffff for bound in bounds)
+        return None
+
+    def last_written_address(self, low, high):
+        ''' The address of the last word before the first word that was never written
+        (RARS dumps a segment up to this address) '''
+        address = low
+        while address < high and self.word_or_none(address) is not None:
+            address += 4
+        return address - 4
+
+    def dump_lines(self, low, high, dump_format):
+        ''' The lines of a dump file in the 'HexText', 'BinaryText' or 'SegmentWindow' format '''
+        lines = []
+        if dump_format == "SegmentWindow":
+            if self.in_text_segment(low):
+                lines += ["Address     Code        Basic                        Line Source", ""]
+                for address in range(low, high + 1, 4):
+                    statement = self.statements.get(address)
+                    if statement is None:
+                        break
+                    line_str = str(statement.line) if statement.source != "" else ""
+                    lines.append(f"0x{address:08x}  0x{statement.code:08x}  " +
+                        f"{statement.basic:<29}"[:29] + f"{line_str:<5}"[:5] + statement.source)
+            else:
+                line = ""
+                for offset, address in enumerate(range(low, high + 1, 4)):
+                    if offset % 8 == 0:
+                        line = f"0x{address:08x}    "
+                    word = self.word_or_none(address)
+                    if word is None:
+                        break
+                    line += f"0x{word:08x} "
+                    if (offset + 1) % 8 == 0:
+                        lines.append(line)
+            return lines
+        for address in range(low, high + 1, 4):
+            word = self.word_or_none(address)
+            if word is None:
+                break
+            lines.append(f"{word:08x}" if dump_format == "HexText" else f"{word:032b}")
+        return lines
+
+    def dump(self, segment, dump_format, filename):
+        ''' Write a dump file like the RARS 'dump' option. Returns an error message or None
+        (no file is written for a segment that was never written). '''
+        bounds = self.segment_bounds(segment)
+        if bounds is None:
+            return f"Error while attempting to save dump, segment/address-range {segment} is invalid!"
+        if dump_format not in ("HexText", "BinaryText", "SegmentWindow"):
+            return f"Error while attempting to save dump, format {dump_format} was not found!"
+        low, high = bounds
+        high_address = self.last_written_address(low, high)
+        if high_address < low:
+            return "This segment has not been written to, there is nothing to dump."
+        lines = self.dump_lines(low, high_address, dump_format)
+        with open(filename, "w", newline="\n") as f:
+            f.write("".join(line + "\n" for line in lines))
+        return None
+
+class rars_assembler():
+    ''' Assembles a single RISC-V assembly file like the RARS assembler '''
+    def __init__(self, memory_configuration = DEFAULT_MEMORY_CONFIGURATION):
+        if memory_configuration not in MEMORY_CONFIGURATIONS:
+            raise ValueError(f"Unknown memory configuration {memory_configuration}")
+        self.configuration = MEMORY_CONFIGURATIONS[memory_configuration]
+
+    def error(self, line, column, message, warning = False, unsupported = False):
+        self.messages.append(assembly_message(self.filename, line, column, message, warning, unsupported))
+
+    def errors_occurred(self):
+        return any(not message.warning for message in self.messages)
+
+    def assemble_file(self, filename):
+        ''' Assemble a file. Returns an 'assembled_program' or raises an 'assembly_error' '''
+        path = pathlib.Path(filename)
+        with open(path, "r", encoding="utf-8", errors="replace", newline=None) as f:
+            lines = f.read().splitlines()
+        return self.assemble(lines, str(path.resolve()))
+
+    def assemble(self, lines, filename = ""):
+        ''' Assemble the lines of a program '''
+        self.filename = filename
+        self.messages = []
+        self.equivalents = {}
+        self.symbols = {}
+        self.globals = []
+        self.forward_references = []
+        self.text_address = self.configuration["text_base"]
+        self.data_address = self.configuration["data_base"]
+        self.extern_address = self.configuration["extern_base"]
+        self.in_data_segment = False
+        self.auto_align = True
+        self.data_directive = None
+        self.data = data_memory(self.configuration["data_segment_base"])
+        # Tokenize all of the lines before parsing them
+        tokenized_lines = []
+        for line_number, line in enumerate(lines, 1):
+            tokens, source = self.tokenize_line(line, line_number)
+            self.check_supported(tokens)
+            tokenized_lines.append((line_number, source, tokens))
+        if self.errors_occurred():
+            raise assembly_error(self.messages)
+        # First pass: record labels, store data and create the text statements
+        statements = []
+        for line_number, source, tokens in tokenized_lines:
+            statement = self.parse_line(tokens, source, line_number)
+            if statement is not None:
+                statements.append(statement)
+        self.resolve_forward_references()
+        self.check_globals()
+        if self.errors_occurred():
+            raise assembly_error(self.messages)
+        # Second pass: generate the basic statements and their machine code
+        basic_statements = []
+        for statement in statements:
+            basic_statements += self.generate_basic_statements(statement)
+        for statement in basic_statements:
+            if not (self.configuration["text_base"] <= statement.address <= self.configuration["text_limit"]):
+                self.error(statement.line, 0, f"Invalid address for text segment: 0x{statement.address:08x}")
+                break
+        if self.errors_occurred():
+            raise assembly_error(self.messages)
+        return assembled_program(filename, self.configuration, basic_statements, self.data,
+            dict(self.symbols), self.messages)
+
+    #####################################################################################
+    # Tokenizer
+    #####################################################################################
+
+    def tokenize_line(self, line, line_number, substitute_equivalents = True):
+        ''' Tokenize a line. Returns the tokens and the source of the line
+        (after the '.eqv' substitutions). '''
+        tokens = []
+        current = ""
+        start = 1
+        in_string = False
+        position = 0
+
+        def add_token(value, column):
+            if value.startswith("'"):
+                value = character_literal_value(value)
+            token_type = match_token_type(value)
+            if token_type == ERROR:
+                self.error(line_number, column, f"Invalid language element: {value}")
+            tokens.append(token(token_type, value, line_number, column))
+
+        while position < len(line):
+            c = line[position]
+            if in_string:
+                current += c
+                if c == '"' and current[-2] != "\\":
+                    add_token(current, start)
+                    current = ""
+                    in_string = False
+            elif c == "#":
+                if current:
+                    add_token(current, start)
+                add_token(line[position:], position + 1)
+                current = ""
+                break
+            elif c in " \t,":
+                if current:
+                    add_token(current, start)
+                    current = ""
+            elif c in "+-":
+                # Exponent of a real number
+                if (current and current[-1] in "eE" and position + 1 < len(line) and
+                        line[position + 1].isdigit()):
+                    current += c
+                    position += 1
+                    continue
+                if current:
+                    add_token(current, start)
+                start = position + 1
+                current = c
+                # The sign is the start of a number unless it follows an identifier (label+4)
+                if not ((not tokens or tokens[-1].type != IDENTIFIER) and
+                        position + 1 < len(line) and line[position + 1].isdigit()):
+                    add_token(current, start)
+                    current = ""
+            elif c in ":()":
+                if current:
+                    add_token(current, start)
+                add_token(c, position + 1)
+                current = ""
+            elif c == '"':
+                if current:
+                    add_token(current, start)
+                start = position + 1
+                current = c
+                in_string = True
+            elif c == "'":
+                if current:
+                    add_token(current, start)
+                    current = ""
+                match = re.match(r"'(?:\\[0-7]{3}|\\.|[^\\'])'", line[position:])
+                if match:
+                    add_token(match.group(0), position + 1)
+                    position += len(match.group(0))
+                    continue
+                start = position + 1
+                current = c
+            else:
+                if not current:
+                    start = position + 1
+                current += c
+            position += 1
+        if current:
+            if in_string:
+                self.error(line_number, start, "String is not terminated.")
+            add_token(current, start)
+        if substitute_equivalents:
+            return self.process_equivalents(tokens, line, line_number)
+        return tokens, line
+
+    def process_equivalents(self, tokens, line, line_number):
+        ''' Record an '.eqv' definition or substitute the defined symbols of a line '''
+        directive_index = None
+        if len(tokens) > 0 and tokens[0].type == DIRECTIVE:
+            directive_index = 0
+        elif len(tokens) > 2 and tokens[2].type == DIRECTIVE and tokens[1].type == COLON:
+            directive_index = 2
+        if directive_index is not None and tokens[directive_index].value == ".eqv":
+            operands = [t for t in tokens[directive_index + 1:] if t.type != COMMENT]
+            if len(operands) < 2:
+                self.error(line_number, tokens[directive_index].column,
+                    f"Too few operands for {tokens[directive_index].value} directive")
+                return tokens, line
+            symbol = operands[0]
+            if symbol.type not in (IDENTIFIER, OPERATOR, REGISTER_NAME, REGISTER_NUMBER):
+                self.error(line_number, symbol.column, "Malformed .eqv directive")
+                return tokens, line
+            start = operands[1].column
+            end = operands[-1].column + len(operands[-1].value)
+            expression = line[start - 1:end - 1]
+            if re.search(rf"\b{re.escape(symbol.value)}\b", expression):
+                self.error(line_number, symbol.column, f"Cannot substitute {symbol.value} for itself")
+                return tokens, line
+            if symbol.value in self.equivalents and self.equivalents[symbol.value] != expression:
+                self.error(line_number, symbol.column, f"\"{symbol.value}\" is already defined")
+                return tokens, line
+            self.equivalents[symbol.value] = expression
+            return tokens, line
+        for t in tokens:
+            if t.type == IDENTIFIER and t.value in self.equivalents:
+                substituted = line[:t.column - 1] + self.equivalents[t.value] + line[t.column - 1 + len(t.value):]
+                return self.tokenize_line(substituted, line_number)
+        return tokens, line
+
+    def check_supported(self, tokens):
+        ''' Report the directives and instructions of a line that this assembler does not
+        support (before the line is parsed as the macro arguments are not valid tokens) '''
+        tokens = [t for t in tokens if t.type != COMMENT]
+        if len(tokens) >= 2 and tokens[1].type == COLON:
+            tokens = tokens[2:]
+        if not tokens:
+            return
+        first = tokens[0]
+        if first.value in UNSUPPORTED_DIRECTIVES:
+            self.error(first.line, first.column,
+                f"\"{first.value}\" directive is not supported by this assembler (use RARS)",
+                unsupported = True)
+        elif first.type != DIRECTIVE and is_unsupported_operator(first.value):
+            self.error(first.line, first.column,
+                f"\"{first.value}\" is not supported by this assembler (use RARS)",
+                unsupported = True)
+
+    #####################################################################################
+    # First pass
+    #####################################################################################
+
+    def parse_line(self, tokens, source, line_number):
+        ''' Parse a line in the first pass. Directives are executed and a statement
+        is returned for an instruction. '''
+        tokens = [t for t in tokens if t.type != COMMENT]
+        if len(tokens) >= 2 and tokens[0].type in (IDENTIFIER, OPERATOR) and tokens[1].type == COLON:
+            self.add_symbol(tokens[0])
+            tokens = tokens[2:]
+        if not tokens:
+            return None
+        first = tokens[0]
+        if first.type == DIRECTIVE:
+            self.execute_directive(tokens)
+            return None
+        if first.type == IDENTIFIER and first.value.startswith("."):
+            self.error(line_number, first.column,
+                f"RARS does not recognize the {first.value} directive.  Ignored.", True)
+            return None
+        if self.in_data_segment:
+            if first.type in (PLUS, MINUS, QUOTED_STRING, IDENTIFIER) + INTEGER_TYPES:
+                self.execute_directive_continuation(tokens)
+            return None
+        instructions = self.match_instruction(first)
+        if instructions is None:
+            return None
+        instruction = self.best_operand_match(tokens, instructions)
+        if not self.operand_match(tokens, instruction, True):
+            return None
+        statement = program_statement(source, line_number, tokens, instruction, self.text_address)
+        self.text_address += instruction.size
+        return statement
+
+    def add_symbol(self, label):
+        if label.value in self.symbols:
+            self.error(label.line, label.column, f"label \"{label.value}\" already defined")
+            return
+        self.symbols[label.value] = self.data_address if self.in_data_segment else self.text_address
+
+    def match_instruction(self, operator):
+        if operator.type != OPERATOR:
+            self.error(operator.line, operator.column, f"\"{operator.value}\" is not a recognized operator")
+            return None
+        return INSTRUCTIONS[operator.value]
+
+    def best_operand_match(self, tokens, instructions):
+        ''' The first instruction whose operands match (or the first instruction) '''
+        if len(instructions) == 1:
+            return instructions[0]
+        for instruction in instructions:
+            if self.operand_match(tokens, instruction, False):
+                return instruction
+        return instructions[0]
+
+    def operand_match(self, tokens, instruction, report_errors):
+        ''' Check the number and the types of the operands against the instruction example '''
+        spec = instruction_tokens(instruction)
+        if len(tokens) != len(spec):
+            if report_errors:
+                kind = "few" if len(tokens) < len(spec) else "many"
+                self.error(tokens[0].line, tokens[0].column,
+                    f"Too {kind} or incorrectly formatted operands. Expected: {instruction.example}")
+            return False
+        for i, (candidate, expected) in enumerate(zip(tokens, spec)):
+            message = None
+            if expected.type == candidate.type:
+                pass
+            elif expected.type == IDENTIFIER and candidate.type == OPERATOR:
+                tokens[i] = token(IDENTIFIER, candidate.value, candidate.line, candidate.column)
+            elif expected.type in REGISTER_TYPES and candidate.type == REGISTER_NAME:
+                pass
+            elif expected.type == REGISTER_NAME and candidate.type == REGISTER_NUMBER:
+                pass
+            elif candidate.type in INTEGER_WIDENING.get(expected.type, ()):
+                pass
+            elif expected.type == INTEGER_12 and candidate.type == INTEGER_12U:
+                message = "Unsigned value is too large to fit into a sign-extended immediate"
+            elif expected.type in INTEGER_TYPES and candidate.type in INTEGER_TYPES:
+                message = "operand is out of range"
+            else:
+                message = "operand is of incorrect type"
+            if message is not None:
+                if report_errors:
+                    self.error(candidate.line, candidate.column, f"\"{candidate.value}\": {message}")
+                return False
+        return True
+
+    def align_data_address(self, boundary):
+        ''' Align the data address (labels at the old address move with it) '''
+        remainder = self.data_address % boundary
+        if remainder == 0:
+            return
+        aligned = self.data_address + boundary - remainder
+        for name, address in self.symbols.items():
+            if address == self.data_address:
+                self.symbols[name] = aligned
+        self.data_address = aligned
+
+    def execute_directive(self, tokens):
+        directive = tokens[0]
+        operands = tokens[1:]
+        name = directive.value
+        if name == ".eqv":
+            pass
+        elif name in (".data", ".text"):
+            self.in_data_segment = name == ".data"
+            if self.in_data_segment:
+                self.auto_align = True
+            if operands and operands[0].type in INTEGER_TYPES:
+                address = string_to_int(operands[0].value) & 0xffffffff
+                if self.in_data_segment:
+                    self.data_address = address
+                else:
+                    self.text_address = address
+        elif name in DATA_DIRECTIVE_LENGTHS or name in STRING_DIRECTIVES:
+            self.data_directive = name
+            if self.passes_data_segment_check(directive):
+                if name in STRING_DIRECTIVES:
+                    self.store_strings(tokens)
+                elif len(tokens) > 1:
+                    self.store_numeric(tokens)
+        elif name == ".align":
+            value = self.directive_integer(directive, operands)
+            if value is None:
+                return
+            if value < 2 and not self.in_data_segment:
+                self.error(directive.line, directive.column, "Alignments less than 4 bytes are not " +
+                    "supported in the text section. The alignment has been rounded up to 4 bytes.", True)
+                self.align_data_address(4)
+            elif value == 0:
+                self.auto_align = False
+            else:
+                self.align_data_address(2 ** value)
+        elif name == ".space":
+            if self.passes_data_segment_check(directive):
+                value = self.directive_integer(directive, operands)
+                if value is not None:
+                    self.data_address += value
+        elif name == ".extern":
+            if len(operands) != 2:
+                self.error(directive.line, directive.column,
+                    f"\"{name}\" directive requires two operands (label and size).")
+                return
+            size = string_to_int(operands[1].value) if operands[1].type in INTEGER_TYPES else None
+            if size is None or size < 0:
+                self.error(directive.line, directive.column, f"\"{name}\" requires a non-negative integer size")
+                return
+            if operands[0].value not in self.symbols:
+                self.symbols[operands[0].value] = self.extern_address
+                self.extern_address += size
+        elif name in (".globl", ".global"):
+            if not operands:
+                self.error(directive.line, directive.column,
+                    f"\"{name}\" directive requires at least one argument.")
+                return
+            for operand in operands:
+                if operand.type != IDENTIFIER:
+                    self.error(operand.line, operand.column, f"\"{operand.value}\" directive argument must be label.")
+                    return
+                self.globals.append(operand)
+
+    def directive_integer(self, directive, operands):
+        ''' The single non-negative integer operand of a directive (None on error) '''
+        if len(operands) != 1:
+            self.error(directive.line, directive.column, f"\"{directive.value}\" requires one operand")
+            return None
+        value = string_to_int(operands[0].value) if operands[0].type in INTEGER_TYPES else None
+        if value is None or value < 0:
+            self.error(directive.line, directive.column, f"\"{directive.value}\" requires a non-negative integer")
+            return None
+        return value
+
+    def passes_data_segment_check(self, directive):
+        if not self.in_data_segment:
+            self.error(directive.line, directive.column,
+                f"\"{directive.value}\" directive cannot appear in text segment")
+            return False
+        return True
+
+    def execute_directive_continuation(self, tokens):
+        ''' A data line without a directive continues the previous data directive '''
+        if self.data_directive in STRING_DIRECTIVES:
+            self.store_strings(tokens)
+        elif self.data_directive in DATA_DIRECTIVE_LENGTHS:
+            self.store_numeric(tokens)
+
+    def store_numeric(self, tokens):
+        ''' Store the values of a '.word', '.half' or '.byte' directive (or its continuation) '''
+        start = 1 if tokens[0].type == DIRECTIVE else 0
+        length = DATA_DIRECTIVE_LENGTHS[self.data_directive]
+        # 'value : count' repeats the value
+        if len(tokens) == 4 and tokens[2].type == COLON:
+            value_token, count_token = tokens[start], tokens[start + 2]
+            if value_token.type not in INTEGER_TYPES or count_token.type not in INTEGER_TYPES:
+                self.error(value_token.line, value_token.column, "malformed expression")
+                return
+            count = string_to_int(count_token.value)
+            if count <= 0:
+                self.error(count_token.line, count_token.column, "repetition factor must be positive")
+                return
+            if self.auto_align:
+                self.align_data_address(length)
+            for i in range(count):
+                self.store_integer(value_token, length)
+            return
+        for value_token in tokens[start:]:
+            self.store_integer(value_token, length)
+
+    def store_integer(self, value_token, length):
+        if value_token.type in INTEGER_TYPES:
+            value = string_to_int(value_token.value)
+            if length < 4:
+                mask = (1 << (8 * length)) - 1
+                if value < -(1 << (8 * length - 1)) or value > mask:
+                    self.error(value_token.line, value_token.column,
+                        f"value 0x{value & 0xffffffff:08x} is out-of-range and truncated to 0x{value & mask:08x}",
+                        True)
+                    value &= mask
+            self.write_data(value, length, value_token)
+        elif value_token.type == IDENTIFIER and length == 4:
+            if value_token.value in self.symbols:
+                self.write_data(self.symbols[value_token.value], length, value_token)
+            else:
+                if self.auto_align:
+                    self.align_data_address(length)
+                self.forward_references.append((self.data_address, length, value_token))
+                self.write_data(0, length, value_token)
+        else:
+            self.error(value_token.line, value_token.column,
+                f"\"{value_token.value}\" is not a valid integer constant or label")
+
+    def write_data(self, value, length, value_token):
+        if self.auto_align:
+            self.align_data_address(length)
+        if not (self.configuration["data_segment_base"] <= self.data_address and
+                self.data_address + length - 1 <= self.configuration["data_segment_limit"]):
+            self.error(value_token.line, value_token.column,
+                f"\"{self.data_address}\" is not a valid data segment address")
+            return
+        self.data.set(self.data_address, value, length)
+        self.data_address += length
+
+    def store_strings(self, tokens):
+        ''' Store the UTF-8 bytes of the strings of an '.ascii', '.asciz' or '.string' directive '''
+        start = 1 if tokens[0].type == DIRECTIVE else 0
+        for string_token in tokens[start:]:
+            if string_token.type != QUOTED_STRING:
+                self.error(string_token.line, string_token.column,
+                    f"\"{string_token.value}\" is not a valid character string")
+                return
+            text = string_token.value[1:-1]
+            characters = []
+            i = 0
+            while i < len(text):
+                c = text[i]
+                if c == "\\" and i + 1 < len(text):
+                    i += 1
+                    escape = text[i]
+                    if escape == "u":
+                        digits = text[i + 1:i + 5]
+                        if not re.fullmatch(r"[0-9a-fA-F]{4}", digits):
+                            self.error(string_token.line, string_token.column,
+                                f"illegal unicode escape: \"\\u{digits}\"")
+                            return
+                        c = chr(int(digits, 16))
+                        i += 4
+                    elif escape in ESCAPE_CHARACTERS:
+                        c = chr(ESCAPE_CHARACTERS[escape])
+                    else:
+                        c = escape
+                characters.append(c)
+                i += 1
+            data = "".join(characters).encode("utf-8")
+            if self.data_directive != ".ascii":
+                data += b"\0"
+            for byte in data:
+                self.write_data(byte, 1, string_token)
+
+    def resolve_forward_references(self):
+        for address, length, label in self.forward_references:
+            if label.value in self.symbols:
+                self.data.set(address, self.symbols[label.value], length)
+            else:
+                self.error(label.line, label.column, f"Symbol \"{label.value}\" not found in symbol table.")
+
+    def check_globals(self):
+        for label in self.globals:
+            if label.value not in self.symbols:
+                self.error(label.line, label.column, f"\"{label.value}\" declared global label but not defined.")
+
+    #####################################################################################
+    # Second pass
+    #####################################################################################
+
+    def generate_basic_statements(self, statement):
+        ''' The basic statements (with machine code) of a first pass statement '''
+        if isinstance(statement.instruction, basic_instruction):
+            if self.build_basic_statement(statement):
+                return [statement]
+            return []
+        # Build the operands of the pseudo instruction (label addresses and decimal values)
+        operands = self.build_basic_statement(statement, True)
+        if operands is None:
+            return []
+        source_tokens, _ = self.tokenize_line(operands, statement.line, False)
+        statements = []
+        address = statement.address
+        for template in statement.instruction.templates:
+            line = self.substitute_template(template, source_tokens, statement.address)
+            tokens, _ = self.tokenize_line(line, statement.line, False)
+            instruction = self.best_operand_match(tokens, INSTRUCTIONS[tokens[0].value])
+            source = statement.source if not statements else ""
+            basic_statement = program_statement(source, statement.line, tokens, instruction, address)
+            if not self.build_basic_statement(basic_statement):
+                return statements
+            statements.append(basic_statement)
+            address += 4
+        return statements
+
+    def build_basic_statement(self, statement, pseudo = False):
+        ''' Resolve the operands of a statement. For a basic instruction, the printable
+        basic statement and the machine code are set. For a pseudo instruction, the
+        statement with label addresses and decimal values is returned. '''
+        tokens = statement.tokens
+        basic = [tokens[0].value, " "]
+        operands = []
+        for i, t in enumerate(tokens[1:], 1):
+            if t.type in REGISTER_TYPES:
+                value = REGISTER_NUMBERS[t.value]
+                operands.append(value)
+                basic.append(f"x{value}")
+            elif t.type == IDENTIFIER:
+                if t.value not in self.symbols:
+                    self.error(t.line, t.column, f"Symbol \"{t.value}\" not found in symbol table.")
+                    return None if pseudo else False
+                value = self.symbols[t.value]
+                if pseudo:
+                    basic.append(str(value))
+                else:
+                    value = to_signed(value - statement.address)
+                    if statement.instruction.format == "B" and not -4096 <= value < 4096:
+                        self.error(statement.line, 0, "Branch target word address beyond 12-bit range")
+                        return False
+                    if statement.instruction.format == "J" and not -1048576 <= value < 1048576:
+                        self.error(statement.line, 0, "Jump target word address beyond 20-bit range")
+                        return False
+                    basic.append(f"0x{value & 0xffffffff:08x}")
+                operands.append(value)
+            elif t.type in INTEGER_TYPES:
+                value = string_to_int(t.value)
+                operands.append(value)
+                if pseudo or t.type == INTEGER_5:
+                    basic.append(str(value))
+                else:
+                    basic.append(f"0x{value & 0xffffffff:08x}")
+            else:
+                basic.append(t.value)
+            if i < len(tokens) - 1:
+                separators = (LEFT_PAREN, RIGHT_PAREN)
+                if t.type not in separators and tokens[i + 1].type not in separators:
+                    basic.append(",")
+        if pseudo:
+            return "".join(basic)
+        statement.basic = "".join(basic)
+        statement.code = statement.instruction.encode(operands)
+        return True
+
+    def substitute_template(self, template, tokens, address):
+        ''' Fill in a pseudo instruction template with the operands of the source tokens '''
+        line = template
+        for i in range(len(tokens) - 1, 0, -1):
+            line = line.replace(f"RG{i}", tokens[i].value)
+        for i in range(len(tokens) - 1, 0, -1):
+            if tokens[i].type not in INTEGER_TYPES:
+                continue
+            value = string_to_int(tokens[i].value)
+            relative = to_signed(value - address)
+            line = line.replace(f"PCH{i}", str(high_immediate(relative)))
+            line = line.replace(f"PCL{i}", str(to_signed(relative, 12)))
+            line = line.replace(f"LH{i}", str(high_immediate(value)))
+            line = line.replace(f"LL{i}", str(to_signed(value, 12)))
+            line = line.replace(f"VH{i}", str(high_immediate(value)))
+            line = line.replace(f"VL{i}", str(to_signed(value, 12)))
+        if "LAB" in line:
+            label_address = string_to_int(tokens[-1].value)
+            for name, symbol_address in self.symbols.items():
+                if symbol_address == label_address:
+                    line = line.replace("LAB", name, 1)
+                    break
+        return line
+
+def high_immediate(value):
+    ''' The upper 20 bits of a value (rounded up when the sign extended lower 12 bits are negative) '''
+    return (value >> 12) + ((value >> 11) & 1)
+
+def instruction_tokens(instruction):
+    ''' The tokens of an instruction example (cached on the instruction) '''
+    if instruction.tokens is None:
+        tokens = []
+        for match in re.finditer(r"[^\s,()]+|[()]", instruction.example):
+            value = match.group(0)
+            tokens.append(token(match_token_type(value), value, 0, match.start() + 1))
+        tokens[0].type = OPERATOR
+        instruction.tokens = tokens
+    return instruction.tokens
+
+#########################################################################################
+# Command line
+#########################################################################################
+
+def run_rars_jar(args):
+    ''' Run the RARS jar with the same options. Returns the exit code of the jar (an assembly
+    error always gives a non-zero code) or 1 if the jar cannot be run. '''
+    if shutil.which("java") is None or not RARS_JAR.exists():
+        print(f"Error: the program has to be assembled with RARS (java and {RARS_JAR} are required)")
+        return 1
+    error_exit_codes = [int(arg[2:]) for arg in args if re.fullmatch(r"ae\d+", arg)]
+    error_exit_code = error_exit_codes[-1] if error_exit_codes and error_exit_codes[-1] else 1
+    jar_args = [arg for arg in args if arg != "nc" and not re.fullmatch(r"ae\d+", arg)]
+    jar_cmd = ["java", "-jar", str(RARS_JAR), "nc", f"ae{error_exit_code}"] + jar_args
+    return subprocess.run(jar_cmd, check=False).returncode
+
+def main(args = None):
+    ''' Run the assembler with RARS command line options. Returns the exit code. '''
+    args = sys.argv[1:] if args is None else args
+    memory_configuration = DEFAULT_MEMORY_CONFIGURATION
+    assemble_only = False
+    error_exit_code = 0
+    show_copyright = True
+    dumps = []
+    filenames = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "a":
+            assemble_only = True
+        elif arg == "nc":
+            show_copyright = False
+        elif re.fullmatch(r"ae\d+", arg):
+            error_exit_code = int(arg[2:])
+        elif arg == "mc" and i + 1 < len(args):
+            memory_configuration = args[i + 1]
+            i += 1
+        elif arg == "dump" and i + 3 < len(args):
+            dumps.append(args[i + 1:i + 4])
+            i += 3
+        elif pathlib.Path(arg).exists():
+            filenames.append(arg)
+        else:
+            print(f"Error: \"{arg}\" is not a supported option or an existing file")
+            return 1
+        i += 1
+    if show_copyright:
+        print(COPYRIGHT_MESSAGE)
+        print()
+    if memory_configuration not in MEMORY_CONFIGURATIONS:
+        print(f"Invalid memory configuration: {memory_configuration}")
+        return 1
+    if len(filenames) != 1:
+        print("Error: a single assembly language file is required")
+        return 1
+    if not assemble_only:
+        print("Simulation is not supported by this assembler, running the RARS jar")
+        return run_rars_jar(args)
+    try:
+        program = rars_assembler(memory_configuration).assemble_file(filenames[0])
+    except assembly_error as e:
+        print(e.report())
+        if e.unsupported:
+            print("The program uses features that are not supported by this assembler, running the RARS jar")
+            return run_rars_jar(args)
+        print("Processing terminated due to errors.")
+        return error_exit_code
+    warnings = "".join(message.report() for message in program.messages)
+    if warnings:
+        print(warnings)
+    for segment, dump_format, filename in dumps:
+        message = program.dump(segment, dump_format, filename)
+        if message is not None:
+            print(message)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,668 @@
+#!/usr/bin/python3
+
+'''
+A RV32IM instruction set simulator with the RARS system calls.
+
+The software labs (i.e., lab04) run a program with RARS and check the printed output.
+This simulator runs a program assembled by rars_asm.py in-process: it loads the text
+statements and data segment of the 'assembled_program', executes the RV32I and RV32M
+instructions and implements the RARS console system calls (print, read, sbrk and exit).
+The result of a simulation holds the output of the program, the final register state,
+the memory and the reason the simulation terminated. The number of instructions that
+are executed can be limited like the RARS '<n>' (maximum step) option.
+
+The command line accepts the RARS options for running a program:
+  rars_sim.py [nc] [ae<n>] [se<n>] [mc <config>] [ic] [dec|hex] [<n>] [<register>] ...
+      [dump <segment> <format> <filename>] <file.s>
+A makefile rule that generates the output of a program without the RARS jar:
+  %.out: %.s
+  	python3 ../resources/rars_sim.py nc $< > $@
+'''
+
+import io
+import pathlib
+import re
+import sys
+
+import rars_asm
+
+# Reasons for the end of a simulation (the same as the RARS simulator reasons)
+NORMAL_TERMINATION = "NORMAL_TERMINATION"
+CLIFF_TERMINATION = "CLIFF_TERMINATION"
+MAX_STEPS = "MAX_STEPS"
+BREAKPOINT = "BREAKPOINT"
+EXCEPTION = "EXCEPTION"
+
+MASK = 0xffffffff
+SIGN_BIT = 0x80000000
+# Instruction limit of a simulation without a maximum number of steps
+UNLIMITED = 1 << 62
+# The memory blocks of the data memory are indexed with address >> BLOCK_SHIFT
+BLOCK_SHIFT = rars_asm.MEMORY_BLOCK_BYTES.bit_length() - 1
+BLOCK_OFFSET_MASK = rars_asm.MEMORY_BLOCK_BYTES - 1
+
+# System call numbers (a7) of the RARS system calls that are implemented
+SYSCALL_PRINT_INT = 1
+SYSCALL_PRINT_STRING = 4
+SYSCALL_READ_INT = 5
+SYSCALL_READ_STRING = 8
+SYSCALL_SBRK = 9
+SYSCALL_EXIT = 10
+SYSCALL_PRINT_CHAR = 11
+SYSCALL_READ_CHAR = 12
+SYSCALL_TIME = 30
+SYSCALL_SLEEP = 32
+SYSCALL_PRINT_INT_HEX = 34
+SYSCALL_PRINT_INT_BINARY = 35
+SYSCALL_PRINT_INT_UNSIGNED = 36
+SYSCALL_EXIT2 = 93
+
+def signed(value):
+    ''' The signed value of an unsigned 32-bit register value '''
+    return value - ((value & SIGN_BIT) << 1)
+
+def sign_extend(value, bits):
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+#########################################################################################
+# Exceptions
+#########################################################################################
+
+class simulation_exit(Exception):
+    ''' Raised by the exit system calls '''
+    def __init__(self, exit_code):
+        super().__init__(f"exit {exit_code}")
+        self.exit_code = exit_code
+
+class simulation_breakpoint(Exception):
+    ''' Raised by the 'ebreak' instruction '''
+
+class runtime_error(Exception):
+    ''' A runtime exception of the simulated program (the message is the RARS message) '''
+
+class address_error(runtime_error):
+    ''' A memory access error. Like RARS, the address is appended to the message. '''
+    def __init__(self, message, address):
+        super().__init__(f"{message}0x{address & MASK:08x}")
+        self.address = address
+
+#########################################################################################
+# Simulation result
+#########################################################################################
+
+class simulation_result():
+    ''' The output, registers and memory of a program at the end of a simulation '''
+    def __init__(self, program, reason, output, registers, pc, memory, instruction_count,
+            exit_code = 0, error = None):
+        self.program = program
+        self.reason = reason
+        self.output = output
+        self.registers = registers
+        self.pc = pc
+        self.memory = memory
+        self.instruction_count = instruction_count
+        self.exit_code = exit_code
+        self.error = error
+
+    def register(self, name):
+        ''' The signed value of a register given its name ('a0', 'x10', 'fp' or 'pc') '''
+        if name == "pc":
+            return self.pc
+        return self.registers[rars_asm.REGISTER_NUMBERS[name]]
+
+    def word(self, address):
+        ''' The word at an address of the text or data segment (0 if it was never written) '''
+        word = self.program.word_or_none(address)
+        return 0 if word is None else word
+
+    def termination_message(self):
+        ''' The message that RARS prints at the end of the simulation '''
+        if self.reason == MAX_STEPS:
+            return f"Program terminated when maximum step limit {self.instruction_count} reached."
+        if self.reason == CLIFF_TERMINATION:
+            return "Program terminated by dropping off the bottom."
+        if self.reason == NORMAL_TERMINATION:
+            return "Program terminated by calling exit"
+        if self.reason == EXCEPTION:
+            return "Simulation terminated due to errors."
+        return f"Program stopped at breakpoint 0x{self.pc:08x}"
+
+    def error_report(self):
+        ''' The RARS report of the runtime error ('' if there was no error) '''
+        if self.error is None:
+            return ""
+        statement = self.program.statements.get(self.pc)
+        if statement is None:
+            return f"Error: {self.error}\n"
+        return f"Error in {self.program.filename} line {statement.line}: " + \
+            f"Runtime exception at 0x{(self.pc + 4) & MASK:08x}: {self.error}\n"
+
+#########################################################################################
+# Simulator
+#########################################################################################
+
+class rars_simulator():
+    ''' Simulates an 'assembled_program' like the RARS simulator.
+
+    The instructions of the text segment are decoded once into functions that execute the
+    instruction and return the address of the next instruction. The data segment is a copy
+    of the data memory of the program so a program can be simulated more than once. Input
+    of the read system calls is read from 'input_text' (or the 'input_stream' file) and the
+    printed output is collected (and also written to 'output_stream' if one is given). '''
+
+    def __init__(self, program, input_text = "", input_stream = None, output_stream = None):
+        self.program = program
+        self.configuration = program.configuration
+        self.input_stream = io.StringIO(input_text) if input_stream is None else input_stream
+        self.output_stream = output_stream
+        self.output = []
+        self.memory = rars_asm.data_memory(program.data.base_address)
+        self.memory.blocks = {index : bytearray(block) for index, block in program.data.blocks.items()}
+        self.data_segment = (self.configuration["data_segment_base"], self.configuration["data_segment_limit"])
+        self.mmio_segment = (self.configuration["mmio_base"], self.configuration["kernel_high"])
+        self.registers = [0] * 33   # register 32 is written by instructions with rd of zero
+        self.registers[2] = self.configuration["stack_pointer"]
+        self.registers[3] = self.configuration["global_pointer"]
+        self.pc = self.configuration["text_base"]
+        self.heap_address = self.configuration["heap_base"]
+        self.instruction_count = 0
+        self.exit_code = 0
+        self.code = {address : self.decode(address, statement.code)
+            for address, statement in program.statements.items()}
+
+    def run(self, max_instructions = None):
+        ''' Run the program until it terminates, reaches a breakpoint or executes
+        max_instructions instructions (None for no limit). Returns a 'simulation_result'.
+        After a breakpoint, run can be called again to continue the simulation. '''
+        code = self.code
+        pc = self.pc
+        count = self.instruction_count
+        limit = UNLIMITED if max_instructions is None else count + max_instructions
+        reason = None
+        error = None
+        try:
+            while count < limit:
+                execute = code.get(pc)
+                if execute is None:
+                    break
+                pc = execute()
+                count += 1
+            else:
+                reason = MAX_STEPS
+            if reason is None:
+                if pc & 3:
+                    raise runtime_error("Instruction load alignment error")
+                if not self.in_text_segment(pc):
+                    raise runtime_error("Instruction load access error")
+                reason = CLIFF_TERMINATION
+        except simulation_exit as e:
+            self.exit_code = e.exit_code
+            reason = NORMAL_TERMINATION
+        except simulation_breakpoint:
+            pc = (pc + 4) & MASK
+            count += 1
+            reason = BREAKPOINT
+        except runtime_error as e:
+            error = str(e)
+            reason = EXCEPTION
+        self.pc = pc
+        self.instruction_count = count
+        self.flush_output()
+        return simulation_result(self.dump_program(), reason, "".join(self.output),
+            [signed(value) for value in self.registers[:32]], pc, self.memory,
+            count, self.exit_code, error)
+
+    def simulate(self, max_instructions = None):
+        ''' Run the program to the end (execution continues after breakpoints) '''
+        remaining = max_instructions
+        while True:
+            result = self.run(remaining)
+            if result.reason != BREAKPOINT:
+                return result
+            if max_instructions is not None:
+                remaining = max_instructions - result.instruction_count
+
+    def dump_program(self):
+        ''' An 'assembled_program' with the current data memory (for memory dumps) '''
+        return rars_asm.assembled_program(self.program.filename, self.configuration,
+            self.program.statements.values(), self.memory, self.program.symbols,
+            self.program.messages)
+
+    def in_text_segment(self, address):
+        return self.configuration["text_base"] <= address <= self.configuration["text_limit"]
+
+    #####################################################################################
+    # Memory
+    #####################################################################################
+
+    def check_address(self, address, store):
+        ''' Raise an 'address_error' if the address is not in the data segment or the
+        memory mapped I/O segment '''
+        if self.data_segment[0] <= address <= self.data_segment[1] or \
+                self.mmio_segment[0] <= address <= self.mmio_segment[1]:
+            return
+        if self.in_text_segment(address):
+            raise address_error("Cannot write directly to text segment!" if store else
+                "Cannot read directly from text segment!", address)
+        raise address_error("store address out of range " if store else "address out of range ", address)
+
+    def load(self, address, length):
+        ''' Read an (unsigned) little endian value of length bytes '''
+        if address & (length - 1):
+            raise address_error("Load address not aligned to word boundary " if length == 4 else
+                "Load address not aligned on halfword boundary ", address)
+        self.check_address(address, False)
+        block, offset = self.memory.block(address)
+        if block is None:
+            return 0
+        return int.from_bytes(block[offset:offset + length], "little")
+
+    def store(self, address, value, length):
+        ''' Write the lower length bytes of value (little endian) '''
+        if address & (length - 1):
+            raise address_error("Store address not aligned to word boundary " if length == 4 else
+                "store address not aligned on halfword boundary ", address)
+        self.check_address(address, True)
+        block, offset = self.memory.block(address, True)
+        block[offset:offset + length] = (value & ((1 << (8 * length)) - 1)).to_bytes(length, "little")
+
+    def load_string(self, address):
+        ''' Read a null terminated string '''
+        characters = bytearray()
+        while True:
+            character = self.load(address, 1)
+            if character == 0:
+                return characters.decode("latin-1")
+            characters.append(character)
+            address += 1
+
+    #####################################################################################
+    # Decoder
+    #####################################################################################
+
+    def decode(self, pc, word):
+        ''' Returns a function that executes the instruction at pc and returns the next pc '''
+        regs = self.registers
+        opcode = word & 0x7f
+        rd = (word >> 7) & 0x1f or 32
+        funct3 = (word >> 12) & 0x7
+        rs1 = (word >> 15) & 0x1f
+        rs2 = (word >> 20) & 0x1f
+        funct7 = word >> 25
+        next_pc = (pc + 4) & MASK
+        i_imm = sign_extend(word >> 20, 12)
+
+        def undefined():
+            raise runtime_error(f"undefined instruction (0x{word:08x})")
+
+        if opcode == 0x37:      # lui
+            value = word & 0xfffff000
+            def execute():
+                regs[rd] = value
+                return next_pc
+            return execute
+        if opcode == 0x17:      # auipc
+            value = (pc + (word & 0xfffff000)) & MASK
+            def execute():
+                regs[rd] = value
+                return next_pc
+            return execute
+        if opcode == 0x6f:      # jal
+            offset = sign_extend((((word >> 31) & 1) << 20) | (((word >> 12) & 0xff) << 12) |
+                (((word >> 20) & 1) << 11) | (((word >> 21) & 0x3ff) << 1), 21)
+            target = (pc + offset) & MASK
+            def execute():
+                regs[rd] = next_pc
+                return target
+            return execute
+        if opcode == 0x67 and funct3 == 0:     # jalr
+            def execute():
+                target = (regs[rs1] + i_imm) & 0xfffffffe
+                regs[rd] = next_pc
+                return target
+            return execute
+        if opcode == 0x63:      # branches
+            offset = sign_extend((((word >> 31) & 1) << 12) | (((word >> 7) & 1) << 11) |
+                (((word >> 25) & 0x3f) << 5) | (((word >> 8) & 0xf) << 1), 13)
+            target = (pc + offset) & MASK
+            condition = BRANCH_CONDITIONS.get(funct3)
+            if condition is None:
+                return undefined
+            if funct3 == 0:
+                def execute():
+                    return target if regs[rs1] == regs[rs2] else next_pc
+            elif funct3 == 1:
+                def execute():
+                    return target if regs[rs1] != regs[rs2] else next_pc
+            elif funct3 == 4:
+                def execute():
+                    return target if regs[rs1] ^ SIGN_BIT < regs[rs2] ^ SIGN_BIT else next_pc
+            elif funct3 == 5:
+                def execute():
+                    return target if regs[rs1] ^ SIGN_BIT >= regs[rs2] ^ SIGN_BIT else next_pc
+            else:
+                def execute():
+                    return target if condition(regs[rs1], regs[rs2]) else next_pc
+            return execute
+        if opcode == 0x03:      # loads
+            if funct3 not in LOAD_LENGTHS:
+                return undefined
+            length, signed_load = LOAD_LENGTHS[funct3]
+            load = self.load
+            if length == 4:
+                # Aligned data segment words are read from the memory blocks directly
+                blocks, base, low, high = self.memory.blocks, self.memory.base_address, *self.data_segment
+                def execute():
+                    address = (regs[rs1] + i_imm) & MASK
+                    if address & 3 or not low <= address <= high:
+                        regs[rd] = load(address, 4)
+                        return next_pc
+                    block = blocks.get((address - base) >> BLOCK_SHIFT)
+                    offset = (address - base) & BLOCK_OFFSET_MASK
+                    regs[rd] = int.from_bytes(block[offset:offset + 4], "little") if block else 0
+                    return next_pc
+            elif signed_load:
+                bits = 8 * length
+                def execute():
+                    regs[rd] = sign_extend(load((regs[rs1] + i_imm) & MASK, length), bits) & MASK
+                    return next_pc
+            else:
+                def execute():
+                    regs[rd] = load((regs[rs1] + i_imm) & MASK, length)
+                    return next_pc
+            return execute
+        if opcode == 0x23:      # stores
+            if funct3 > 2:
+                return undefined
+            length = 1 << funct3
+            offset = sign_extend(((word >> 25) << 5) | ((word >> 7) & 0x1f), 12)
+            store = self.store
+            if length == 4:
+                blocks, base, low, high = self.memory.blocks, self.memory.base_address, *self.data_segment
+                def execute():
+                    address = (regs[rs1] + offset) & MASK
+                    block = blocks.get((address - base) >> BLOCK_SHIFT)
+                    if address & 3 or block is None or not low <= address <= high:
+                        store(address, regs[rs2], 4)
+                        return next_pc
+                    index = (address - base) & BLOCK_OFFSET_MASK
+                    block[index:index + 4] = regs[rs2].to_bytes(4, "little")
+                    return next_pc
+                return execute
+            def execute():
+                store((regs[rs1] + offset) & MASK, regs[rs2], length)
+                return next_pc
+            return execute
+        if opcode == 0x13:      # register-immediate operations
+            if funct3 == 0:
+                def execute():
+                    regs[rd] = (regs[rs1] + i_imm) & MASK
+                    return next_pc
+                return execute
+            if funct3 in (1, 5):
+                key = (funct3, funct7)
+                immediate = rs2
+            else:
+                key = (funct3, 0)
+                immediate = i_imm & MASK
+            operation = ALU_OPERATIONS.get(key)
+            if operation is None:
+                return undefined
+            def execute():
+                regs[rd] = operation(regs[rs1], immediate)
+                return next_pc
+            return execute
+        if opcode == 0x33:      # register-register operations
+            if (funct3, funct7) == (0, 0):
+                def execute():
+                    regs[rd] = (regs[rs1] + regs[rs2]) & MASK
+                    return next_pc
+                return execute
+            operation = ALU_OPERATIONS.get((funct3, funct7))
+            if operation is None:
+                return undefined
+            def execute():
+                regs[rd] = operation(regs[rs1], regs[rs2])
+                return next_pc
+            return execute
+        if opcode == 0x0f:      # fence, fence.i
+            return lambda: next_pc
+        if word == 0x00000073:  # ecall
+            syscall = self.syscall
+            def execute():
+                syscall(regs[17])
+                return next_pc
+            return execute
+        if word == 0x00100073:  # ebreak
+            def execute():
+                raise simulation_breakpoint()
+            return execute
+        return undefined
+
+    #####################################################################################
+    # System calls
+    #####################################################################################
+
+    def print_string(self, string):
+        self.output.append(string)
+        if self.output_stream is not None:
+            self.output_stream.write(string)
+
+    def flush_output(self):
+        if self.output_stream is not None:
+            self.output_stream.flush()
+
+    def read_line(self):
+        ''' Read a line of input (without the end of line) '''
+        self.flush_output()
+        return self.input_stream.readline().rstrip("\r\n")
+
+    def syscall(self, number):
+        ''' Perform the system call in a7 (the arguments are in a0 and a1) '''
+        regs = self.registers
+        a0 = regs[10]
+        if number == SYSCALL_PRINT_INT:
+            self.print_string(str(signed(a0)))
+        elif number == SYSCALL_PRINT_STRING:
+            self.print_string(self.load_string(a0))
+        elif number == SYSCALL_READ_INT:
+            line = self.read_line().strip()
+            if not re.fullmatch(r"[+-]?\d+", line) or not -SIGN_BIT <= int(line) < SIGN_BIT:
+                raise runtime_error(f"invalid integer input (syscall {number})")
+            regs[10] = int(line) & MASK
+        elif number == SYSCALL_READ_STRING:
+            max_length = signed(regs[11])
+            characters = self.read_line().encode("latin-1", errors="replace")[:max(max_length - 1, 0)]
+            if len(characters) < max_length - 1:
+                characters += b"\n"
+            for offset, character in enumerate(characters + b"\0" if max_length > 0 else b""):
+                self.store((a0 + offset) & MASK, character, 1)
+        elif number == SYSCALL_SBRK:
+            amount = signed(a0)
+            if amount < 0:
+                raise runtime_error(f"request ({amount}) is negative heap amount (syscall {number})")
+            address = self.heap_address
+            new_address = (address + amount + 3) & ~3
+            if new_address >= self.configuration["data_segment_limit"]:
+                raise runtime_error(f"request ({amount}) exceeds available heap storage (syscall {number})")
+            self.heap_address = new_address
+            regs[10] = address
+        elif number == SYSCALL_EXIT:
+            raise simulation_exit(0)
+        elif number == SYSCALL_PRINT_CHAR:
+            self.print_string(chr(a0 & 0xff))
+        elif number == SYSCALL_READ_CHAR:
+            character = self.input_stream.read(1)
+            if character == "":
+                raise runtime_error(f"invalid char input (syscall {number})")
+            regs[10] = ord(character) & 0xff
+        elif number == SYSCALL_TIME:
+            regs[10] = regs[11] = 0
+        elif number == SYSCALL_SLEEP:
+            pass
+        elif number == SYSCALL_PRINT_INT_HEX:
+            self.print_string(f"0x{a0:08x}")
+        elif number == SYSCALL_PRINT_INT_BINARY:
+            self.print_string(f"{a0:032b}")
+        elif number == SYSCALL_PRINT_INT_UNSIGNED:
+            self.print_string(str(a0))
+        elif number == SYSCALL_EXIT2:
+            raise simulation_exit(signed(a0))
+        else:
+            raise runtime_error(f"invalid or unimplemented syscall service: {number} ")
+
+#########################################################################################
+# Instruction operations (on unsigned 32-bit values)
+#########################################################################################
+
+def divide(a, b):
+    a, b = signed(a), signed(b)
+    if b == 0:
+        return MASK
+    quotient = abs(a) // abs(b)
+    return (-quotient if (a < 0) != (b < 0) else quotient) & MASK
+
+def remainder(a, b):
+    a, b = signed(a), signed(b)
+    if b == 0:
+        return a & MASK
+    value = abs(a) % abs(b)
+    return (-value if a < 0 else value) & MASK
+
+# Operations of the register-register instructions (and register-immediate instructions)
+# indexed by (funct3, funct7)
+ALU_OPERATIONS = {
+    (0, 0x20) : lambda a, b: (a - b) & MASK,                                # sub
+    (1, 0) : lambda a, b: (a << (b & 0x1f)) & MASK,                         # sll
+    (2, 0) : lambda a, b: int(signed(a) < signed(b)),                       # slt
+    (3, 0) : lambda a, b: int(a < b),                                       # sltu
+    (4, 0) : lambda a, b: a ^ b,                                            # xor
+    (5, 0) : lambda a, b: a >> (b & 0x1f),                                  # srl
+    (5, 0x20) : lambda a, b: (signed(a) >> (b & 0x1f)) & MASK,              # sra
+    (6, 0) : lambda a, b: a | b,                                            # or
+    (7, 0) : lambda a, b: a & b,                                            # and
+    (0, 1) : lambda a, b: (a * b) & MASK,                                   # mul
+    (1, 1) : lambda a, b: ((signed(a) * signed(b)) >> 32) & MASK,           # mulh
+    (2, 1) : lambda a, b: ((signed(a) * b) >> 32) & MASK,                   # mulhsu
+    (3, 1) : lambda a, b: (a * b) >> 32,                                    # mulhu
+    (4, 1) : divide,                                                        # div
+    (5, 1) : lambda a, b: a // b if b else MASK,                            # divu
+    (6, 1) : remainder,                                                     # rem
+    (7, 1) : lambda a, b: a % b if b else a,                                # remu
+}
+
+# Conditions of the branch instructions indexed by funct3
+BRANCH_CONDITIONS = {
+    0 : lambda a, b: a == b,                                                # beq
+    1 : lambda a, b: a != b,                                                # bne
+    4 : lambda a, b: (a ^ SIGN_BIT) < (b ^ SIGN_BIT),                       # blt
+    5 : lambda a, b: (a ^ SIGN_BIT) >= (b ^ SIGN_BIT),                      # bge
+    6 : lambda a, b: a < b,                                                 # bltu
+    7 : lambda a, b: a >= b,                                                # bgeu
+}
+
+# Length in bytes and sign extension of the load instructions indexed by funct3
+LOAD_LENGTHS = {0 : (1, True), 1 : (2, True), 2 : (4, False), 4 : (1, False), 5 : (2, False)}
+
+def simulate_file(filename, memory_configuration = rars_asm.DEFAULT_MEMORY_CONFIGURATION,
+        max_instructions = None, input_text = ""):
+    ''' Assemble and simulate a file. Returns a 'simulation_result' (raises an
+    'assembly_error' if the file has assembly errors). '''
+    program = rars_asm.rars_assembler(memory_configuration).assemble_file(filename)
+    return rars_simulator(program, input_text).simulate(max_instructions)
+
+#########################################################################################
+# Command line
+#########################################################################################
+
+def main(args = None):
+    ''' Run a program with RARS command line options. Returns the exit code. '''
+    args = sys.argv[1:] if args is None else args
+    memory_configuration = rars_asm.DEFAULT_MEMORY_CONFIGURATION
+    assembly_error_exit_code = 0
+    simulation_error_exit_code = 0
+    show_copyright = True
+    count_instructions = False
+    hexadecimal = True
+    max_instructions = None
+    display_registers = []
+    dumps = []
+    filenames = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "nc":
+            show_copyright = False
+        elif re.fullmatch(r"ae\d+", arg):
+            assembly_error_exit_code = int(arg[2:])
+        elif re.fullmatch(r"se\d+", arg):
+            simulation_error_exit_code = int(arg[2:])
+        elif arg == "mc" and i + 1 < len(args):
+            memory_configuration = args[i + 1]
+            i += 1
+        elif arg == "dump" and i + 3 < len(args):
+            dumps.append(args[i + 1:i + 4])
+            i += 3
+        elif arg == "ic":
+            count_instructions = True
+        elif arg in ("dec", "hex"):
+            hexadecimal = arg == "hex"
+        elif re.fullmatch(r"\d+|0[xX][0-9a-fA-F]+", arg):
+            max_instructions = int(arg, 0)
+        elif arg in rars_asm.REGISTER_NUMBERS:
+            display_registers.append(arg)
+        elif pathlib.Path(arg).exists():
+            filenames.append(arg)
+        else:
+            print(f"Error: \"{arg}\" is not a supported option or an existing file")
+            return 1
+        i += 1
+    if show_copyright:
+        print(rars_asm.COPYRIGHT_MESSAGE)
+        print()
+    if memory_configuration not in rars_asm.MEMORY_CONFIGURATIONS:
+        print(f"Invalid memory configuration: {memory_configuration}")
+        return 1
+    if len(filenames) != 1:
+        print("Error: a single assembly language file is required")
+        return 1
+    try:
+        program = rars_asm.rars_assembler(memory_configuration).assemble_file(filenames[0])
+    except rars_asm.assembly_error as e:
+        print(e.report())
+        if e.unsupported:
+            print("The program uses features that are not supported by this simulator, running the RARS jar")
+            return rars_asm.run_rars_jar(args)
+        print("Processing terminated due to errors.")
+        return assembly_error_exit_code
+    warnings = "".join(message.report() for message in program.messages)
+    if warnings:
+        print(warnings)
+    simulator = rars_simulator(program, input_stream = sys.stdin, output_stream = sys.stdout)
+    while True:
+        result = simulator.run(None if max_instructions is None else
+            max_instructions - simulator.instruction_count)
+        if result.reason == EXCEPTION:
+            print(result.error_report())
+        if result.reason == MAX_STEPS:
+            print(f"\nProgram terminated when maximum step limit {max_instructions} reached.")
+        elif result.reason != BREAKPOINT:
+            print(("\n" if result.reason != EXCEPTION else "") + result.termination_message())
+        if count_instructions:
+            print(f"\n{result.instruction_count}")
+        for name in display_registers:
+            value = result.register(name)
+            print(f"{name}\t" + (f"0x{value & MASK:08x}" if hexadecimal else str(value)))
+        if result.reason != BREAKPOINT:
+            break
+    for segment, dump_format, filename in dumps:
+        message = result.program.dump(segment, dump_format, filename)
+        if message is not None:
+            print(message)
+    if result.reason == EXCEPTION:
+        return simulation_error_exit_code
+    return result.exit_code & 0xff
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,12 +13,14 @@ import sys
 from enum import Enum
 from git import Repo
 import datetime
-import time
-import threading
-import queue
 import pathlib
 import shutil
-import re
+import build_cache
+import git_reader
+import log_scanner
+import log_store
+import process_runner
+import work_dir
 
 ##########################################################
 # Useful static functions for manipulating and querying git repos
@@ -44,10 +46,13 @@ def fetch_remote(repo, remote_name = None):
     except Exception as e:
         raise Exception(f"Error fetching updates from remote: {e}")
 
-def get_unpushed_commits(repo, remote_name = None, remote_branch_name = None):
-    ''' Get a list of unpushed commits in the local repository. '''
-    # Fetch the remote before doing the compare
-    fetch_remote(repo, remote_name)
+def get_unpushed_commits(repo, remote_name = None, remote_branch_name = None, reader = None, fetcher = None):
+    ''' Get a list of unpushed commits in the local repository.
+    The commits are read with the git_reader.git_object_reader of the repository (a new one
+    if none is given) and are git_reader.commit_info objects. When a fetch_coordinator is
+    given, only the remote branch is fetched (and only if it has not been fetched recently). '''
+    if reader is None:
+        reader = git_reader.git_object_reader(repo.working_tree_dir)
     # Get the remote branch reference
     if remote_name is None:
         remote_name = "origin"
@@ -58,22 +63,19 @@ def get_unpushed_commits(repo, remote_name = None, remote_branch_name = None):
         except TypeError:
             # Detached HEAD state (e.g., on a tag)
             # Check if current commit matches a tag
-            current_commit = repo.head.commit
-            tag_found = False
-            for tag in repo.tags:
-                if tag.commit == current_commit:
-                    remote_branch_name = tag.name
-                    tag_found = True
-                    break
-            if not tag_found:
-                remote_branch_name = "main"
+            current_commit = reader.resolve("HEAD")
+            remote_branch_name = next((tag_name for tag_name, tag_commit in reader.tags().items()
+                                       if tag_commit == current_commit), "main")
+    # Fetch the remote before doing the compare
+    if fetcher is not None:
+        fetcher.fetch_branch(remote_name, remote_branch_name)
+    else:
+        fetch_remote(repo, remote_name)
+    reader.invalidate()
     remote_branch = f"{remote_name}/{remote_branch_name}"  #repo.active_branch.name
     # Commit is used instead of branch name since tags don't have branch names (but they have commits)
-    # local_branch = repo.active_branch.name
-    local_commit = repo.head.commit
     # Check for unpushed local commits
-    # unpushed_commits = list(repo.iter_commits(f"{remote_branch}..{local_branch}"))
-    unpushed_commits = list(repo.iter_commits(f"{remote_branch}..{local_commit}"))
+    unpushed_commits = reader.commits(f"{remote_branch}..HEAD")
     return unpushed_commits
     # if unpushed_commits:
     #     print(f"Local branch '{current_branch}' has unpushed commits:")
@@ -82,22 +84,26 @@ def get_unpushed_commits(repo, remote_name = None, remote_branch_name = None):
     # else:
     #     print(f"No unpushed commits in local branch '{current_branch}'.")
 
-def get_unpulled_commits(repo,  remote_name = None, remote_branch_name = None, date_limit = None):
-    ''' Get a list of unpulled commits in the local repository.  '''
-    # Fetch the remote before doing the compare
-    fetch_remote(repo, remote_name)
+def get_unpulled_commits(repo,  remote_name = None, remote_branch_name = None, date_limit = None, reader = None,
+                         fetcher = None):
+    ''' Get a list of unpulled commits in the local repository (git_reader.commit_info objects).  '''
+    if reader is None:
+        reader = git_reader.git_object_reader(repo.working_tree_dir)
     # Get the remote branch reference
     if remote_name is None:
         remote_name = "origin"
     if remote_branch_name is None:
         remote_branch_name = "main"
+    # Fetch the remote before doing the compare
+    if fetcher is not None:
+        fetcher.fetch_branch(remote_name, remote_branch_name)
+    else:
+        fetch_remote(repo, remote_name)
+    reader.invalidate()
     # Create branch names
     remote_branch = f"{remote_name}/{remote_branch_name}"
     # Commit is used instead of branch name since tags don't have branch names (but they have commits)
-    # local_branch = repo.active_branch.name
-    local_commit = repo.head.commit
-    # unpulled_commits = list(repo.iter_commits(f"{local_branch}..{remote_branch}"))
-    unpulled_commits = list(repo.iter_commits(f"{local_commit}..{remote_branch}"))
+    unpulled_commits = reader.commits(f"HEAD..{remote_branch}")
     # Remove those commits that are after the date limit
     if date_limit is not None:
         unpulled_commits = [commit for commit in unpulled_commits if datetime.datetime.fromtimestamp(commit.committed_date) <= date_limit]
@@ -127,15 +133,21 @@ def get_uncommitted_tracked_files(repo):
         pass
     return modified_files
 
-def get_remote_tags():
-    try:
-        result = subprocess.run(["git fetch --tags --force"], shell=True, capture_output=True, text=True)
-        print(result.stdout)
-    except subprocess.CalledProcessError as e:
-        return False
-    return True
-
-def get_commit_file_contents(commit, file_path):
+def get_remote_tags(repo_path = None):
+    ''' Fetch all of the tags of the remote (the test suite fetches only the tag it needs
+    with its fetch_coordinator) '''
+    result = subprocess.run(["git", "fetch", "--tags", "--force"], cwd=repo_path, capture_output=True, text=True)
+    print(result.stdout)
+    return result.returncode == 0
+
+def get_commit_file_contents(commit, file_path, reader = None):
+    ''' The contents of a file of a commit (None if it does not exist or is empty). The file is
+    read with the git_reader.git_object_reader when one is given. '''
+    if reader is not None:
+        data = reader.read_blob(commit.hexsha, file_path)
+        if data:
+            return data.decode("utf-8")
+        return None
     try:
         file_content = (commit.tree / file_path).data_stream.read().decode("utf-8")
         if len(file_content) > 0:
@@ -163,11 +175,13 @@ class repo_test_result():
     test: the repo_test_unit that was executed
     result: the restult_type
     msg: optional message associated with the result
+    usage: resource usage (process_runner.resource_usage) of the commands run by the test
     """
-    def __init__(self, test, result = result_type.SUCCESS, msg = None):
+    def __init__(self, test, result = result_type.SUCCESS, msg = None, usage = None):
         self.test = test
         self.result = result
         self.msg = msg
+        self.usage = usage
 
     def __str__(self):
         if self.result == result_type.SUCCESS:
@@ -177,9 +191,16 @@ class repo_test_result():
         else:
             return f"Error: {self.test.getName()}"
 
+    def to_dict(self):
+        ''' Returns a dictionary summary of the result (used for saving results to a file) '''
+        result_dict = {"test" : self.test.getName(), "result" : self.result.name, "msg" : self.msg}
+        if self.usage is not None:
+            result_dict["usage"] = self.usage.to_dict()
+        return result_dict
+
     def merged_result(self, other_result):
         if other_result is None:
-            return repo_test_result(self.test, self.result, self.msg)
+            return repo_test_result(self.test, self.result, self.msg, self.usage)
         new_msg = self.msg
         if other_result.msg is not None:
             new_msg += "\n" + other_result.msg if new_msg is not None else other_result.msg
@@ -188,7 +209,8 @@ class repo_test_result():
             new_error = result_type.ERROR
         elif self.result == result_type.WARNING or other_result.result == result_type.WARNING:
             new_error = result_type.WARNING
-        return repo_test_result(self.test, new_error, new_msg)
+        new_usage = other_result.usage if self.usage is None else self.usage.combined(other_result.usage)
+        return repo_test_result(self.test, new_error, new_msg, new_usage)
 
 class repo_test_unit():
     """ Base class for repo tests. """
@@ -234,7 +256,16 @@ class repo_test(repo_test_unit):
         # List of files that should be deleted after the test is done (i.e., log files)
         self.files_to_delete = []
         self.timeout_seconds = timeout_seconds
-        self.execute_lines = []
+        # Output of the commands run by the test (only the last lines are kept in memory)
+        self.execute_output = process_runner.output_capture()
+        # Regular expressions that terminate a command as soon as a line of its output matches
+        self.kill_patterns = None
+        # Reason the last command was terminated (timeout or kill pattern)
+        self.terminated_msg = None
+        # Resource usage of the commands run by the test
+        self.usage = None
+        # Resource limits (process_runner.resource_limits) of the commands run by the test
+        self.limits = None
 
     def module_name(self):
         """ returns a string indicating the name of the module. Used for logging. """
@@ -246,23 +277,15 @@ class repo_test(repo_test_unit):
         return False
     
     def success_result(self, msg=None):
-        return repo_test_result(self, result_type.SUCCESS, msg)
+        return repo_test_result(self, result_type.SUCCESS, msg, self.usage)
 
     def warning_result(self, msg=None):
-        return repo_test_result(self, result_type.WARNING, msg)
+        return repo_test_result(self, result_type.WARNING, msg, self.usage)
 
     def error_result(self, msg=None):
-        return repo_test_result(self, result_type.ERROR, msg)
+        return repo_test_result(self, result_type.ERROR, msg, self.usage)
 
-    def read_stdout_to_queue_thread(proc, output_queue):
-        while True:
-            line = proc.stdout.readline()
-            if line:
-                output_queue.put(line.strip())
-            else:
-                break
-
-    def execute_command(self, repo_test_suite, proc_cmd, process_output_filename = None):
+    def execute_command(self, repo_test_suite, proc_cmd, process_output_filename = None, proc_wd = None):
         """ Completes a sub-process command. and print to a file and stdout.
         Args:
             proc_cmd -- The string command to be executed.
@@ -271,72 +294,76 @@ class repo_test(repo_test_unit):
                 will be used.
             print_to_stdout -- If True, the output of the command will be printed to stdout.
             print_message -- If True, messages will be printed to stdout about the command being executed.
-            process_output_filepath -- The file path to which the output of the command should be written.
-                This can be None if no output file is wanted.
+            process_output_filename -- The name of the log file (in the log directory of the suite) to which
+                the output of the command should be written (default is the process_output_filename of the
+                test). The log is compressed unless the suite uses plain logs (see log_store).
         Returns: the sub-process return code
         """
-        
-        fp = None
-        if repo_test_suite.log_dir is not None and process_output_filename is not None:
-            if not os.path.exists(self.repo_test_suite.log_dir):
-                os.makedirs(self.repo_test_suite.log_dir)
-            process_output_filepath = self.log_dir + '/' + process_output_filename
-            fp = open(process_output_filepath, "w")
-            if not fp:
-                repo_test_suite.print_error("Error opening file for writing:", process_output_filepath)
-                return -1
-            repo_test_suite.print("Writing output to:", process_output_filepath)
-            self.files_to_delete.append(process_output_filepath)
+        if proc_wd is None:
+            proc_wd = repo_test_suite.working_path
         cmd_str = " ".join(proc_cmd)
-        message = "Executing the following command in directory:"+str(repo_test_suite.working_path)+":"+str(cmd_str)
+        message = "Executing the following command in directory:"+str(proc_wd)+":"+str(cmd_str)
         repo_test_suite.print(message)
-        if fp:
-            fp.write(message+"\n")
-        # Execute command
-        start_time = time.time()
-        proc = subprocess.Popen(
-            proc_cmd,
-            cwd=repo_test_suite.working_path,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-        )
-        output_queue = queue.Queue()
-        output_thread = threading.Thread(target=repo_test.read_stdout_to_queue_thread, args=(proc, output_queue))
-        output_thread.start()
-
-        while proc.poll() is None and output_thread.is_alive():
+        if process_output_filename is None:
+            process_output_filename = self.process_output_filename
+        log = None
+        if repo_test_suite.log_dir is not None and process_output_filename is not None:
+            if not os.path.exists(repo_test_suite.log_dir):
+                os.makedirs(repo_test_suite.log_dir)
+            process_output_filepath = pathlib.Path(repo_test_suite.log_dir) / process_output_filename
             try:
-                line = output_queue.get(timeout=1.0)
-                self.execute_lines.append(line)
-                line = line + "\n"
-                if repo_test_suite.print_to_stdout:
-                    sys.stdout.write(line)
-                    sys.stdout.flush()
-                if repo_test_suite.test_log_fp:
-                    repo_test_suite.test_log_fp.write(line)
-                    repo_test_suite.test_log_fp.flush()
-                if fp:
-                    fp.write(line)
-                    fp.flush()
-            except queue.Empty:
-                # If the queue is empty, just move on: we waited for output and will try again
-                pass
-            if self.timeout_seconds > 0:
-                elapsed_time = time.time() - start_time
-                if elapsed_time > self.timeout_seconds:
-                    # Timeout exceeded, terminate the process
-                    repo_test_suite.print_error(f"Process exceeded {self.timeout_seconds} seconds and was terminated.")
-                    proc.terminate()
-                    return 1
-        proc.communicate()
-        return proc.returncode
+                log = log_store.log_sink(process_output_filepath, message + "\n", plain = repo_test_suite.plain_logs)
+            except OSError as e:
+                repo_test_suite.print_error(f"Error opening file for writing: {process_output_filepath} ({e})")
+                return -1
+            repo_test_suite.print(f"Writing output to: {log.filepath}")
+            self.files_to_delete.extend(log_store.log_filepaths(process_output_filepath))
+        # Execute command (the output is copied to stdout, the suite log, the test log and execute_output)
+        sinks = [self.execute_output]
+        status = None
+        if repo_test_suite.status_display is not None:
+            status = repo_test_suite.status_display.start_command(self.name)
+            sinks.append(status)
+        elif repo_test_suite.print_to_stdout:
+            sinks.append(process_runner.stream_sink(sys.stdout, repo_test_suite.print_lock))
+        if repo_test_suite.test_log_fp:
+            sinks.append(process_runner.stream_sink(repo_test_suite.test_log_fp, repo_test_suite.print_lock))
+        if log:
+            sinks.append(log)
+        runner = process_runner.process_runner(proc_cmd, cwd=proc_wd, sinks=sinks, timeout_seconds=self.timeout_seconds,
+                                               kill_patterns=self.kill_patterns, limits=self.limits)
+        self.terminated_msg = None
+        try:
+            return_code = runner.run()
+        finally:
+            if log:
+                log.close()
+            if status:
+                repo_test_suite.status_display.end_command(status)
+        if runner.usage is not None:
+            self.usage = runner.usage.combined(self.usage)
+            repo_test_suite.print(f"Resource usage: {runner.usage}")
+        if runner.orphan_count > 0:
+            repo_test_suite.print(f"Processes left running by the command were stopped: {runner.orphan_count}")
+        if runner.timed_out:
+            self.terminated_msg = f"Process exceeded {self.timeout_seconds} seconds and was terminated."
+        elif runner.limit_msg is not None:
+            self.terminated_msg = f"Process stopped: {runner.limit_msg}"
+        elif runner.kill_line is not None:
+            self.terminated_msg = f"Process terminated on output matching '{runner.kill_pattern}': {runner.kill_line.strip()}"
+        if status and (return_code != 0 or self.terminated_msg is not None):
+            repo_test_suite.print_output_tail(cmd_str, self.execute_output.tail_lines()[-repo_test_suite.tail_lines:])
+        if self.terminated_msg is not None:
+            repo_test_suite.print_error(self.terminated_msg)
+            return 1
+        return return_code
 
     def cleanup(self):
         """ Cleanup any files that were created by the test. """
         for file in self.files_to_delete:
             if os.path.exists(file):
                 os.remove(file) 
+        self.execute_output.discard()
 
 class repo_test_linked_list(repo_test):
     """ 
@@ -377,6 +404,7 @@ class repo_test_follow(repo_test):
 
     def initiate_test(self):
         own_result = self.perform_test()
+        scan_file_regex_checks(self.sub_tests)
         for sub_test in self.sub_tests:
             sub_result = sub_test.perform_test()
             own_result = own_result.merged_result(sub_result)
@@ -467,6 +495,8 @@ class file_regex_check(repo_test):
         self.error_on_match = error_on_match
         self.module_name_str = module_name
         self.error_msg = error_msg
+        # Result of the regex search when the file was scanned with the other checks of the same file
+        self.scanned_match = None
 
     def make_name(filename,regex_str, error_on_match):
         ''' Static method to make a name string '''
@@ -479,14 +509,16 @@ class file_regex_check(repo_test):
  
     def perform_test(self):
         file_path = self.repo_test_suite.working_path / self.filename
-        if not os.path.exists(file_path):
+        if not log_store.log_exists(file_path):
             self.repo_test_suite.print_error(f'File does not exist: {file_path}')
             return self.error_result()
         # Check to see if there is a match
-        regex_match = False
-        with open(file_path, 'r') as file:
-            file_contents = file.read()
-            regex_match = re.search(self.regex_str, file_contents)
+        regex_match = self.scanned_match
+        self.scanned_match = None
+        if regex_match is None:
+            scanner = log_scanner.log_scanner(file_path)
+            scanner.add_pattern(self.regex_str)
+            regex_match = scanner.scan()[self.regex_str]
         if self.error_on_match and regex_match:
             # Error if there is a match
             self.repo_test_suite.print_error(f'Regex \'{self.regex_str}\' matches in file {self.filename}')
@@ -502,6 +534,25 @@ class file_regex_check(repo_test):
         return self.success_result()
 
 
+def scan_file_regex_checks(tests):
+    ''' Scan each file checked by the file_regex_check tests in the list once for all of the
+    regular expressions of the tests (the result is used by the perform_test of each check) '''
+    scanners = {}
+    for test in tests:
+        if not isinstance(test, file_regex_check):
+            continue
+        file_path = test.repo_test_suite.working_path / test.filename
+        if not log_store.log_exists(file_path):
+            continue
+        if file_path not in scanners:
+            scanners[file_path] = (log_scanner.log_scanner(file_path), [])
+        scanners[file_path][0].add_pattern(test.regex_str)
+        scanners[file_path][1].append(test)
+    for scanner, file_tests in scanners.values():
+        matches = scanner.scan()
+        for test in file_tests:
+            test.scanned_match = matches[test.regex_str]
+
 class file_not_tracked_test(repo_test):
     ''' Checks to see if a given file is 'not tracked' in the repository.
     This is usually used to test for files that are created during the
@@ -521,7 +572,7 @@ class file_not_tracked_test(repo_test):
     def perform_test(self):
         return_val = True
         test_dir = self.repo_test_suite.working_path
-        tracked_dir_files = self.repo_test_suite.repo.git.ls_files(test_dir).splitlines()
+        tracked_dir_files = self.repo_test_suite.repo_snapshot().tracked_files(test_dir)
         # Get the filenames from the full path
         tracked_dir_filenames = [pathlib.Path(file).name for file in tracked_dir_files]
         #print(tracked_dir_filenames)
@@ -555,22 +606,15 @@ class files_tracked_test(repo_test):
 
     def perform_test(self):
         return_val = True
-        path_of_test_relative_to_repo = self.repo_test_suite.relative_repo_path
-        # Dictionary of all files tracked in each directory. Key is pathlib.Path object relative to repo root
-        repo_files_dict = {}
+        snapshot = self.repo_test_suite.repo_snapshot()
         for tracked_file in self.files_tracked_list:
             # Convert string of path to pathlib.Path object 
             file_path = self.repo_test_suite.repo.working_tree_dir / self.repo_test_suite.relative_repo_path / tracked_file
             file_path_resolve = file_path.resolve() # resolve to get rid of any ../ or ./ in path
             file_path_relative_to_repo = file_path_resolve.relative_to(self.repo_test_suite.repo.working_tree_dir)
             # print(file_path, file_path_resolve, file_path_relative_to_repo)
-            # Determine the path of this file relative to the repo
-            repo_dir_path = file_path.parent 
-            # If this is the first time seeing this directory, get the list of tracked files in it
-            if repo_dir_path not in repo_files_dict:
-                repo_files_dict[repo_dir_path] = self.repo_test_suite.repo.git.ls_files(repo_dir_path).splitlines()
-            # Is file in the list of tracked files for this directory?
-            if str(file_path_relative_to_repo) not in repo_files_dict[repo_dir_path]:
+            # Is file in the list of tracked files of the repository?
+            if not snapshot.is_tracked(file_path_relative_to_repo):
                 self.repo_test_suite.print_error(f'*** File should be tracked in the repository: {tracked_file}')
                 return_val = False
         if return_val:
@@ -584,7 +628,8 @@ class make_test(repo_test_follow):
     def __init__(self, rts, make_rule, required_input_files = None, required_build_files = None, 
                  generate_output_file = True, make_output_filename=None,
                  abort_on_error=True, timeout_seconds = 60,
-                 copy_build_files_dir = None, copy_prefice_str = None):
+                 copy_build_files_dir = None, copy_prefice_str = None, isolate = False, kill_patterns = None,
+                 limits = None):
         ''' - make_rule: the string makefile rule that is executed. 
             - required_input_files: list of files that should exist before the make rule is executed.
             - required_build_files: list of files that should be created after the make rule is executed.
@@ -593,6 +638,11 @@ class make_test(repo_test_follow):
             - copy_build_files_dir: the directory to copy the build files to after the make rule is executed
               (default is None in which case no files are copied)
             - copy_prefice_str: string to prepend to the copied file name
+            - isolate: if True, the rule is run in its own scratch work directory when tests run
+              at the same time (for simulations whose tool scratch files would collide)
+            - kill_patterns: regular expressions that stop the rule as soon as a line of its output
+              matches (i.e., process_runner.SIMULATION_KILL_PATTERNS)
+            - limits: process_runner.resource_limits for the rule (memory, CPU time, output, ...)
         '''
         if generate_output_file and make_output_filename is None:
             # default makefile output filename
@@ -610,6 +660,13 @@ class make_test(repo_test_follow):
             rts.add_excluded_repo_files(required_build_files)
         self.copy_build_files_dir = copy_build_files_dir
         self.copy_prefice_str = copy_prefice_str
+        # Build manifest of the rule (created when a build cache is used)
+        self.build_manifest = None
+        self.isolate = isolate
+        self.kill_patterns = kill_patterns
+        self.limits = limits
+        # Files copied back from the isolated work directory by the last run
+        self.copied_back_files = []
 
     def module_name(self):
         ''' Generates custom module name string '''
@@ -628,20 +685,146 @@ class make_test(repo_test_follow):
         return name_str
 
     def perform_test(self):
+        try:
+            return self.run_make_rule()
+        finally:
+            # The rule (or a restore from the cache) changes the files of the repository
+            self.repo_test_suite.invalidate_repo_snapshot()
+
+    def run_make_rule(self):
         # Check to see if the required input files exist
         if self.required_input_files is not None and len(self.required_input_files) > 0:
             for file in self.required_input_files:
                 if not os.path.exists(file):
                     self.repo_test_suite.print_error(f" Required file for Makefile rule '{self.make_rule}' does not exist: {file}")
                     return self.error_result()
+        # See if the rule can be skipped because none of its inputs have changed
+        manifest = None
+        cache = self.repo_test_suite.incremental_cache
+        if cache is not None and not self.make_rule.startswith("clean"):
+            manifest = self.get_build_manifest()
+            if manifest is None:
+                self.repo_test_suite.print_verbose(f"Inputs of '{self.make_rule}' cannot be determined: the rule is always run")
+            elif cache.restore(self.repo_test_suite.working_path, manifest):
+                self.repo_test_suite.print(f"Inputs of '{self.make_rule}' unchanged since last successful run: build files restored")
+                return self.check_build_files()
+        # Files in the working directory before the rule is run (for finding the new build files)
+        snapshot = None
+        if manifest is not None and self.repo_test_suite.jobs <= 1:
+            snapshot = build_cache.directory_snapshot(self.repo_test_suite.working_path)
         # Run the rule
         cmd = ["make", self.make_rule]
-        make_return_val = self.execute_command(self.repo_test_suite, cmd)
+        if self.use_isolated_work_dir():
+            make_return_val = self.execute_isolated(cmd)
+        else:
+            make_return_val = self.execute_command(self.repo_test_suite, cmd)
         # Check to see if the make rule was successful
         if make_return_val != 0:
-            return self.error_result()
+            return self.error_result(self.terminated_msg)
+        result = self.check_build_files()
+        if manifest is not None and result.result == result_type.SUCCESS:
+            new_files = self.new_build_files(snapshot)
+            if new_files is None:
+                self.repo_test_suite.print_verbose(f"Files built by '{self.make_rule}' cannot be determined (concurrent rules): the run is not cached")
+            else:
+                cache.store(self.repo_test_suite.working_path, manifest, self.required_build_files, new_files)
+        return result
+
+    def new_build_files(self, snapshot):
+        ''' Returns the files written by the last run of the rule: the changes to the snapshot of
+        the working directory or the files copied back from the isolated work directory (None if
+        they cannot be determined because other rules are run in the working directory at the
+        same time) '''
+        if snapshot is not None:
+            return build_cache.changed_files(self.repo_test_suite.working_path, snapshot)
+        if self.use_isolated_work_dir():
+            return self.copied_back_files
+        return None
+
+    def initiate_test(self):
+        ''' Run the make rule followed by the checks of its output. When a shared result cache
+        is used, the results of an earlier run with identical inputs are reused. '''
+        self.build_manifest = None
+        cache = self.repo_test_suite.shared_cache
+        if cache is None or self.make_rule.startswith("clean") or self.get_build_manifest() is None:
+            return super().initiate_test()
+        check_names = [sub_test.getName() for sub_test in self.sub_tests]
+        key = cache.entry_key(self.build_manifest, self.required_build_files, check_names)
+        entry = cache.restore(key, self.repo_test_suite.working_path)
+        if entry is not None:
+            return self.cached_result(entry)
+        snapshot = None
+        if self.repo_test_suite.jobs <= 1:
+            snapshot = build_cache.directory_snapshot(self.repo_test_suite.working_path)
+        own_result = self.perform_test()
+        scan_file_regex_checks(self.sub_tests)
+        check_results = []
+        merged_result = own_result
+        for sub_test in self.sub_tests:
+            sub_result = sub_test.perform_test()
+            check_results.append((sub_result.result.name, sub_result.msg))
+            merged_result = merged_result.merged_result(sub_result)
+        # Only successful runs are saved (failures may be caused by timeouts or the environment)
+        if own_result.result == result_type.SUCCESS:
+            new_files = self.new_build_files(snapshot)
+            if new_files is None:
+                self.repo_test_suite.print_verbose(f"Files built by '{self.make_rule}' cannot be determined (concurrent rules): the results are not shared")
+            else:
+                cache.store(key, self.repo_test_suite.working_path, self.build_manifest, self.required_build_files,
+                            (own_result.result.name, own_result.msg), check_results,
+                            self.execute_output, new_files)
+        return merged_result
+
+    def use_isolated_work_dir(self):
+        ''' Returns True if the rule should be run in an isolated work directory '''
+        if self.make_rule.startswith("clean"):
+            return False
+        rts = self.repo_test_suite
+        return rts.isolate or (self.isolate and rts.jobs > 1)
+
+    def execute_isolated(self, cmd):
+        ''' Run the command in a scratch copy of the lab directory and copy the build files back '''
+        scratch = work_dir.isolated_work_dir(self.repo_test_suite.repo_root_path, self.repo_test_suite.working_path)
+        self.copied_back_files = []
+        try:
+            scratch_path = scratch.create(prefix=f"{self.make_rule}_")
+            return_val = self.execute_command(self.repo_test_suite, cmd, proc_wd = scratch_path)
+            # The files are copied back even when the rule fails (the logs show what went wrong)
+            self.copied_back_files = scratch.copy_back(self.required_build_files)
+        finally:
+            scratch.remove()
+        return return_val
+
+    def get_build_manifest(self):
+        ''' Returns the build manifest of the rule (created the first time it is needed) '''
+        if self.build_manifest is None:
+            self.build_manifest = build_cache.create_build_manifest(self.repo_test_suite.working_path, self.make_rule,
+                                                                    self.required_input_files, self.required_build_files)
+        return self.build_manifest
+
+    def cached_result(self, entry):
+        ''' Create the test result from a shared result cache entry. The build files have
+        already been restored. '''
+        self.repo_test_suite.invalidate_repo_snapshot()
+        self.repo_test_suite.print(f"Inputs of '{self.make_rule}' match an earlier run: results reused from {entry['log_filepath']}")
+        self.execute_output = process_runner.output_capture()
+        with open(entry["log_filepath"], errors="replace") as fp:
+            for lines in iter(lambda: "".join(fp.readlines(process_runner.READ_CHUNK_BYTES)), ""):
+                self.execute_output.write(lines)
+                if self.repo_test_suite.test_log_fp:
+                    self.repo_test_suite.test_log_fp.write(lines)
+        if self.repo_test_suite.test_log_fp:
+            self.repo_test_suite.test_log_fp.flush()
+        merged_result = self.check_build_files()
+        for sub_test, (result_name, msg) in zip(self.sub_tests, entry["checks"]):
+            sub_result = repo_test_result(sub_test, result_type[result_name], msg)
+            self.repo_test_suite.print(f"{sub_result} (from shared cache)")
+            merged_result = merged_result.merged_result(sub_result)
+        return merged_result
+
+    def check_build_files(self):
+        """ Check to see if the required build files exist and copy them if requested """
         result = self.success_result()
-        # Check to see if the required build files exist.
         missing_build_files = []
         if self.required_build_files is not None and len(self.required_build_files) > 0:
             for file in self.required_build_files:
@@ -735,12 +918,10 @@ class check_for_untracked_files(repo_test):
         return "Check for untracked GIT files"
 
     def perform_test(self):
-        # TODO: look into using repo.untracked_files instead of git command
-        untracked_files = self.repo_test_suite.repo.git.ls_files("--others", "--exclude-standard")
+        untracked_files = self.repo_test_suite.repo_snapshot().untracked_files()
         if untracked_files:
             self.repo_test_suite.print_error('Untracked files found in repository:')
-            files = untracked_files.splitlines()
-            for file in files:
+            for file in untracked_files:
                 self.repo_test_suite.print_error(f'  {file}')
             # return False
             return self.warning_result()
@@ -760,8 +941,8 @@ class check_for_tag(repo_test):
         return f"Check for tag \'{self.tag_name}\'"
 
     def perform_test(self, repo_test_suite):
-        if self.tag_name in repo_test_suite.repo.tags:
-            commit = repo_test_suite.repo.tags[self.tag_name].commit
+        commit = repo_test_suite.git_reader().tag_commit(self.tag_name)
+        if commit is not None:
             commit_date = datetime.datetime.fromtimestamp(commit.committed_date).strftime('%Y-%m-%d %H:%M:%S')
             repo_test_suite.print(f'Tag \'{self.tag_name}\' found in repository (commit date: {commit_date})')
             return self.success_result()
@@ -780,7 +961,7 @@ class check_for_max_repo_files(repo_test):
     #     return "Check for max tracked repo files"
 
     def perform_test(self):
-        tracked_files = self.repo_test_suite.repo.git.ls_files(self.repo_test_suite.relative_repo_path).split('\n')
+        tracked_files = self.repo_test_suite.repo_snapshot().tracked_files(self.repo_test_suite.relative_repo_path)
         n_tracked_files = len(tracked_files)
         self.repo_test_suite.print(f"{n_tracked_files} Tracked git files in {self.repo_test_suite.relative_repo_path}" +
                                    f" (max allowed: {self.max_dir_files})")
@@ -805,13 +986,11 @@ class check_for_ignored_files(repo_test):
     def perform_test(self):
         if self.check_path is None:
             self.check_path = self.repo_test_suite.working_path
-        # TODO: look into using repo.untracked_files instead of git command
         self.repo_test_suite.print(f'Checking for ignored files at {self.check_path}')
-        ignored_files = self.repo_test_suite.repo.git.ls_files(self.check_path, "--others", "--ignored", "--exclude-standard")
+        ignored_files = self.repo_test_suite.repo_snapshot().ignored_files(self.check_path)
         if ignored_files:
             self.repo_test_suite.print_error('Ignored files found in repository (update your \'clean\' rule):')
-            files = ignored_files.splitlines()
-            for file in files:
+            for file in ignored_files:
                 self.repo_test_suite.print_error(f'  {file}')
             # return False
             return self.warning_result()
@@ -832,17 +1011,7 @@ class check_for_uncommitted_files(repo_test):
     
     def find_uncommitted_tracked_files(self, dir=None):
         """Finds uncommitted files in the repo (staged and unstaged)."""
-        # Unstaged changes (working directory vs index)
-        unstaged_changes = self.repo_test_suite.repo.index.diff(None)
-        # Staged changes (HEAD vs index)
-        staged_changes = self.repo_test_suite.repo.head.commit.diff()
-        modified_files = list(
-            set(
-                [item.a_path for item in unstaged_changes]
-                + [item.a_path for item in staged_changes]
-            )
-        )
-        return modified_files
+        return self.repo_test_suite.repo_snapshot().uncommitted_files(dir)
 
     def perform_test(self):
         modified_files = self.find_uncommitted_tracked_files()
@@ -897,7 +1066,7 @@ class list_git_commits(repo_test):
             self.check_path = repo_test_suite.working_path
         relative_path = self.check_path.relative_to(repo_test_suite.repo_root_path)
         repo_test_suite.print(f'Checking for commits at {relative_path}')
-        commits = list(repo_test_suite.repo.iter_commits(paths=relative_path))
+        commits = repo_test_suite.git_reader().commits("HEAD", relative_path)
         for commit in commits:
             commit_hash = commit.hexsha[:7]
             commit_message = commit.message.strip()
@@ -919,14 +1088,16 @@ class check_remote_origin(repo_test):
     def perform_test(self):
         try:
             # 1. Check for unpushed commits
-            unpushed_commits = get_unpushed_commits(self.repo_test_suite.repo)
+            unpushed_commits = get_unpushed_commits(self.repo_test_suite.repo, reader = self.repo_test_suite.git_reader(),
+                                                    fetcher = self.repo_test_suite.fetch_coordinator())
             if unpushed_commits:
                 self.repo_test_suite.print_error('Local branch has unpushed commits:')
                 for commit in unpushed_commits:
                     self.repo_test_suite.print_error(f'  - {commit.hexsha[:7]}: {commit.message.strip()}')
                 return self.warning_result()
             # 2. Check for unpulled commits
-            unpulled_commits = get_unpulled_commits(self.repo_test_suite.repo)
+            unpulled_commits = get_unpulled_commits(self.repo_test_suite.repo, reader = self.repo_test_suite.git_reader(),
+                                                    fetcher = self.repo_test_suite.fetch_coordinator())
             if unpulled_commits:
                 self.repo_test_suite.print_error('Local branch has unpulled commits:')
                 for commit in unpulled_commits:
@@ -966,7 +1137,8 @@ class check_remote_starter(repo_test):
         try:
             # 1. Check for unpulled commits from starter
             unpulled_commits = get_unpulled_commits(self.repo_test_suite.repo, 
-                self.remote_name, self.remote_branch, self.last_date_of_remote_commit)
+                self.remote_name, self.remote_branch, self.last_date_of_remote_commit,
+                reader = self.repo_test_suite.git_reader(), fetcher = self.repo_test_suite.fetch_coordinator())
             if unpulled_commits:
                 self.repo_test_suite.print_error('Remote Branch has unpulled commits:')
                 for commit in unpulled_commits:
@@ -11,6 +11,17 @@ import sys
 import repo_test
 from repo_test import repo_test_result, result_type
 import time
+import threading
+import concurrent.futures
+import make_database
+import build_cache
+import fetch_coordinator
+import git_reader
+import git_snapshot
+import process_runner
+import status_display
+import json
+import hashlib
 
 class TermColor:
     """ Terminal codes for printing in color """
@@ -77,16 +88,41 @@ class repo_test_suite():
         self.relative_repo_path = self.working_path.relative_to(self.repo_root_path)        
         # Directory where logs are placed
         self.log_dir = None 
+        # Write the logs of the commands as plain text rather than compressed (see log_store)
+        self.plain_logs = False
         # This contains the list of makefile tests specified by the lab
         self.makefile_tests = repo_test_group(self, "Build Steps")
         # This is contains the list of tests that will be run by the script. Its contents are generated at runtime
         self.repo_tests = repo_test_group(self, "Repository Tests")
         self.print_to_stdout = True
+        # Output of the commands on stdout: 'full' (all of the output) or 'tail' (a status line for
+        # each running command and the last tail_lines lines of the output of a failed command)
+        self.output_mode = "full"
+        self.tail_lines = 20
+        self.status_display = None
         self.verbose = False
         self.test_log_fp = None
+        # Lock for keeping messages from concurrently running tests intact
+        self.print_lock = threading.Lock()
+        # Maximum number of makefile tests that can be run at the same time
+        self.jobs = 1
+        # Run every makefile rule in its own isolated work directory
+        self.isolate = False
+        # Cache of make rule results for skipping rules whose inputs have not changed
+        self.incremental_cache = None
+        self.shared_cache = None
         # Members for repo tests
         self.required_repo_files = set() # Files that must be present in the repo (only one instance of each)
         self.excluded_repo_file = set()  # Files that must not be present in the repo (only one instance of each)
+        # Status of the files of the repository shared by the repo tests (taken when first needed
+        # and invalidated when a makefile rule is run)
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+        # Persistent reader of the git objects of the repository (see git_reader)
+        self.reader = None
+        # Fetches of the remotes made by the repo tests (see fetch_coordinator)
+        self.fetcher = None
+        self.fetch_ttl_seconds = fetch_coordinator.DEFAULT_FETCH_TTL_SECONDS
         self.max_repo_files = max_repo_files
         self.starter_remote_name = starter_remote_name
         self.copy_build_files_dir = copy_build_files_dir
@@ -109,15 +145,46 @@ class repo_test_suite():
         for file in list_of_files:
             self.excluded_repo_file.add(file)
 
+    def repo_snapshot(self):
+        ''' Returns the git_snapshot.repo_snapshot of the repository (taken if there is none) '''
+        with self.snapshot_lock:
+            if self.snapshot is None:
+                self.snapshot = git_snapshot.repo_snapshot(self.repo_root_path)
+            return self.snapshot
+
+    def git_reader(self):
+        ''' Returns the git_reader.git_object_reader of the repository (created if there is none) '''
+        with self.snapshot_lock:
+            if self.reader is None:
+                self.reader = git_reader.git_object_reader(self.repo_root_path)
+            return self.reader
+
+    def fetch_coordinator(self):
+        ''' Returns the fetch_coordinator.fetch_coordinator of the repository (created if there is none) '''
+        with self.snapshot_lock:
+            if self.fetcher is None:
+                self.fetcher = fetch_coordinator.fetch_coordinator(self.repo_root_path, self.fetch_ttl_seconds,
+                                                                   self.repo.git_dir)
+            return self.fetcher
+
+    def invalidate_repo_snapshot(self):
+        ''' The files of the repository may have changed (i.e., a makefile rule was run) '''
+        with self.snapshot_lock:
+            self.snapshot = None
+
     def print_color(self, color, *msg):
         """ Print a message in color """
         msg_str = " ".join(str(item) for item in msg)
         if self.test_log_fp is not None:
             # Don't print color codes to the log file, just plain message
-            self.test_log_fp.write(msg_str + "\n")
+            with self.print_lock:
+                self.test_log_fp.write(msg_str + "\n")
         if color is not None:
             msg_str = color + msg_str + TermColor.END
-        print(msg_str)
+        with self.print_lock:
+            if self.status_display is not None:
+                self.status_display.clear()
+            print(msg_str)
 
     def print_verbose(self, message):
         self.print(message, verbose_message = True)
@@ -126,10 +193,23 @@ class repo_test_suite():
         """ Prints a string to the appropriate locations. """
         # Print to std_out?
         if not verbose_message or self.verbose:
-            if self.print_to_stdout:
-                print(message)
-            if self.test_log_fp is not None:
-                self.test_log_fp.write(message + '\n')
+            with self.print_lock:
+                if self.print_to_stdout:
+                    if self.status_display is not None:
+                        self.status_display.clear()
+                    print(message)
+                if self.test_log_fp is not None:
+                    self.test_log_fp.write(message + '\n')
+
+    def print_output_tail(self, name, lines):
+        """ Prints the last lines of the output of a command to stdout (the complete output is
+        already in the logs) """
+        with self.print_lock:
+            if self.status_display is not None:
+                self.status_display.clear()
+            print(f"Last {len(lines)} lines of the output of '{name}':")
+            for line in lines:
+                print(f"  {line}")
 
     def print_error(self, message):
         """ Prints a message using the 'error_color' """
@@ -147,8 +227,28 @@ class repo_test_suite():
         # self.top_test_set.cleanup()
         # for test in self.tests_to_perform:
         #     test.cleanup()
+        if self.run_time_args.result_file:
+            self.write_result_file(self.run_time_args.result_file)
         if self.test_log_fp:
             self.test_log_fp.close()
+        if self.reader is not None:
+            self.reader.close()
+        if self.fetcher is not None and self.fetcher.fetch_count > 0:
+            self.print_verbose(f"Remote fetches: {self.fetcher.fetch_count} ({self.fetcher.summary()})")
+
+    def write_result_file(self, result_filename):
+        ''' Write the results of all executed tests to a JSON file. This file is used by
+        tools (like the batch grader) that collect the results of many test suites. '''
+        results = [result.to_dict() for result in self.repo_tests.result_dict.values()]
+        summary = self.repo_tests.getResult()
+        result_data = {
+            "test_name" : self.test_name,
+            "repo" : str(self.repo_root_path),
+            "result" : summary.result.name,
+            "tests" : results,
+        }
+        with open(result_filename, "w") as fp:
+            json.dump(result_data, fp, indent=2)
 
     def create_test_logfile(self, log_filename):
         if self.log_dir is None:
@@ -160,6 +260,24 @@ class repo_test_suite():
         if not self.test_log_fp:
             self.print_error("Error opening file for writing:", summary_log_filepath)
 
+    def cache_root_path(self):
+        ''' The directory for caches that are kept between test runs '''
+        if self.run_time_args.cache_dir:
+            return pathlib.Path(self.run_time_args.cache_dir)
+        return pathlib.Path.home() / ".cache" / "ecen423"
+
+    def create_incremental_cache(self):
+        ''' Create the cache used for skipping make rules whose inputs have not changed.
+        Each working directory has its own cache directory. '''
+        working_path_hash = hashlib.sha256(str(self.working_path.resolve()).encode()).hexdigest()[:16]
+        cache_path = self.cache_root_path() / "incremental" / working_path_hash
+        self.incremental_cache = build_cache.incremental_build_cache(cache_path)
+
+    def create_shared_cache(self):
+        ''' Create the result cache that is shared by all repositories using the same cache directory '''
+        max_size_bytes = int(self.run_time_args.shared_cache_size * 1024 ** 3)
+        self.shared_cache = build_cache.shared_result_cache(self.run_time_args.shared_cache, max_size_bytes)
+
     def add_clean_test(self):
         self.repo_tests.add_test(repo_test.make_test(self, "clean"))
 
@@ -224,14 +342,29 @@ class repo_test_suite():
     #     self.add_test(self.create_repo_tests(check_start_code, tag_str))
 
     def add_makefile_test(self, make_rule, required_input_files = [], required_build_files = [],
-                          timeout_seconds = 10 * 60,):
-        ''' Add a makefile rule test '''
+                          timeout_seconds = 10 * 60, isolate = None, kill_patterns = None, limits = None):
+        ''' Add a makefile rule test.
+        isolate: run the rule in its own work directory when tests run at the same time
+          (default is True for simulation rules, i.e., rules starting with 'sim_')
+        kill_patterns: regular expressions that stop the rule as soon as its output shows a failure
+          (default is the testbench error messages for simulation rules and the synthesis errors
+          for the other rules, [] for none)
+        limits: process_runner.resource_limits for the rule (i.e., resource_limits(memory_bytes = 4 << 30,
+          output_bytes = 100 << 20)) '''
+        if isolate is None:
+            isolate = make_rule.startswith("sim_")
+        if kill_patterns is None:
+            if make_rule.startswith("sim_"):
+                kill_patterns = process_runner.SIMULATION_KILL_PATTERNS
+            else:
+                kill_patterns = process_runner.BUILD_KILL_PATTERNS
         # Create the makefile test and add it to the test set
         makefile_test = repo_test.make_test(self, make_rule, required_input_files = required_input_files, 
                                         required_build_files = required_build_files,
                                         timeout_seconds=timeout_seconds,
                                         copy_build_files_dir=self.copy_build_files_dir,
-                                        copy_prefice_str=self.copy_prefix_str)
+                                        copy_prefice_str=self.copy_prefix_str,
+                                        isolate=isolate, kill_patterns=kill_patterns, limits=limits)
         self.makefile_tests.add_test(makefile_test)
         return makefile_test
 
@@ -262,22 +395,23 @@ class repo_test_suite():
             print(test.rule_summary())
 
     def get_lab_tag_commit(self, lab_name, fetch_remote_tags = True):
-        ''' Get the tag associated with a lab assignment. If the tag doesn't exist, return None. '''
+        ''' Get the commit (git_reader.commit_info) of the tag associated with a lab assignment.
+        If the tag doesn't exist, return None. '''
         if fetch_remote_tags:
-            result = repo_test.get_remote_tags()
-        if not result:
-            return False
-        tag = next((tag for tag in self.repo.tags if tag.name == lab_name), None)
-        if tag is None:
-            return None
-        return tag.commit
+            try:
+                self.fetch_coordinator().fetch_tag("origin", lab_name)
+            except Exception as e:
+                self.print_error(str(e))
+                return False
+            self.git_reader().invalidate()
+        return self.git_reader().tag_commit(lab_name)
         # % git push --delete origin lab01
         # % git tag --delete lab01
 
     def get_commit_file_contents(self, tag_commit):
         if tag_commit is None:
             return None
-        return repo_test.get_commit_file_contents(tag_commit, ".commitdate")
+        return repo_test.get_commit_file_contents(tag_commit, ".commitdate", self.git_reader())
 
     def check_submission(self):
         self.print_test_status(f"\nSubmission status for '{self.test_name}'")
@@ -347,23 +481,23 @@ class repo_test_suite():
                 time.sleep(check_sleep_time)
                 first_time = False
 
-            # Fetch the remote tags
-            result = repo_test.get_remote_tags()
-            if not result:
+            # Fetch the tag (every time: it is updated by the remote). The commit of the tag
+            # and its files are fetched with it.
+            try:
+                self.fetch_coordinator().fetch_tag("origin", lab_name, force = True)
+            except Exception as e:
+                self.print_error(str(e))
                 return False
+            self.git_reader().invalidate()
             # See if the tag exists
-            tag = next((tag for tag in self.repo.tags if tag.name == lab_name), None)
-            if tag is None:
+            tag_commit = self.git_reader().tag_commit(lab_name)
+            if tag_commit is None:
                 time.sleep(check_sleep_time)
                 continue
-            # Tag exists, fetch the remote to get all the files
-            repo_test.fetch_remote(self.repo)
-            # Get the commit associated with the tag
-            tag_commit = tag.commit
             # See if the .commitdate file exists in root of repository
             # Access the file from the commit
             file_path = ".commitdate"
-            file_content = repo_test.get_commit_file_contents(tag_commit, file_path)
+            file_content = repo_test.get_commit_file_contents(tag_commit, file_path, self.git_reader())
             if file_content is not None:
                 self.print(f"Commit file created - submission complete")
                 self.print(file_content)
@@ -403,8 +537,21 @@ class repo_test_suite():
             self.error_color = None
         if self.run_time_args.log_dir:
             self.log_dir = pathlib.Path(self.run_time_args.log_dir)
+        self.plain_logs = self.run_time_args.plain_logs
+        self.fetch_ttl_seconds = self.run_time_args.fetch_ttl
+        self.output_mode = self.run_time_args.output
+        self.tail_lines = self.run_time_args.tail_lines
+        if self.output_mode == "tail":
+            self.status_display = status_display.status_display(self.print_lock)
         if self.run_time_args.log:
             self.create_test_logfile(self.run_time_args.log)
+        if self.run_time_args.jobs is not None:
+            self.jobs = max(1, self.run_time_args.jobs)
+        self.isolate = self.run_time_args.isolate
+        if self.run_time_args.incremental:
+            self.create_incremental_cache()
+        if self.run_time_args.shared_cache:
+            self.create_shared_cache()
         # Information based arguments
         if self.run_time_args.required_files:
             self.summarize_repo_files()
@@ -490,13 +637,43 @@ class repo_test_group():
     def initiate_test(self):
         """ Perform all of the tests in the test set"""
         self.repo_test_suite.print_test_status(f"Executing Test Set: {self.getName()}")
+        if self.repo_test_suite.jobs <= 1:
+            for test in self.sub_tests:
+                self.initiate_sub_test(test)
+            return self.getResult()
+        # Run consecutive makefile tests with the scheduler. The 'clean' rule and any
+        # other kind of test act as barriers and are run by themselves.
+        batch = []
         for test in self.sub_tests:
-            self.repo_test_suite.print_test_status(f' Executing Test: {test.getName()}')
-            result = test.initiate_test()
-            self.result_dict[test] = result
-            self.repo_test_suite.print_test_status(result)
+            if isinstance(test, repo_test.make_test) and test.make_rule != "clean":
+                batch.append(test)
+                continue
+            self.run_make_test_batch(batch)
+            batch = []
+            self.initiate_sub_test(test)
+        self.run_make_test_batch(batch)
         return self.getResult()
 
+    def initiate_sub_test(self, test):
+        """ Perform a single test of the set and record its result """
+        self.repo_test_suite.print_test_status(f' Executing Test: {test.getName()}')
+        result = test.initiate_test()
+        self.result_dict[test] = result
+        self.repo_test_suite.print_test_status(result)
+
+    def run_make_test_batch(self, tests):
+        """ Run a list of makefile tests concurrently. The results are added to the
+        result dictionary in the order the tests were added to the group. """
+        if len(tests) == 0:
+            return
+        if len(tests) == 1:
+            self.initiate_sub_test(tests[0])
+            return
+        scheduler = make_test_scheduler(self.repo_test_suite, tests)
+        results = scheduler.run(self.repo_test_suite.jobs)
+        for test in tests:
+            self.result_dict[test] = results[test]
+
     def cleanup(self):
         """ Cleanup any files that were created by the test. """
         for test in self.sub_tests:
@@ -531,6 +708,88 @@ class repo_test_group():
                     if error.msg is not None:
                         self.repo_test_suite.print_error(f"   {error.msg}")
 
+class make_test_scheduler():
+    """
+    Runs a set of makefile tests concurrently. A dependency graph is built from the
+    files declared by each test (required_input_files / required_build_files) and from
+    the make rule database ('make -pn'). Two tests are related if one builds something
+    the other needs, if they declare the same build file, or if they share an
+    intermediate make target (two 'make' processes building the same file at the same
+    time would corrupt it). Shared intermediate targets are allowed between tests that
+    run in isolated work directories (each builds its own copy). Related tests run in
+    the order they were added; unrelated tests run at the same time up to the worker limit.
+    """
+    def __init__(self, rts, tests):
+        self.repo_test_suite = rts
+        self.tests = tests
+        # For each test, the set of earlier tests that must complete before it starts
+        self.waits_for = {}
+        self.build_graph()
+
+    def build_graph(self):
+        """ Determine the tests that each test must wait for """
+        database = make_database.read_make_database(self.repo_test_suite.working_path,
+                                                    [test.make_rule for test in self.tests])
+        closures = {}
+        for test in self.tests:
+            if database is None or test.make_rule not in database:
+                # Unknown dependencies: the test is related to every other test
+                closures[test] = None
+            else:
+                closures[test] = database.prerequisite_closure(test.make_rule)
+        for j, test in enumerate(self.tests):
+            self.waits_for[test] = set()
+            for earlier_test in self.tests[:j]:
+                if self.related(database, closures, earlier_test, test):
+                    self.waits_for[test].add(earlier_test)
+
+    def related(self, database, closures, test_a, test_b):
+        """ Returns True if the two tests cannot run at the same time """
+        closure_a = closures[test_a]
+        closure_b = closures[test_b]
+        if closure_a is None or closure_b is None:
+            return True
+        outputs_a = set(test_a.required_build_files or []) | {test_a.make_rule}
+        outputs_b = set(test_b.required_build_files or []) | {test_b.make_rule}
+        inputs_a = set(test_a.required_input_files or []) | closure_a
+        inputs_b = set(test_b.required_input_files or []) | closure_b
+        if outputs_a & inputs_b or outputs_b & inputs_a or outputs_a & outputs_b:
+            return True
+        if test_a.use_isolated_work_dir() and test_b.use_isolated_work_dir():
+            return False
+        # Shared intermediate targets would be built by both make processes
+        shared_targets = database.buildable_targets(closure_a & closure_b)
+        return len(shared_targets) > 0
+
+    def run(self, jobs):
+        """ Run all of the tests with at most 'jobs' tests running at the same time.
+        Returns a dictionary of results keyed by test. """
+        results = {}
+        running = {}
+        remaining = list(self.tests)
+        rts = self.repo_test_suite
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            while remaining or running:
+                # Start every test whose dependencies have completed
+                for test in list(remaining):
+                    if len(running) >= jobs:
+                        break
+                    if all(dep in results for dep in self.waits_for[test]):
+                        remaining.remove(test)
+                        rts.print_test_status(f' Executing Test: {test.getName()}')
+                        running[executor.submit(test.initiate_test)] = test
+                done, _ = concurrent.futures.wait(running.keys(),
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    test = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = repo_test_result(test, result_type.ERROR, f"Exception: {e}")
+                    results[test] = result
+                    rts.print_test_status(result)
+        return results
+
 def create_arg_parser(description):
 
     parser = argparse.ArgumentParser(description=description)
@@ -543,18 +802,31 @@ def create_arg_parser(description):
     build_group.add_argument("--make_rule", type=str, help="Run a single makefile rule")
     build_group.add_argument("--build", action="store_true", help="Run all build rules")
     parser.add_argument("--noclean", action="store_true", help="Do not run 'make clean' before building")
+    build_group.add_argument("--incremental", action="store_true", help="Skip makefile rules whose inputs have not changed since their last successful run")
+    build_group.add_argument("--jobs", type=int, help="Maximum number of independent makefile rules to run at the same time (default 1)")
+    build_group.add_argument("--isolate", action="store_true", help="Run each makefile rule in its own scratch work directory")
     # Repo arguments
     repo_group = parser.add_argument_group('Repo Options')
     repo_group.add_argument("--check_repo", action="store_true", help="Check the repository state")
+    repo_group.add_argument("--fetch_ttl", type=float, default=fetch_coordinator.DEFAULT_FETCH_TTL_SECONDS,
+        help=f"Do not fetch remote references fetched less than this many seconds ago (default {fetch_coordinator.DEFAULT_FETCH_TTL_SECONDS})")
     # Test environment arguments
     env_group = parser.add_argument_group('Test Environment Options')
     env_group.add_argument("--nocolor", action="store_true", help="Remove color tags from output")
     env_group.add_argument("--log", type=str, help="Save output to a log file (relative file path)")
     env_group.add_argument("--log_dir", type=str, help="Target location for logs")
+    env_group.add_argument("--output", choices=["full", "tail"], default="full",
+                           help="Output of the commands: 'full' prints all of the output, 'tail' prints a status line for each running command and the last lines of the output of failed commands (the logs have the full output)")
+    env_group.add_argument("--tail_lines", type=int, default=20, help="Number of output lines printed for a failed command with '--output tail'")
+    env_group.add_argument("--plain_logs", action="store_true", help="Write the command logs as plain text (default is compressed '.gz' logs)")
     env_group.add_argument("--starterbranch", type=str, default = "main", help="Branch for starter code to check")
     env_group.add_argument("--copy", type=str, help="Copy generated files to a directory")
     env_group.add_argument("--copy_file_str", type=str, help="Customized the copy file by prepending filenames with given string")
     env_group.add_argument("--repo", help="Path to the local repository to test (default is current directory)")
+    env_group.add_argument("--result_file", type=str, help="Save the test results to a JSON file")
+    env_group.add_argument("--cache_dir", type=str, help="Directory for build caches (default is ~/.cache/ecen423)")
+    env_group.add_argument("--shared_cache", type=str, help="Directory of a result cache shared between repositories (reuse the results of makefile rules with identical inputs)")
+    env_group.add_argument("--shared_cache_size", type=float, default=20, help="Size budget of the shared result cache in GB (default 20)")
     # Submission options
     submission_group = parser.add_argument_group('Submission Options')
     submission_group.add_argument("--full_check",  action="store_true", help="Performs full check but does not run the submit")
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+'''
+Compact status of the commands that are running (for the 'tail' output mode of the test suite).
+
+Rather than copying all of the output of the tools to the terminal, each running
+command is shown with a single status line (elapsed time, number of lines of output
+and the last line). On a terminal the status lines are redrawn in place below the
+messages of the test suite every STATUS_TTY_INTERVAL_SECONDS. When the output is not a
+terminal (i.e., a CI log or a batch grading log), the status lines are printed every
+STATUS_LOG_INTERVAL_SECONDS instead.
+
+The messages of the suite are printed while holding the print lock of the suite;
+the status lines are erased (clear) before a message is printed and are drawn again
+at the next refresh.
+'''
+
+import shutil
+import sys
+import threading
+import time
+
+STATUS_TTY_INTERVAL_SECONDS = 1
+STATUS_LOG_INTERVAL_SECONDS = 60
+
+class command_status():
+    ''' The status of a running command. This is a process_runner sink that only keeps the
+    number of lines and the last line of the output. '''
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.monotonic()
+        self.line_count = 0
+        self.last_line = ""
+
+    def write(self, text):
+        self.line_count += text.count("\n")
+        last_line = text.rstrip("\n").rsplit("\n", 1)[-1].strip()
+        if last_line:
+            self.last_line = last_line
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def status_line(self, width):
+        line = f" [{time.monotonic() - self.start_time:6.0f}s {self.line_count:8} lines] {self.name}: {self.last_line}"
+        return line[:width - 1]
+
+class status_display():
+    ''' Shows a status line for each running command.
+    print_lock: the lock held while printing to the stream
+    stream: the output stream (default is stdout) '''
+    def __init__(self, print_lock, stream = None):
+        self.print_lock = print_lock
+        self.stream = sys.stdout if stream is None else stream
+        self.is_tty = self.stream.isatty()
+        self.interval = STATUS_TTY_INTERVAL_SECONDS if self.is_tty else STATUS_LOG_INTERVAL_SECONDS
+        self.commands = []
+        # Number of status lines on the terminal (erased before other output is printed)
+        self.lines_shown = 0
+        self.thread = None
+        self.wakeup = threading.Event()
+
+    def start_command(self, name):
+        ''' Returns the status (a sink for the output) of a command that is started '''
+        status = command_status(name)
+        with self.print_lock:
+            self.commands.append(status)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.refresh_loop, daemon=True)
+                self.thread.start()
+        return status
+
+    def end_command(self, status):
+        with self.print_lock:
+            self.commands.remove(status)
+            self.clear()
+            if not self.commands:
+                self.wakeup.set()
+
+    def clear(self):
+        ''' Erase the status lines from the terminal (called with the print lock held) '''
+        if self.lines_shown > 0:
+            self.stream.write("\033[1A\033[2K" * self.lines_shown + "\r")
+            self.stream.flush()
+            self.lines_shown = 0
+
+    def draw(self):
+        ''' Print the status lines (called with the print lock held) '''
+        width = shutil.get_terminal_size().columns if self.is_tty else 200
+        self.clear()
+        lines = [status.status_line(width) for status in self.commands]
+        if lines:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        if self.is_tty:
+            self.lines_shown = len(lines)
+
+    def refresh_loop(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            with self.print_lock:
+                self.wakeup.clear()
+                if not self.commands:
+                    self.thread = None
+                    return
+                self.draw()
@@ -26,9 +26,33 @@ import shutil
 import subprocess
 # For os.remove
 import os
+# For locking and hashing the precompiled simulation libraries
+import fcntl
+import hashlib
 
 import lab_passoff
 from lab_passoff import TermColor
+import log_store
+import process_runner
+import rars_asm
+import rars_sim
+import vivado_server
+
+# Directory of the precompiled xsim libraries (the same directory is used by the iosystem makefile rules)
+XSIM_LIB_CACHE_PATH = pathlib.Path(os.environ.get("XSIM_LIB_CACHE", pathlib.Path.home() / ".cache" / "ecen423" / "xsim"))
+
+def precompiled_library_path(library_name, hdl_filename_list):
+    ''' Returns the directory of a precompiled xsim library. The directory name includes a hash
+    of the library sources and of the xvlog executable so that a new library is used when
+    either one changes (this is the same hash computed in iosystem.mk). '''
+    sha = hashlib.sha1()
+    for filename in hdl_filename_list:
+        with open(filename, "rb") as fp:
+            sha.update(fp.read())
+    xvlog_path = shutil.which("xvlog")
+    if xvlog_path is not None:
+        sha.update((os.path.realpath(xvlog_path) + "\n").encode())
+    return XSIM_LIB_CACHE_PATH / f"{library_name}_{sha.hexdigest()[:16]}"
 
 class tester_module():
     """ Super class for all test modules """
@@ -49,14 +73,24 @@ class simulation_module(tester_module):
     TODO: Add support for analyzing VHDL and verilog
     '''
 
-    def __init__(self, sim_top_module_name, hdl_sim_keylist, include_dirs=[], generics=[], vhdl_files=[], use_glbl=False ):
-        ''' Initialize the top module name and the keylist for simulation HDL files '''
+    def __init__(self, sim_top_module_name, hdl_sim_keylist, include_dirs=[], generics=[], vhdl_files=[], use_glbl=False,
+                 library_keylist=[], library_name="sim_lib", kill_patterns=None):
+        ''' Initialize the top module name and the keylist for simulation HDL files.
+        library_keylist: keys of HDL files that do not change between submissions (i.e., the iosystem
+          files and packages). These are analyzed once into a shared precompiled library.
+        kill_patterns: regular expressions that stop the simulation as soon as a line of its output
+          matches (i.e., process_runner.SIMULATION_KILL_PATTERNS) '''
         self.sim_top_module = sim_top_module_name
         self.hdl_sim_keylist = hdl_sim_keylist
         self.include_dirs = include_dirs
         self.generics = generics
         self.vhdl_files = vhdl_files
         self.use_glbl = use_glbl
+        self.library_keylist = library_keylist
+        self.library_name = library_name
+        self.kill_patterns = kill_patterns
+        # xvlog/xelab options for referencing the precompiled library
+        self.library_opts = []
 
     def analyze_hdl_files(self, lab_test, hdl_filename_list, log_basename, analyze_cmd,consider_include=True):
         ''' Perform HDL analysis on a set of files. This is a generic function and should
@@ -85,20 +119,46 @@ class simulation_module(tester_module):
 
         #print(analyze_cmd)
         #print(lab_test.execution_path)
-        return_code = lab_test.subprocess_file_print(self.analyze_log_filepath, analyze_cmd, lab_test.execution_path )
-        if return_code != 0 :
+        result = lab_test.subprocess_file_print(self.analyze_log_filepath, analyze_cmd, lab_test.execution_path )
+        if result.return_code != 0:
             lab_test.print_error("Failed analyze")
             return False
 
         return True
 
+    def analyze_library(self, lab_test, log_basename):
+        ''' Analyze the library files into the shared precompiled library (if the library
+        for the current files and tools does not exist yet) '''
+        hdl_filename_list = lab_test.get_filenames_from_keylist(self.library_keylist)
+        library_path = precompiled_library_path(self.library_name, hdl_filename_list)
+        self.library_opts = ["-L", f"{self.library_name}={library_path}"]
+        complete_filepath = library_path / ".complete"
+        if complete_filepath.exists():
+            lab_test.print_info(TermColor.BLUE, f" Using precompiled library {library_path}")
+            return True
+        XSIM_LIB_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        # Only one process builds the library at a time (other processes wait and then use it)
+        with open(XSIM_LIB_CACHE_PATH / ".lock", "w") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            if complete_filepath.exists():
+                return True
+            shutil.rmtree(library_path, ignore_errors=True)
+            lib_xvlog_cmd = ["xvlog", "--nolog", "-sv", "--work", f"{self.library_name}={library_path}"]
+            if not self.analyze_hdl_files(lab_test, hdl_filename_list, log_basename + "_lib", lib_xvlog_cmd):
+                return False
+            complete_filepath.touch()
+        return True
+
     def analyze_sv_files(self, lab_test, log_basename):
         ''' Perform HDL analysis on a set of files '''
         
+        if len(self.library_keylist) > 0 and not self.analyze_library(lab_test, log_basename):
+            return False
+
         # Resolve the filenames
         hdl_filename_list = lab_test.get_filenames_from_keylist(self.hdl_sim_keylist)
 
-        sv_xvlog_cmd = ["xvlog", "--nolog", "-sv", ]
+        sv_xvlog_cmd = ["xvlog", "--nolog", "-sv", ] + self.library_opts
         # (include DIRS added in analyze_hdl_files)
         return self.analyze_hdl_files(lab_test, hdl_filename_list, log_basename, sv_xvlog_cmd)
 
@@ -119,7 +179,7 @@ class simulation_module(tester_module):
         self.elaborate_log_filepath = lab_test.execution_path / elaborate_log_filename
 
         #xelab_cmd = ["xelab", "--debug", "typical", "--nolog", "-L", "unisims_ver", design_name, "work.glbl" ]
-        xelab_cmd = ["xelab", "--debug", "typical", "--nolog", "-L", "unisims_ver"]
+        xelab_cmd = ["xelab", "--debug", "typical", "--nolog", "-L", "unisims_ver"] + self.library_opts
         if len(self.generics) > 0:
             # Add generic options
             for generic in self.generics:
@@ -133,9 +193,9 @@ class simulation_module(tester_module):
             #xelab_cmd.extend( ["-L", "unisims_ver", "--relax", "work.glbl" ])
             xelab_cmd.extend( ["-L", "unisims_ver", "--relax", "glbl", "-s", str.format("work.{}",design_name ) ])
 
-        return_code = lab_test.subprocess_file_print(self.elaborate_log_filepath, xelab_cmd, lab_test.execution_path )
+        result = lab_test.subprocess_file_print(self.elaborate_log_filepath, xelab_cmd, lab_test.execution_path )
 
-        if return_code != 0:
+        if result.return_code != 0:
             lab_test.print_error("Failed Elaborate")
             print(xelab_cmd)
             print(lab_test.execution_path)
@@ -143,7 +203,10 @@ class simulation_module(tester_module):
 
         return True
 
-    def simulate(self,lab_test,xsim_opts=[]):
+    def simulate(self,lab_test,xsim_opts=[],plusargs={}):
+        ''' Simulate the elaborated design. The plusargs are passed to the simulation with
+        '-testplusarg' (i.e., {"TEXT_MEM" : "program_text.mem"} selects the instruction memory
+        file of the iosystem without elaborating the design again). '''
         # Simulate
         #extract_lab_path = lab_test.submission_lab_path
         lab_test.print_info(TermColor.BLUE, " Starting Simulation")
@@ -154,9 +217,12 @@ class simulation_module(tester_module):
         # Add options from function parameters
         for opt in xsim_opts:
             xsim_cmd.append(opt)
+        for name, value in plusargs.items():
+            xsim_cmd.extend(["-testplusarg", f"{name}={value}"])
 
-        return_code = lab_test.subprocess_file_print(self.simulation_log_filepath, xsim_cmd, lab_test.execution_path )
-        if return_code != 0:
+        result = lab_test.subprocess_file_print(self.simulation_log_filepath, xsim_cmd, lab_test.execution_path,
+                                                kill_patterns=self.kill_patterns)
+        if result.return_code != 0:
             lab_test.print_error("Failed simulation")
             print(xsim_cmd)
             print(lab_test.execution_path)
@@ -231,8 +297,9 @@ class testbench_simulation(simulation_module):
     ''' An object that represents a testbench simulation.
     '''
     def __init__(self, testbench_description, testbench_top, hdl_sim_keylist, xe_options_list, \
-        include_dirs=[], generics=[], vhdl_files=[], use_glbl = False ):
-        super().__init__(testbench_top,hdl_sim_keylist,include_dirs,generics,vhdl_files,use_glbl=use_glbl)
+        include_dirs=[], generics=[], vhdl_files=[], use_glbl = False, kill_patterns = process_runner.SIMULATION_KILL_PATTERNS ):
+        super().__init__(testbench_top,hdl_sim_keylist,include_dirs,generics,vhdl_files,use_glbl=use_glbl,
+                         kill_patterns=kill_patterns)
         self.testbench_description = testbench_description
         #self.testbench_top = testbench_top
         #self.hdl_sim_keylist = hdl_sim_keylist
@@ -268,7 +335,7 @@ class testbench_simulation(simulation_module):
         return self.check_for_no_errors(lab_test,["Errors", "Error", "ERROR"])
 
     def check_for_no_errors(self, lab_test, error_strings):
-        with open(self.simulation_log_filepath) as sim_file:
+        with log_store.open_log(self.simulation_log_filepath) as sim_file:
             for line in sim_file:
                 for error_string in error_strings:
                     if error_string in line:
@@ -280,10 +347,14 @@ class testbench_simulation(simulation_module):
 
 class build_bitstream(tester_module):
     ''' An object that represents a bitstream implementation test.
+    kill_patterns: regular expressions that stop the build as soon as a line of its output matches
+    timeout_seconds: maximum duration of the build (0 for no limit)
+    Both apply to the build on the Vivado server and to a batch Vivado build.
     '''
 
     def __init__(self,design_name, xdl_key_list, hdl_key_list, implement_build = True, 
-        create_dcp = False,  include_dirs = [], vhdl_key_list = [], generics=[]):
+        create_dcp = False,  include_dirs = [], vhdl_key_list = [], generics=[],
+        kill_patterns = process_runner.BUILD_KILL_PATTERNS, timeout_seconds = 0):
         self.design_name = design_name
         self.xdl_key_list = xdl_key_list
         self.hdl_key_list = hdl_key_list
@@ -292,6 +363,8 @@ class build_bitstream(tester_module):
         self.include_dirs = include_dirs
         self.vhdl_key_list = vhdl_key_list
         self.generics=generics
+        self.kill_patterns = kill_patterns
+        self.timeout_seconds = timeout_seconds
 
     def module_name(self):
         ''' returns a string indicating the name of the module. Used for logging. '''
@@ -383,11 +456,35 @@ class build_bitstream(tester_module):
 
         implementation_log_filename = str(self.design_name + "_implementation.txt")
         implementation_log_filepath = lab_test.execution_path / implementation_log_filename
+
+        # Run the build script on the Vivado server if one is running (the design stays open
+        # for later memory updates)
+        output_checkpoint = checkpoint_filename if self.implement_build else (dcp_filename if self.create_dcp else None)
+        response = vivado_server.send_request({"source" : tcl_build_script_filename, "cwd" : str(lab_test.execution_path),
+            "output_checkpoint" : output_checkpoint, "kill_patterns" : self.kill_patterns,
+            "timeout_seconds" : self.timeout_seconds})
+        if response is not None:
+            # Same log as a batch Vivado build (compressed unless --plain_logs is given)
+            header = "Executing the build script on the Vivado server in directory:"+str(lab_test.execution_path)+"\n"
+            header += "\tsource " + tcl_build_script_filename + "\n"
+            log = log_store.log_sink(implementation_log_filepath, header, plain = lab_test.plain_logs)
+            try:
+                log.write("".join(line + "\n" for line in response["output"]))
+            finally:
+                log.close()
+            if response.get("terminated_msg") is not None:
+                lab_test.print_error(response["terminated_msg"])
+            if response["return_code"] != 0:
+                lab_test.print_error("Failed Implemeneetation")
+                return False
+            return True
+
         build_cmd = ["vivado", "-nolog", "-mode", "batch", "-nojournal", "-source", tcl_build_script_filename]
 
 
-        return_code = lab_test.subprocess_file_print(implementation_log_filepath, build_cmd, lab_test.execution_path )
-        if return_code != 0:
+        result = lab_test.subprocess_file_print(implementation_log_filepath, build_cmd, lab_test.execution_path,
+                                                kill_patterns=self.kill_patterns, timeout_seconds=self.timeout_seconds)
+        if result.return_code != 0:
             lab_test.print_error("Failed Implemeneetation")
             return False
         return True
@@ -407,7 +504,7 @@ class rars_raw(tester_module):
         self.rars_options = rars_options
         self.asm_filekey = asm_filekey
         #self.RARS_FILENAME = "../resources/rars1_4.jar"
-        self.RARS_FILENAME = "resources/rars1_4.jar"
+        self.RARS_FILENAME = "resources/rars1_6.jar"
 
     def module_name(self):
         ''' returns a string indicating the name of the module. Used for logging. '''
@@ -419,6 +516,9 @@ class rars_raw(tester_module):
         print( "RARS execution of", asm_filename,"with options",self.rars_options)
 
         jar_file_path = lab_test.submission_top_path / self.RARS_FILENAME
+        if shutil.which("java") is None or not jar_file_path.exists():
+            lab_test.print_warning(f"java and {jar_file_path} are required to run RARS")
+            return False
 
         #rars_cmd = ["java", "-jar", self.RARS_FILENAME, ]
         rars_cmd = ["java", "-jar", jar_file_path, ]
@@ -430,35 +530,81 @@ class rars_raw(tester_module):
         #if proc.returncode:
         #	lab_test.print_warning("Failed to simulate assembler files")
         #	return False
-        return_code = lab_test.subprocess_file_print(rars_log_filepath, rars_cmd, lab_test.execution_path )
-        if return_code:
+        result = lab_test.subprocess_file_print(rars_log_filepath, rars_cmd, lab_test.execution_path )
+        if result.return_code:
             lab_test.print_warning("Failed to simulate assembler files")
             return False
         return True
 
 class rars_sim_print(rars_raw):
     ''' 
-    Assembles the given file and then runs the file with output
+    Assembles the given file and then runs the file with output.
+    The file is assembled and simulated in-process with the python RARS assembler and
+    simulator (rars_asm.py and rars_sim.py) rather than starting the RARS jar. The jar
+    is used for programs with features that the python assembler does not support.
     '''
 
-    def __init__(self, asm_filekey):
+    def __init__(self, asm_filekey, max_instructions = 100000, input_text = ""):
         super().__init__(asm_filekey)
         #self.asm_filekey = asm_filekey
         #self.RARS_FILENAME = "../resources/rars1_4.jar"
+        self.max_instructions = max_instructions
+        self.input_text = input_text
 
     def module_name(self):
         ''' returns a string indicating the name of the module. Used for logging. '''
         return str.format("RARS assembly and run with file ({})",self.asm_filekey)
 
     def perform_test(self, lab_test):
-        # Bug! Using key for filename rather than actual file
         asm_filename = lab_test.get_filename_from_key(self.asm_filekey)
         hex_filename = str.format("{}.txt",self.asm_filekey)
-        # TODO: SHould add a "ae1" to these options so that an error is given as a return code for failed assembly
-        self.rars_options = ["sp","ic","100000","dump",".text","HexText",hex_filename,]
-        result = super().perform_test(lab_test)
-        if not result:
+        print( "RARS execution of", asm_filename,"with instruction limit",self.max_instructions)
+        try:
+            program = rars_asm.rars_assembler().assemble_file(lab_test.execution_path / asm_filename)
+            error = None
+        except rars_asm.assembly_error as e:
+            if e.unsupported:
+                return self.perform_jar_test(lab_test, e, hex_filename)
+            error = e
+        rars_log_filepath = lab_test.execution_path / str(self.asm_filekey + "_exec.txt")
+        with open(rars_log_filepath, "w") as fp:
+            fp.write("Simulating "+str(asm_filename)+" in directory:"+str(lab_test.execution_path)+"\n")
+            if error is not None:
+                report = error.report() + "Processing terminated due to errors.\n"
+                print(report, end="")
+                fp.write(report)
+                lab_test.print_warning("Failed to simulate assembler files")
+                return False
+            simulator = rars_sim.rars_simulator(program, self.input_text)
+            result = simulator.simulate(self.max_instructions)
+            # Same messages as the RARS options "<max_instructions> ic"
+            report = result.output + result.error_report()
+            if result.reason != rars_sim.EXCEPTION:
+                report += "\n"
+            report += result.termination_message() + "\n\n" + str(result.instruction_count) + "\n"
+            print(report, end="")
+            fp.write(report)
+            message = result.program.dump(".text", "HexText", lab_test.execution_path / hex_filename)
+            if message is not None:
+                print(message)
+                fp.write(message+"\n")
+        if result.reason == rars_sim.EXCEPTION:
+            lab_test.print_warning("Failed to simulate assembler files")
             return False
+        self.print_memory_contents(lab_test, hex_filename)
+        return True
+
+    def perform_jar_test(self, lab_test, error, hex_filename):
+        ''' Simulate a program that the python assembler does not support with the RARS jar '''
+        print(error.report(), end="")
+        lab_test.print_warning("Features not supported by the python assembler, simulating with the RARS jar")
+        self.rars_options = ["sp","ic",str(self.max_instructions),"dump",".text","HexText",hex_filename,]
+        if not super().perform_test(lab_test):
+            return False
+        self.print_memory_contents(lab_test, hex_filename)
+        return True
+
+    def print_memory_contents(self, lab_test, hex_filename):
         # Now print the output of each compiled file
         print("Memory contents")
         hex_filepath = lab_test.execution_path / hex_filename
@@ -466,11 +612,13 @@ class rars_sim_print(rars_raw):
         file_contents = f.read()
         print(file_contents)
         f.close()
-        return True
 
         
 class rars_mem_file(rars_raw):
-    ''' Assembles the given file and generates an ascii memory file
+    ''' Assembles the given file and generates an ascii memory file.
+    The file is assembled in-process with the python RARS assembler (rars_asm.py)
+    rather than starting the RARS jar. The jar is used for programs with features
+    that the python assembler does not support.
     '''
 
     def __init__(self, asm_filekey, generate_data_mem=False):
@@ -487,20 +635,40 @@ class rars_mem_file(rars_raw):
         asm_filename = lab_test.get_filename_from_key(self.asm_filekey)
         asm_path = pathlib.Path(asm_filename)
         asm_basename = asm_path.stem
-        asm_rootname = asm_path.name
-        i_mem_filename = str.format("{}_text.mem",asm_basename)		
-        d_mem_filename = str.format("{}_data.mem",asm_basename)		
-        # Initial options "ae1" - return a 1 return code with assembly error
-        self.rars_options = ["ae1", "mc", "CompactTextAtZero", "a", "dump", ".text", "HexText", i_mem_filename]
-        # Add options for data memory
+        i_mem_filename = str.format("{}_text.mem",asm_basename)
+        d_mem_filename = str.format("{}_data.mem",asm_basename)
+        # Same dumps as the RARS options "mc CompactTextAtZero a dump .text HexText <i_mem> [dump .data HexText <d_mem>]"
+        dumps = [(".text", "HexText", i_mem_filename)]
         if self.generate_data_mem:
-            self.rars_options.extend(["dump", ".data", "HexText", d_mem_filename])
-        # Append orginal filename
-        #self.rars_options.append(asm_rootname)
-        # Run test
-        result = super().perform_test(lab_test)
-        if not result:
-            return False
+            dumps.append((".data", "HexText", d_mem_filename))
+        print( "RARS assembly of", asm_filename,"with dumps",dumps)
+        try:
+            program = rars_asm.rars_assembler("CompactTextAtZero").assemble_file(lab_test.execution_path / asm_path)
+            error = None
+        except rars_asm.assembly_error as e:
+            if e.unsupported:
+                print(e.report(), end="")
+                lab_test.print_warning("Features not supported by the python assembler, assembling with the RARS jar")
+                # "ae1" - return a 1 return code with assembly error
+                self.rars_options = ["ae1", "mc", "CompactTextAtZero", "a"]
+                for dump in dumps:
+                    self.rars_options += ["dump", *dump]
+                return super().perform_test(lab_test)
+            error = e
+        rars_log_filepath = lab_test.execution_path / str(self.asm_filekey + "_exec.txt")
+        with open(rars_log_filepath, "w") as fp:
+            fp.write("Assembling "+str(asm_filename)+" in directory:"+str(lab_test.execution_path)+"\n")
+            if error is not None:
+                report = error.report() + "Processing terminated due to errors.\n"
+                print(report, end="")
+                fp.write(report)
+                lab_test.print_warning("Failed to simulate assembler files")
+                return False
+            for segment, dump_format, dump_filename in dumps:
+                message = program.dump(segment, dump_format, lab_test.execution_path / dump_filename)
+                if message is not None:
+                    print(message)
+                    fp.write(message+"\n")
         return True
 
 class update_bistream(tester_module):
@@ -537,15 +705,16 @@ class update_bitstream_mem(tester_module):
 
         load_mem_path = lab_test.submission_top_path / "resources/load_mem.tcl"
 
-        updatemem_cmd = ["vivado", "-mode", "batch", "-source", str(load_mem_path), 
-             "-tclargs", "updateMem2",
+        load_mem_args = ["updateMem2",
             self.input_dcp_filename, self.text_mem_filename, self.data_mem_filename, 
             self.bitstream_filename]
         if self.output_dcp != "":
-            updatemem_cmd.append(self.output_dcp)
-        print(updatemem_cmd)
-        proc = subprocess.run(updatemem_cmd, cwd=lab_test.execution_path,check=False)
-        if proc.returncode:
+            load_mem_args.append(self.output_dcp)
+        print(load_mem_args)
+        # Uses the Vivado server if one is running (the checkpoint may already be open)
+        return_code = vivado_server.load_mem_command(load_mem_args, cwd=lab_test.execution_path,
+            load_mem_tcl_path=load_mem_path)
+        if return_code:
             lab_test.print_warning("Failed to update bitfile")
             return False
         return True
@@ -578,19 +747,19 @@ class update_font_mem(tester_module):
         rel_path = os.path.relpath(os.path.relpath(lab_test.submission_lab_path,lab_test.execution_path))
         font_path = os.path.join(rel_path,self.font_file)
 
-        updatemem_cmd = ["vivado", "-mode", "batch", "-source", str(load_mem_path), 
-             "-tclargs", "updateFont",
+        load_mem_args = ["updateFont",
             self.input_dcp_filename, 
             #self.font_file,
             font_path,
             self.bitstream_filename]
 
         if self.output_dcp != "":
-            updatemem_cmd.append(self.output_dcp)
-        print(updatemem_cmd)
+            load_mem_args.append(self.output_dcp)
+        print(load_mem_args)
         print(lab_test.execution_path)
-        proc = subprocess.run(updatemem_cmd, cwd=lab_test.execution_path,check=False)
-        if proc.returncode:
+        return_code = vivado_server.load_mem_command(load_mem_args, cwd=lab_test.execution_path,
+            load_mem_tcl_path=load_mem_path)
+        if return_code:
             lab_test.print_warning("Failed to update bitfile")
             return False
         return True
@@ -622,18 +791,18 @@ class update_background_mem(tester_module):
         rel_path = os.path.relpath(os.path.relpath(lab_test.submission_lab_path,lab_test.execution_path))
         background_path = os.path.join(rel_path,self.background_file)
 
-        updatemem_cmd = ["vivado", "-mode", "batch", "-source", str(load_mem_path), 
-             "-tclargs", "updateBackground",
+        load_mem_args = ["updateBackground",
             self.input_dcp_filename, 
             #self.background_file,
             background_path,
             self.bitstream_filename]
         if self.output_dcp != "":
-            updatemem_cmd.append(self.output_dcp)
-        print(updatemem_cmd)
+            load_mem_args.append(self.output_dcp)
+        print(load_mem_args)
         print(lab_test.execution_path)
-        proc = subprocess.run(updatemem_cmd, cwd=lab_test.execution_path,check=False)
-        if proc.returncode:
+        return_code = vivado_server.load_mem_command(load_mem_args, cwd=lab_test.execution_path,
+            load_mem_tcl_path=load_mem_path)
+        if return_code:
             lab_test.print_warning("Failed to update bitfile")
             return False
         return True
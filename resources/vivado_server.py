@@ -0,0 +1,424 @@
+#!/usr/bin/python3
+
+'''
+A long running Vivado Tcl process for executing many Tcl jobs.
+
+Starting Vivado and reading a design checkpoint from disk takes longer than most
+of the memory update steps (i.e., the lab12 chain riscv_io_final.bit -> font.bit ->
+background.bit). The server starts a single 'vivado -mode tcl' process, sources
+load_mem.tcl once, and sends it Tcl jobs over its stdin. The end of each job is
+detected with a unique marker that is printed after the job completes.
+
+The server keeps track of the checkpoint whose contents are in memory. A job that
+needs the same (unchanged) checkpoint uses the open design instead of reading the
+checkpoint again. After a job writes a new checkpoint, the open design is the new
+checkpoint (i.e., font.dcp is still open when background.bit is built from it).
+
+The server can be used directly from Python (vivado_tcl_server) or shared between
+processes through a unix socket:
+  vivado_server.py serve &
+  vivado_server.py load_mem updateFont riscv_io_final.dcp game_font_mem.txt font.bit font.dcp
+  vivado_server.py stop
+The 'load_mem' command runs a batch Vivado with load_mem.tcl when no server is running.
+
+A job can be given kill patterns and a timeout like a batch Vivado run by the tester. The
+Vivado process is killed (and restarted) when a line of the job output matches a kill
+pattern or the job does not complete before its deadline.
+
+The command used to start the Tcl process can be changed with the VIVADO_SERVER_COMMAND
+environment variable (i.e., a 'tclsh' with stand-in procedures for testing).
+'''
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import select
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+RESOURCES_PATH = pathlib.Path(__file__).resolve().parent
+LOAD_MEM_TCL_PATH = RESOURCES_PATH / "load_mem.tcl"
+
+DEFAULT_VIVADO_COMMAND = ["vivado", "-mode", "tcl", "-nolog", "-nojournal", "-notrace"]
+VIVADO_COMMAND_ENV = "VIVADO_SERVER_COMMAND"
+SOCKET_PATH_ENV = "VIVADO_SERVER_SOCKET"
+
+# load_mem.tcl commands that only read the open design
+LOAD_MEM_READ_ONLY_COMMANDS = ["dumpMem"]
+# Position of the optional output checkpoint argument for each load_mem.tcl command
+LOAD_MEM_CHECKPOINT_ARGUMENT = {
+    "updateMem" : 5,
+    "updateMem2" : 5,
+    "updateData" : 4,
+    "updateFont" : 4,
+    "updateBackground" : 4,
+}
+
+def default_socket_path():
+    ''' The socket used when no socket is given (one server per user) '''
+    if SOCKET_PATH_ENV in os.environ:
+        return pathlib.Path(os.environ[SOCKET_PATH_ENV])
+    return pathlib.Path.home() / ".cache" / "ecen423" / "vivado_server.sock"
+
+def tcl_quote(text):
+    ''' Returns a Tcl word (in double quotes) that evaluates to the given string without
+    any substitutions. The word does not contain any newlines. '''
+    escapes = {"\\" : "\\\\", "\"" : "\\\"", "$" : "\\$", "[" : "\\[", "]" : "\\]",
+               "{" : "\\{", "}" : "\\}", "\n" : "\\n", "\r" : "\\r", "\t" : "\\t"}
+    return "\"" + "".join(escapes.get(c, c) for c in text) + "\""
+
+def tcl_list(words):
+    ''' Returns a Tcl command that creates a list of the given strings '''
+    return "[list " + " ".join(tcl_quote(str(word)) for word in words) + "]"
+
+class tcl_job_result():
+    ''' The result of a Tcl job.
+    return_code: 0 if the job completed without a Tcl error
+    output: list of lines printed by the job
+    terminated_msg: the reason the job was stopped by a kill pattern or its timeout (None otherwise)
+    '''
+    def __init__(self, return_code, output, terminated_msg = None):
+        self.return_code = return_code
+        self.output = output
+        self.terminated_msg = terminated_msg
+
+    def to_dict(self):
+        return {"return_code" : self.return_code, "output" : self.output, "terminated_msg" : self.terminated_msg}
+
+class vivado_tcl_server():
+    ''' A Vivado process in Tcl mode that executes jobs one at a time.
+    command: the command that starts the Tcl process (default is DEFAULT_VIVADO_COMMAND
+      or the VIVADO_SERVER_COMMAND environment variable)
+    output_fp: file object where the output of every job is echoed (None for no echo)
+    '''
+    def __init__(self, command = None, output_fp = None):
+        if command is None:
+            if VIVADO_COMMAND_ENV in os.environ:
+                command = shlex.split(os.environ[VIVADO_COMMAND_ENV])
+            else:
+                command = DEFAULT_VIVADO_COMMAND
+        self.command = command
+        self.output_fp = output_fp
+        self.proc = None
+        # Output of the Tcl process that has been read but is not a complete line
+        self.pending_output = b""
+        # (path, modification time) of the checkpoint whose contents are open (None if unknown)
+        self.open_checkpoint_key = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        ''' Start the Tcl process and load the load_mem.tcl procedures '''
+        # The process is started in its own session so it can be killed with all of its children
+        self.proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, bufsize=0, start_new_session=True)
+        self.pending_output = b""
+        result = self.run(f"set load_mem_library 1\nsource {tcl_quote(str(LOAD_MEM_TCL_PATH))}")
+        if result.return_code != 0:
+            self.close()
+            raise Exception(f"Error starting the Vivado server: {' '.join(result.output)}")
+
+    def is_running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def read_line(self, deadline = None):
+        ''' Returns the next line of output (without the end of line) or None at the end of
+        the output. Raises TimeoutError if no complete line is available before the deadline. '''
+        fd = self.proc.stdout.fileno()
+        while b"\n" not in self.pending_output:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                raise TimeoutError()
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if not ready:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                line, self.pending_output = self.pending_output, b""
+                return line.decode(errors="replace") if line else None
+            self.pending_output += data
+        line, self.pending_output = self.pending_output.split(b"\n", 1)
+        return line.decode(errors="replace")
+
+    def kill(self):
+        ''' Kill the Tcl process and the processes it started '''
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.proc.wait()
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc = None
+        self.open_checkpoint_key = None
+
+    def restart(self):
+        ''' Kill the Tcl process after a job was stopped and start a new one (the server
+        is left stopped if the new process cannot be started) '''
+        self.kill()
+        try:
+            self.start()
+        except Exception as e:
+            print(f"Error restarting the Vivado server: {e}")
+            self.proc = None
+
+    def run(self, script, cwd = None, kill_patterns = None, timeout_seconds = 0):
+        ''' Execute a Tcl script in the global scope and return a tcl_job_result.
+        cwd: directory where the job is executed (default is the current directory)
+        kill_patterns: regular expressions that stop the job as soon as a line of its output matches
+        timeout_seconds: maximum duration of the job (0 for no limit) '''
+        if not self.is_running():
+            raise Exception("The Vivado server is not running")
+        if cwd is None:
+            cwd = os.getcwd()
+        marker = f"__VIVADO_SERVER_DONE_{uuid.uuid4().hex}__"
+        job = (f"cd {tcl_quote(str(cwd))}\n"
+               f"set ::vivado_server_script {tcl_quote(script)}\n"
+               "set ::vivado_server_rc [catch {uplevel #0 $::vivado_server_script} ::vivado_server_result]\n"
+               "if {$::vivado_server_rc != 0} {puts \"ERROR: $::vivado_server_result\"}\n"
+               f"puts \"\\n{marker} $::vivado_server_rc\"\n"
+               "flush stdout\n")
+        kill_regexes = [re.compile(pattern, re.MULTILINE) for pattern in (kill_patterns or [])]
+        deadline = time.monotonic() + timeout_seconds if timeout_seconds > 0 else None
+        self.proc.stdin.write(job.encode())
+        self.proc.stdin.flush()
+        output = []
+        while True:
+            try:
+                line = self.read_line(deadline)
+            except TimeoutError:
+                terminated_msg = f"Process terminated after {timeout_seconds} seconds"
+                output.append(terminated_msg)
+                self.restart()
+                return tcl_job_result(-1, output, terminated_msg)
+            if line is None:
+                # The process exited before the job completed
+                self.open_checkpoint_key = None
+                return tcl_job_result(-1, output)
+            position = line.find(marker)
+            if position >= 0:
+                return_code = int(line[position + len(marker):].strip())
+                # The blank line printed before the marker is not part of the job output
+                if len(output) > 0 and output[-1] == "":
+                    output.pop()
+                return tcl_job_result(return_code, output)
+            output.append(line)
+            if self.output_fp is not None:
+                self.output_fp.write(line + "\n")
+                self.output_fp.flush()
+            for regex in kill_regexes:
+                if regex.search(line):
+                    terminated_msg = f"Process terminated on output matching '{regex.pattern}'"
+                    output.append(terminated_msg)
+                    self.restart()
+                    return tcl_job_result(-1, output, terminated_msg)
+
+    def checkpoint_key(self, checkpoint_filepath):
+        path = pathlib.Path(checkpoint_filepath).resolve()
+        return (str(path), path.stat().st_mtime_ns)
+
+    def open_checkpoint(self, checkpoint_filename, cwd = None):
+        ''' Open a checkpoint unless its (unchanged) contents are already open.
+        Returns a tcl_job_result. '''
+        checkpoint_filepath = pathlib.Path(cwd if cwd is not None else os.getcwd()) / checkpoint_filename
+        if not checkpoint_filepath.exists():
+            return tcl_job_result(1, [f"ERROR: checkpoint {checkpoint_filepath} does not exist"])
+        key = self.checkpoint_key(checkpoint_filepath)
+        if key == self.open_checkpoint_key:
+            return tcl_job_result(0, [f"Using open checkpoint {key[0]}"])
+        self.open_checkpoint_key = None
+        result = self.run(f"catch {{close_design}}\nopen_checkpoint {tcl_quote(key[0])}", cwd)
+        if result.return_code == 0:
+            self.open_checkpoint_key = key
+        return result
+
+    def checkpoint_written(self, checkpoint_filename, cwd = None):
+        ''' Record that the open design was written to a checkpoint (the open design
+        and the checkpoint are the same) '''
+        checkpoint_filepath = pathlib.Path(cwd if cwd is not None else os.getcwd()) / checkpoint_filename
+        self.open_checkpoint_key = None
+        if checkpoint_filepath.exists():
+            self.open_checkpoint_key = self.checkpoint_key(checkpoint_filepath)
+
+    def load_mem(self, load_mem_args, cwd = None):
+        ''' Execute a load_mem.tcl command. The arguments are the same as the load_mem.tcl
+        script arguments (command name, checkpoint file, command arguments). '''
+        if len(load_mem_args) < 2:
+            return tcl_job_result(1, ["ERROR: load_mem requires a command and a checkpoint file"])
+        command = load_mem_args[0]
+        result = self.open_checkpoint(load_mem_args[1], cwd)
+        if result.return_code != 0:
+            return result
+        job_result = self.run(f"load_mem_command {tcl_list(load_mem_args)}", cwd)
+        job_result.output = result.output + job_result.output
+        if command in LOAD_MEM_READ_ONLY_COMMANDS:
+            return job_result
+        # The memories of the open design have been changed: it only matches a checkpoint written by the command
+        self.open_checkpoint_key = None
+        checkpoint_position = LOAD_MEM_CHECKPOINT_ARGUMENT.get(command)
+        if job_result.return_code == 0 and checkpoint_position is not None and len(load_mem_args) > checkpoint_position:
+            self.checkpoint_written(load_mem_args[checkpoint_position], cwd)
+        return job_result
+
+    def source(self, tcl_filename, cwd = None, output_checkpoint = None, kill_patterns = None, timeout_seconds = 0):
+        ''' Source a Tcl script (i.e., a build script) after closing the open design.
+        output_checkpoint: checkpoint written at the end of the script (the design stays open)
+        kill_patterns, timeout_seconds: see run() '''
+        self.open_checkpoint_key = None
+        result = self.run(f"catch {{close_design}}\nsource {tcl_quote(str(tcl_filename))}", cwd,
+                          kill_patterns, timeout_seconds)
+        if result.return_code == 0 and output_checkpoint is not None:
+            self.checkpoint_written(output_checkpoint, cwd)
+        return result
+
+    def close(self):
+        ''' Stop the Tcl process '''
+        if self.proc is None:
+            return
+        if self.is_running():
+            try:
+                self.proc.stdin.write(b"exit\n")
+                self.proc.stdin.flush()
+                self.proc.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                self.kill()
+                return
+        self.proc = None
+        self.open_checkpoint_key = None
+
+##########################################################
+# Socket interface
+##########################################################
+
+def handle_request(server, request):
+    ''' Execute a single request and return the response dictionary '''
+    cwd = request.get("cwd")
+    if "load_mem" in request:
+        return server.load_mem(request["load_mem"], cwd).to_dict()
+    if "source" in request:
+        return server.source(request["source"], cwd, request.get("output_checkpoint"),
+                             request.get("kill_patterns"), request.get("timeout_seconds", 0)).to_dict()
+    if "script" in request:
+        return server.run(request["script"], cwd).to_dict()
+    return tcl_job_result(1, [f"ERROR: unknown request {request}"]).to_dict()
+
+def serve(socket_path, command = None):
+    ''' Accept requests on a unix socket until a 'shutdown' request is received. Each
+    connection sends one JSON request line and receives one JSON response line. Requests
+    are executed one at a time. '''
+    socket_path = pathlib.Path(socket_path)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        socket_path.unlink()
+    with vivado_tcl_server(command, output_fp=sys.stdout) as server:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(socket_path))
+        listener.listen()
+        print(f"Vivado server listening on {socket_path}")
+        try:
+            running = True
+            while running:
+                connection, _ = listener.accept()
+                with connection, connection.makefile("rw") as fp:
+                    line = fp.readline()
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        continue
+                    if request.get("shutdown"):
+                        running = False
+                        response = tcl_job_result(0, ["Vivado server stopped"]).to_dict()
+                    elif not server.is_running():
+                        running = False
+                        response = tcl_job_result(-1, ["ERROR: the Vivado process exited"]).to_dict()
+                    else:
+                        response = handle_request(server, request)
+                    fp.write(json.dumps(response) + "\n")
+                    fp.flush()
+        finally:
+            listener.close()
+            if socket_path.exists():
+                socket_path.unlink()
+
+def send_request(request, socket_path = None):
+    ''' Send a request to a running server. Returns the response dictionary or None if
+    no server is running on the socket. '''
+    if socket_path is None:
+        socket_path = default_socket_path()
+    if not pathlib.Path(socket_path).exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(str(socket_path))
+            with connection.makefile("rw") as fp:
+                fp.write(json.dumps(request) + "\n")
+                fp.flush()
+                line = fp.readline()
+    except OSError:
+        return None
+    if line == "":
+        return None
+    return json.loads(line)
+
+def load_mem_command(load_mem_args, cwd = None, socket_path = None, output_fp = sys.stdout,
+                     load_mem_tcl_path = LOAD_MEM_TCL_PATH):
+    ''' Run a load_mem.tcl command on the running server or, if there is no server,
+    with a batch Vivado (using the given load_mem.tcl). Returns the return code. '''
+    if cwd is None:
+        cwd = os.getcwd()
+    response = send_request({"load_mem" : list(load_mem_args), "cwd" : str(cwd)}, socket_path)
+    if response is not None:
+        if output_fp is not None:
+            for line in response["output"]:
+                output_fp.write(line + "\n")
+        return response["return_code"]
+    cmd = ["vivado", "-mode", "batch", "-source", str(load_mem_tcl_path), "-tclargs"] + list(load_mem_args)
+    return subprocess.run(cmd, cwd=cwd, check=False).returncode
+
+def main():
+    parser = argparse.ArgumentParser(description="Long running Vivado Tcl server")
+    parser.add_argument("--socket", type=str, help="Unix socket of the server (default is ~/.cache/ecen423/vivado_server.sock)")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Start the server")
+    serve_parser.add_argument("--command", type=str, help="Command that starts the Tcl process")
+    load_mem_parser = subparsers.add_parser("load_mem", help="Run a load_mem.tcl command")
+    load_mem_parser.add_argument("args", nargs=argparse.REMAINDER, help="load_mem.tcl arguments")
+    source_parser = subparsers.add_parser("source", help="Source a Tcl script on the server")
+    source_parser.add_argument("script", type=str, help="Tcl script")
+    source_parser.add_argument("--output_checkpoint", type=str, help="Checkpoint written at the end of the script")
+    subparsers.add_parser("stop", help="Stop the server")
+    args = parser.parse_args()
+    socket_path = args.socket if args.socket else default_socket_path()
+
+    if args.action == "serve":
+        command = shlex.split(args.command) if args.command else None
+        serve(socket_path, command)
+        return 0
+    if args.action == "load_mem":
+        return load_mem_command(args.args, socket_path=socket_path)
+    if args.action == "source":
+        response = send_request({"source" : args.script, "cwd" : os.getcwd(),
+                                 "output_checkpoint" : args.output_checkpoint}, socket_path)
+    else:
+        response = send_request({"shutdown" : True}, socket_path)
+    if response is None:
+        print(f"No Vivado server running on {socket_path}")
+        return 1
+    for line in response["output"]:
+        print(line)
+    return response["return_code"]
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+'''
+Isolated scratch work directories for running makefile rules at the same time.
+
+The simulation tools write their scratch files (xsim.dir, xvlog.pb, xelab.pb,
+webtalk files, ...) into the directory they are run from. Two simulations run
+in the same lab directory at the same time corrupt each other's snapshots.
+
+An isolated work directory is a scratch copy of the lab directory inside a
+mirror of the repository: every other directory of the repository is a symbolic
+link to the original so relative paths used by the makefiles (i.e.,
+'../lab02/alu.sv', '../resources/iosystem/iosystem.mk', '../include') still
+work. The files of the lab directory and of its sub directories are copied (with
+their time stamps so make sees the same up to date targets) so a tool never writes
+into the lab directory through a link. The tool scratch directories (xsim.dir, .Xil)
+are not copied: the tools create new ones. After the rule is run, the declared build
+files and the new or changed files (outside of the scratch directories) are copied
+back to the lab directory. The tool scratch files are discarded with the work directory.
+'''
+
+import os
+import pathlib
+import shutil
+import tempfile
+import uuid
+
+import build_cache
+
+# Directories in the lab directory that are never copied into a work directory
+SCRATCH_DIRECTORY_NAMES = ("xsim.dir", ".Xil", "__pycache__")
+
+def copy_tree(source_path, target_path):
+    ''' Copy the files of a directory and of its sub directories (the symbolic links are
+    copied as links and the tool scratch directories are skipped) '''
+    for entry in source_path.iterdir():
+        if entry.name in SCRATCH_DIRECTORY_NAMES:
+            continue
+        target = target_path / entry.name
+        if entry.is_symlink():
+            target.symlink_to(os.readlink(entry))
+        elif entry.is_dir():
+            target.mkdir()
+            copy_tree(entry, target)
+        elif entry.is_file():
+            shutil.copy2(entry, target)
+
+def tree_snapshot(directory_path, relative_path = ""):
+    ''' Returns a dictionary of (size, mtime) keyed by relative filename for the regular files
+    in a directory and its sub directories (the tool scratch directories are skipped) '''
+    snapshot = {}
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            name = relative_path + entry.name
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                snapshot[name] = (stat.st_size, stat.st_mtime_ns)
+            elif entry.is_dir(follow_symlinks=False) and entry.name not in SCRATCH_DIRECTORY_NAMES:
+                snapshot.update(tree_snapshot(entry.path, name + "/"))
+    return snapshot
+
+class isolated_work_dir():
+    ''' A scratch work directory for a single makefile rule.
+    repo_root_path: top-level directory of the repository
+    working_path: the lab directory (must be inside the repository)
+    '''
+    def __init__(self, repo_root_path, working_path):
+        self.repo_root_path = pathlib.Path(repo_root_path).resolve()
+        self.working_path = pathlib.Path(working_path).resolve()
+        self.scratch_root_path = None
+        # The copy of the lab directory where the rule is run
+        self.path = None
+        self.snapshot = None
+
+    def create(self, prefix = "work_"):
+        ''' Create the work directory and return its path '''
+        self.scratch_root_path = pathlib.Path(tempfile.mkdtemp(prefix=prefix))
+        relative_path = self.working_path.relative_to(self.repo_root_path)
+        # Link all of the siblings of each directory between the repository root and the lab directory
+        real_dir = self.repo_root_path
+        scratch_dir = self.scratch_root_path
+        for part in relative_path.parts:
+            for entry in real_dir.iterdir():
+                if entry.name != part:
+                    (scratch_dir / entry.name).symlink_to(entry)
+            real_dir = real_dir / part
+            scratch_dir = scratch_dir / part
+            scratch_dir.mkdir()
+        copy_tree(self.working_path, scratch_dir)
+        self.path = scratch_dir
+        self.snapshot = tree_snapshot(self.path)
+        return self.path
+
+    def copy_back(self, required_build_files = None):
+        ''' Copy the declared build files and the files created or changed in the work
+        directory (and its sub directories) back to the lab directory. Returns the list of
+        copied filenames (relative to the lab directory). '''
+        current = tree_snapshot(self.path)
+        names = set(name for name, stat in current.items() if self.snapshot.get(name) != stat)
+        names |= set(name for name in (required_build_files or []) if ".." not in pathlib.PurePath(name).parts)
+        copied = []
+        for name in sorted(names):
+            source = self.path / name
+            if (pathlib.PurePath(name).name.startswith(build_cache.SCRATCH_FILE_PREFIXES) or
+                    not source.is_file() or source.is_symlink()):
+                continue
+            target = self.working_path / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # Copy to a temporary file and rename so that a concurrent reader never sees a partial file
+            tmp_target = target.parent / f".{target.name}.{uuid.uuid4().hex[:8]}.tmp"
+            shutil.copy2(source, tmp_target)
+            os.replace(tmp_target, target)
+            copied.append(name)
+        return copied
+
+    def remove(self):
+        ''' Remove the work directory (the linked directories are not affected) '''
+        if self.scratch_root_path is not None:
+            shutil.rmtree(self.scratch_root_path, ignore_errors=True)
+            self.scratch_root_path = None
+            self.path = None
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+
+'''
+Fast workspaces for the repositories cloned by the lab passoff scripts.
+
+The passoff scripts clone the student repository into an extract directory and
+run the tools there, so all of the tool scratch output (.Xil, xsim.dir, checkpoints,
+logs) is written to the file system of the extract directory. When that file system
+is slow (network or shared storage), a workspace on a RAM backed file system (tmpfs)
+or on a local disk is used instead:
+
+- The candidate directories are the directory given with '--workspace_dir' (or the
+  ECEN423_WORKSPACE environment variable), /dev/shm, $XDG_RUNTIME_DIR and /tmp. RAM
+  backed candidates are preferred over local disks. Network file systems are not used.
+- A candidate is only used if it has at least min_free_bytes of free space (and,
+  for a RAM backed file system, as much available memory on top of it).
+- The declared artifacts and the logs are copied back to the extract directory when
+  the test is done and the workspace is removed (clean_up, also called at exit). A
+  workspace that holds a git clone can be kept instead: only the files that are not
+  tracked (the tool output) are removed, so the next passoff can update the clone
+  rather than cloning the repository again.
+
+The time for writing, reading and deleting a probe (a large file and many small
+files) is measured in the extract directory and in the workspace. The I/O time saved
+by the workspace is estimated from the difference and the amount of data and
+files in the workspace at the end of the test.
+'''
+
+import atexit
+import fnmatch
+import os
+import pathlib
+import shutil
+import subprocess
+import time
+
+# Environment variable with the directory for the workspaces
+WORKSPACE_DIR_ENV = "ECEN423_WORKSPACE"
+# Free space needed in a workspace file system (a Vivado implementation uses a few GB)
+MIN_FREE_BYTES = 4 * 1024 ** 3
+# File system types
+RAM_FILE_SYSTEMS = ("tmpfs", "ramfs")
+NETWORK_FILE_SYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "lustre", "gpfs", "ceph", "glusterfs",
+                        "fuse.sshfs", "fuse.glusterfs", "9p", "virtiofs")
+# Probe used to compare the I/O speed of the file systems
+PROBE_FILE_BYTES = 4 * 1024 * 1024
+PROBE_FILE_COUNT = 100
+# Files copied back from a workspace (in addition to the declared artifacts)
+LOG_PATTERNS = ["*.log", "*.txt", "*.gz", "*.idx", "*.jou"]
+
+def mount_info(path):
+    ''' Returns the (mount point, file system type) of the file system of a path '''
+    path = os.path.realpath(path)
+    best = ("/", "")
+    try:
+        with open("/proc/self/mountinfo") as fp:
+            for line in fp:
+                fields = line.split()
+                mount_point = fields[4].replace("\\040", " ")
+                fs_type = fields[fields.index("-") + 1]
+                if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and \
+                   len(mount_point) >= len(best[0]):
+                    best = (mount_point, fs_type)
+    except (OSError, ValueError, IndexError):
+        pass
+    return best
+
+def file_system_kind(path):
+    ''' Returns 'ram', 'network' or 'local' for the file system of a path '''
+    fs_type = mount_info(path)[1]
+    if fs_type in RAM_FILE_SYSTEMS:
+        return "ram"
+    if fs_type in NETWORK_FILE_SYSTEMS:
+        return "network"
+    return "local"
+
+def available_memory_bytes():
+    try:
+        with open("/proc/meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def existing_parent(path):
+    ''' The path or its closest existing parent directory '''
+    path = pathlib.Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+class io_probe():
+    ''' Time to write (and sync), read and delete a large file and many small files in a directory '''
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.seconds_per_byte = 0
+        self.seconds_per_file = 0
+
+    def run(self):
+        probe_path = self.directory / f".ecen423_probe_{os.getpid()}"
+        probe_path.mkdir()
+        try:
+            data = os.urandom(PROBE_FILE_BYTES)
+            start_time = time.monotonic()
+            with open(probe_path / "large", "wb") as fp:
+                fp.write(data)
+                fp.flush()
+                os.fsync(fp.fileno())
+            with open(probe_path / "large", "rb") as fp:
+                fp.read()
+            self.seconds_per_byte = (time.monotonic() - start_time) / PROBE_FILE_BYTES
+            start_time = time.monotonic()
+            for index in range(PROBE_FILE_COUNT):
+                with open(probe_path / f"small{index}", "wb") as fp:
+                    fp.write(data[:512])
+            for index in range(PROBE_FILE_COUNT):
+                (probe_path / f"small{index}").unlink()
+            self.seconds_per_file = (time.monotonic() - start_time) / PROBE_FILE_COUNT
+        finally:
+            shutil.rmtree(probe_path, ignore_errors=True)
+        return self
+
+class workspace_manager():
+    ''' Places the extract directory of a passoff in a fast workspace when one is available.
+    extract_path: the extract directory given to the passoff script (where the results are copied)
+    workspace_dir: a directory to try first (i.e., --workspace_dir)
+    min_free_bytes: free space needed in the workspace '''
+    def __init__(self, extract_path, workspace_dir = None, min_free_bytes = MIN_FREE_BYTES):
+        self.extract_path = pathlib.Path(extract_path).absolute()
+        self.workspace_dir = workspace_dir or os.environ.get(WORKSPACE_DIR_ENV)
+        self.min_free_bytes = min_free_bytes
+        # The workspace (None if the extract directory is used)
+        self.path = None
+        self.kind = None
+        self.artifact_patterns = []
+        self.extract_probe = None
+        self.workspace_probe = None
+        self.removed = False
+
+    def candidates(self):
+        ''' The directories that can hold the workspace (in order of preference) '''
+        directories = [self.workspace_dir, "/dev/shm", os.environ.get("XDG_RUNTIME_DIR"), "/tmp"]
+        directories = [pathlib.Path(directory) for directory in directories if directory]
+        # RAM backed file systems first (sorted keeps the order of the directories of the same kind)
+        rank = {"ram" : 0, "local" : 1}
+        directories = [directory for directory in directories if directory.is_dir() and os.access(directory, os.W_OK)]
+        directories = [directory for directory in directories if file_system_kind(directory) in rank]
+        return sorted(directories, key=lambda directory: (directory != pathlib.Path(self.workspace_dir or ""),
+                                                         rank[file_system_kind(directory)]))
+
+    def has_space(self, directory):
+        free_bytes = shutil.disk_usage(directory).free
+        if free_bytes < self.min_free_bytes:
+            return False
+        if file_system_kind(directory) == "ram" and available_memory_bytes() < 2 * self.min_free_bytes:
+            return False
+        return True
+
+    def choose(self):
+        ''' Returns the path of the workspace (the path to use in place of the extract directory)
+        or None if the extract directory is already on the best file system available '''
+        extract_parent = existing_parent(self.extract_path.parent)
+        extract_kind = file_system_kind(extract_parent)
+        for directory in self.candidates():
+            kind = file_system_kind(directory)
+            if mount_info(directory)[0] == mount_info(extract_parent)[0]:
+                # The extract directory is on this file system already
+                return None
+            if extract_kind == "ram" or (extract_kind == "local" and kind != "ram"):
+                return None
+            if not self.has_space(directory):
+                continue
+            self.path = directory / self.extract_path.name
+            self.kind = kind
+            try:
+                self.extract_probe = io_probe(extract_parent).run()
+                self.workspace_probe = io_probe(directory).run()
+            except OSError:
+                self.extract_probe = self.workspace_probe = None
+            atexit.register(self.clean_up)
+            return self.path
+        return None
+
+    def add_artifact(self, pattern):
+        ''' Declare files (glob pattern relative to the lab directory) that are copied back '''
+        self.artifact_patterns.append(pattern)
+
+    def copy_back(self, lab_dir_name):
+        ''' Copy the artifacts and logs of the lab directory of the workspace to the extract
+        directory. Returns the list of copied files. '''
+        source_path = self.path / lab_dir_name
+        target_path = self.extract_path / lab_dir_name
+        if not source_path.is_dir():
+            return []
+        copied = []
+        for root, _, filenames in os.walk(source_path):
+            for filename in filenames:
+                relative_path = (pathlib.Path(root) / filename).relative_to(source_path)
+                # Logs are copied from the lab directory only (not the tool scratch directories)
+                is_log = relative_path.parent == pathlib.Path(".") and \
+                    any(fnmatch.fnmatch(filename, pattern) for pattern in LOG_PATTERNS)
+                is_artifact = any(fnmatch.fnmatch(str(relative_path), pattern) for pattern in self.artifact_patterns)
+                if is_log or is_artifact:
+                    (target_path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(source_path / relative_path, target_path / relative_path)
+                    copied.append(target_path / relative_path)
+        return copied
+
+    def usage(self):
+        ''' Returns the (bytes, files) in the workspace '''
+        total_bytes = 0
+        file_count = 0
+        for root, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                try:
+                    total_bytes += os.lstat(os.path.join(root, filename)).st_size
+                    file_count += 1
+                except OSError:
+                    pass
+        return total_bytes, file_count
+
+    def saved_seconds(self, total_bytes, file_count):
+        ''' Estimated I/O time saved by using the workspace rather than the extract directory '''
+        if self.extract_probe is None or self.workspace_probe is None:
+            return None
+        return total_bytes * (self.extract_probe.seconds_per_byte - self.workspace_probe.seconds_per_byte) + \
+            file_count * (self.extract_probe.seconds_per_file - self.workspace_probe.seconds_per_file)
+
+    def clean_up(self, lab_dir_name = None, print_function = print, keep_clone = False):
+        ''' Copy back the results (if lab_dir_name is given), report the I/O time saved and remove
+        the workspace (or, when keep_clone is True, only the files that are not tracked by the
+        clone in the workspace). This can be called more than once (it is also called at exit). '''
+        if self.path is None or self.removed:
+            return
+        self.removed = True
+        if lab_dir_name is not None:
+            copied = self.copy_back(lab_dir_name)
+            print_function(f"Copied {len(copied)} logs and artifacts from the workspace to {self.extract_path / lab_dir_name}")
+        total_bytes, file_count = self.usage()
+        saved_seconds = self.saved_seconds(total_bytes, file_count)
+        message = f"Workspace {self.path} ({self.kind}): {total_bytes / 1024 ** 2:.1f} MB in {file_count} files"
+        if saved_seconds is not None:
+            message += f", estimated I/O time saved compared to {self.extract_path.parent}: {saved_seconds:.1f}s"
+        print_function(message)
+        if keep_clone and (self.path / ".git").is_dir():
+            proc = subprocess.run(["git", "clean", "-q", "-ffdx"], cwd=self.path,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if proc.returncode == 0:
+                print_function(f"Clone kept in the workspace for the next passoff: {self.usage()[0] / 1024 ** 2:.1f} MB")
+                return
+        shutil.rmtree(self.path, ignore_errors=True)